@@ -0,0 +1,99 @@
+"""
+Latency of the sync and async database modes under concurrent load.
+
+Seeds a scratch database, then for each SHS_DB_MODE starts `uvicorn main:app`
+in a subprocess and drives it with --clients concurrent HTTP clients. Each
+client issues --requests-per-client requests: GET /devices/{device_id}, plus a
+PUT of the same device for --write-ratio of the requests. Reports throughput
+and p50/p95/p99 per mode.
+
+    python -m benchmarks.bench_async_load --clients 1000
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+
+import httpx
+
+from benchmarks.common import percentiles, seed_fleet, start_uvicorn, use_scratch_database
+
+
+async def drive(base_url: str, devices, clients: int, requests_per_client: int, write_ratio: float,
+                ramp_up: float):
+    latencies = []
+    errors = 0
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as http:
+        async def client_loop():
+            nonlocal errors
+            # Spread the initial connects rather than opening every connection in the same instant
+            await asyncio.sleep(random.uniform(0, ramp_up))
+            for _ in range(requests_per_client):
+                device = random.choice(devices)
+                start = time.perf_counter()
+                try:
+                    if random.random() < write_ratio:
+                        resp = await http.put(f"/devices/{device['id']}", json={
+                            "type": device["type"], "name": "Load Test", "room_id": device["room_id"],
+                            "settings": {"brightness": random.randint(0, 100)},
+                        })
+                    else:
+                        resp = await http.get(f"/devices/{device['id']}")
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - start)
+                if resp.status_code != 200:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop() for _ in range(clients)))
+        elapsed = time.perf_counter() - start
+
+    # Throughput counts completed requests over the whole run, ramp-up included
+    return {"requests": len(latencies), "errors": errors,
+            "requests_per_s": round(len(latencies) / elapsed), **percentiles(latencies)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--requests-per-client", type=int, default=20)
+    parser.add_argument("--write-ratio", type=float, default=0.1)
+    parser.add_argument("--devices", type=int, default=10_000)
+    parser.add_argument("--ramp-up", type=float, default=2.0, help="seconds over which clients start")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--modes", default="sync,async")
+    args = parser.parse_args()
+
+    use_scratch_database("async_load")
+    from sqlalchemy import create_engine
+    from shs_api import migrations
+    from shs_api.database import SQLALCHEMY_DATABASE_URL
+
+    seed_engine = create_engine(SQLALCHEMY_DATABASE_URL)
+    migrations.upgrade(seed_engine)
+    seed_fleet(seed_engine, houses=max(1, args.devices // 30), rooms_per_house=6, devices_per_room=5)
+    with seed_engine.connect() as conn:
+        devices = [dict(row._mapping) for row in conn.exec_driver_sql("SELECT id, type, room_id FROM devices")]
+    seed_engine.dispose()
+
+    results = {}
+    for mode in args.modes.split(","):
+        server = start_uvicorn(args.port, {"SHS_DB_MODE": mode})
+        try:
+            results[mode] = asyncio.run(drive(
+                f"http://127.0.0.1:{args.port}", devices, args.clients, args.requests_per_client,
+                args.write_ratio, args.ramp_up,
+            ))
+        finally:
+            server.terminate()
+            server.wait()
+    print(json.dumps({"clients": args.clients, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
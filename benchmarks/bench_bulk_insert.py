@@ -0,0 +1,77 @@
+"""
+Throughput of the bulk create handlers.
+
+Creates --rows devices through the POST /devices/bulk handler in batches of
+--batch-size and reports rows/s. Request bodies are parsed into
+schemas.DeviceCreate up front, so the figure covers validation through
+DeviceAPI.create_device plus the batched INSERT and commit, not JSON decoding.
+The single-row POST /devices/ handler is timed on a smaller sample for comparison.
+
+    python -m benchmarks.bench_bulk_insert --rows 200000 --batch-size 500
+"""
+import argparse
+import json
+import time
+
+from benchmarks.common import seed_fleet, use_scratch_database
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--single-rows", type=int, default=2_000)
+    args = parser.parse_args()
+
+    use_scratch_database("bulk_insert")
+    import main as app_main  # noqa: E402  (reads SHS_DATABASE_URL on import)
+    from shs_api import schemas
+    from shs_api.database import SessionLocal, engine
+
+    app_main.migrations.upgrade(engine)
+
+    room_ids = seed_fleet(engine, houses=10, rooms_per_house=10, devices_per_room=0)["rooms"]
+    batches = []
+    for start in range(0, args.rows, args.batch_size):
+        batches.append([
+            schemas.DeviceCreate(
+                type="light", name=f"Light {i}", room_id=room_ids[i % len(room_ids)], settings={"brightness": 50}
+            )
+            for i in range(start, min(args.rows, start + args.batch_size))
+        ])
+
+    db = SessionLocal()
+    try:
+        start = time.perf_counter()
+        for batch in batches:
+            app_main.create_devices_bulk(batch, db)
+        bulk_elapsed = time.perf_counter() - start
+
+        singles = [
+            schemas.DeviceCreate(type="light", name=f"Single {i}", room_id=room_ids[0], settings={})
+            for i in range(args.single_rows)
+        ]
+        start = time.perf_counter()
+        for device in singles:
+            app_main.create_device(device, db)
+        single_elapsed = time.perf_counter() - start
+    finally:
+        db.close()
+
+    print(json.dumps({
+        "bulk": {
+            "rows": args.rows,
+            "batch_size": args.batch_size,
+            "seconds": round(bulk_elapsed, 3),
+            "rows_per_s": round(args.rows / bulk_elapsed),
+        },
+        "single": {
+            "rows": args.single_rows,
+            "seconds": round(single_elapsed, 3),
+            "rows_per_s": round(args.single_rows / single_elapsed),
+        },
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
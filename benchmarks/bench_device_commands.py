@@ -0,0 +1,55 @@
+"""
+Latency of house-wide device commands ("scenes").
+
+Seeds one house with --rooms rooms of --devices-per-room devices, then times
+the POST /houses/{house_id}/commands handler toggling every light off and on
+(status plus a settings merge patch) and switching every device off, and
+reports the number of affected devices and the latency percentiles.
+
+    python -m benchmarks.bench_device_commands --rooms 30 --devices-per-room 10
+"""
+import argparse
+import json
+
+from benchmarks.common import percentiles, seed_fleet, time_calls, use_scratch_database
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rooms", type=int, default=30)
+    parser.add_argument("--devices-per-room", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    use_scratch_database("device_commands")
+    import main as app_main  # noqa: E402  (reads SHS_DATABASE_URL on import)
+    from shs_api import schemas
+    from shs_api.database import SessionLocal, engine
+
+    app_main.migrations.upgrade(engine)
+    fleet = seed_fleet(engine, houses=1, rooms_per_house=args.rooms, devices_per_room=args.devices_per_room)
+    house_id = fleet["houses"][0]
+
+    lights_off = schemas.DeviceCommand(filter={"type": "light"}, status=False, settings={"brightness": 0})
+    lights_on = schemas.DeviceCommand(filter={"type": "light"}, status=True, settings={"brightness": 80})
+    all_off = schemas.DeviceCommand(status=False)
+
+    db = SessionLocal()
+    try:
+        lights = len(app_main.command_house_devices(house_id, lights_off, db)["affected_ids"])
+        devices = len(app_main.command_house_devices(house_id, all_off, db)["affected_ids"])
+        toggles = time_calls(app_main.command_house_devices,
+                             [(house_id, cmd, db) for cmd in (lights_off, lights_on)] * (args.repeat // 2))
+        everything = time_calls(app_main.command_house_devices, [(house_id, all_off, db)] * args.repeat)
+    finally:
+        db.close()
+
+    print(json.dumps({
+        "devices": devices,
+        "lights_toggle": {"affected": lights, **percentiles(toggles)},
+        "all_off": {"affected": devices, **percentiles(everything)},
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Latency of device status writes and reads.
+
+Seeds --devices devices and times --writes status changes through the
+POST /devices/{device_id}/status handler (hot-state store plus its append-only
+log, with SHS_HOTSTATE_SYNC=normal and =full), the same changes as one UPDATE
+and commit per change against the devices table, status reads through
+GET /devices/{device_id}/status, and one writeback of everything dirtied.
+
+    python -m benchmarks.bench_device_status --devices 1000 --writes 5000
+"""
+import argparse
+import json
+import os
+import random
+import time
+
+from benchmarks.common import percentiles, seed_fleet, time_calls, use_scratch_database
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, default=1_000)
+    parser.add_argument("--writes", type=int, default=5_000)
+    args = parser.parse_args()
+
+    db_path = use_scratch_database("device_status")
+    import main as app_main  # noqa: E402  (reads SHS_DATABASE_URL on import)
+    from shs_api import hotstate, schemas
+    from shs_api.database import SessionLocal, engine
+
+    app_main.migrations.upgrade(engine)
+    device_ids = seed_fleet(engine, houses=max(1, args.devices // 10), rooms_per_house=2, devices_per_room=5)["devices"]
+    rng = random.Random(7)
+    changes = [(rng.choice(device_ids), schemas.DeviceStatusUpdate(status=bool(i % 2), data={"level": i % 100}))
+               for i in range(args.writes)]
+
+    results = {"devices": len(device_ids), "writes": args.writes}
+    db = SessionLocal()
+    try:
+        for mode in ("normal", "full"):
+            hotstate.store = hotstate.HotStateStore(log_path=f"{db_path}-{mode}.log", sync_mode=mode,
+                                                    writeback_interval=0)
+            samples = time_calls(app_main.set_device_status, [(device_id, change, db) for device_id, change in changes])
+            results[f"hot_state_{mode}"] = percentiles(samples)
+            if mode == "normal":
+                hotstate.store.close()
+
+        reads = time_calls(app_main.get_device_status, [(device_id, db) for device_id, _ in changes])
+        results["status_reads"] = percentiles(reads)
+
+        start = time.perf_counter()
+        written = hotstate.store.writeback()
+        results["writeback"] = {"devices": written, "seconds": round(time.perf_counter() - start, 4)}
+        hotstate.store.close()
+
+        def sql_update(device_id, change):
+            db.execute(app_main.update(app_main.models.Device)
+                       .where(app_main.models.Device.id == device_id)
+                       .values(status=change.status, last_data=change.data))
+            db.commit()
+
+        results["sql_update_per_change"] = percentiles(time_calls(sql_update, changes))
+    finally:
+        db.close()
+        for mode in ("normal", "full"):
+            if os.path.exists(f"{db_path}-{mode}.log"):
+                os.remove(f"{db_path}-{mode}.log")
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
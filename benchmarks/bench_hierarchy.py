@@ -0,0 +1,69 @@
+"""
+Latency of the hierarchy endpoints on a large fleet.
+
+Seeds a scratch database (1M devices by default) and times the handlers behind
+GET /houses/{house_id}/devices, /houses/{house_id}/rooms and
+/rooms/{room_id}/devices against random parents, reporting the SQLite query
+plan and latency percentiles for each.
+
+    python -m benchmarks.bench_hierarchy --devices 1000000
+"""
+import argparse
+import json
+import random
+import time
+
+from benchmarks.common import percentiles, seed_fleet, time_calls, use_scratch_database
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, default=1_000_000)
+    parser.add_argument("--rooms-per-house", type=int, default=6)
+    parser.add_argument("--devices-per-room", type=int, default=5)
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    use_scratch_database("hierarchy")
+    import main as app_main  # noqa: E402  (reads SHS_DATABASE_URL on import)
+    from shs_api.database import SessionLocal, engine
+
+    app_main.migrations.upgrade(engine)
+
+    houses = max(1, args.devices // (args.rooms_per_house * args.devices_per_room))
+    start = time.perf_counter()
+    fleet = seed_fleet(engine, houses, args.rooms_per_house, args.devices_per_room)
+    print(f"seeded {len(fleet['devices'])} devices in {len(fleet['houses'])} houses "
+          f"in {time.perf_counter() - start:.1f}s")
+
+    with engine.connect() as conn:
+        plan = conn.exec_driver_sql(
+            "EXPLAIN QUERY PLAN SELECT devices.* FROM devices "
+            "JOIN rooms ON devices.room_id = rooms.id WHERE rooms.house_id = ?",
+            (fleet["houses"][0],),
+        ).fetchall()
+    print("house devices plan:", "; ".join(row[-1] for row in plan))
+
+    cases = {
+        "GET /houses/{house_id}/devices": (app_main.list_house_devices, fleet["houses"]),
+        "GET /houses/{house_id}/rooms": (app_main.list_house_rooms, fleet["houses"]),
+        "GET /rooms/{room_id}/devices": (app_main.list_room_devices, fleet["rooms"]),
+    }
+    results = {}
+    db = SessionLocal()
+    try:
+        for name, (handler, parent_ids) in cases.items():
+            picks = [(random.choice(parent_ids), db) for _ in range(args.iterations)]
+
+            def call(parent_id, session, handler=handler):
+                handler(parent_id, session)
+                session.expunge_all()  # keep the identity map from turning later calls into cache hits
+
+            results[name] = percentiles(time_calls(call, picks))
+    finally:
+        db.close()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""
+Per-route throughput and latency of realistic traffic mixes.
+
+Seeds a fleet of --houses houses x --rooms-per-house rooms x
+--devices-per-room devices, starts `uvicorn main:app` in a subprocess and,
+for each mix in --mixes, runs --clients concurrent HTTP clients for
+--duration seconds:
+
+    polling     dashboards and apps: device status and details, room and
+                house device lists, house stats (read-only)
+    telemetry   gateways: readings per device, NDJSON batch uploads and
+                status changes
+    onboarding  installers: a house, then its rooms and devices in bulk
+
+Prints (and with --output writes) JSON with throughput, error count and
+p50/p95/p99 per route and mix. With --baseline, the run is compared with a
+previous --output file and exits with status 1 if any route's p95 grew, or
+its throughput fell, by more than --max-regression (a fraction).
+
+    python -m benchmarks.bench_load_mix --output baseline.json
+    python -m benchmarks.bench_load_mix --baseline baseline.json --max-regression 0.2
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, List
+
+import httpx
+
+from benchmarks.common import percentiles, seed_fleet, start_uvicorn, use_scratch_database
+
+DEVICE_TYPES = ["light", "thermostat", "security camera", "door lock", "other"]
+
+
+def reading(device_id: str = None) -> dict:
+    item = {"ts": datetime.now(timezone.utc).isoformat(),
+            "data": {"temperature": round(random.uniform(15, 30), 2), "battery": random.randint(0, 100)}}
+    if device_id is not None:
+        item["device_id"] = device_id
+    return item
+
+
+# Each operation issues one or more requests through `call`, labelled by route template
+async def poll_device_status(call, fleet, args):
+    await call("GET", "/devices/{device_id}/status", f"/devices/{random.choice(fleet['devices'])}/status")
+
+
+async def poll_device(call, fleet, args):
+    await call("GET", "/devices/{device_id}", f"/devices/{random.choice(fleet['devices'])}")
+
+
+async def poll_room_devices(call, fleet, args):
+    await call("GET", "/rooms/{room_id}/devices", f"/rooms/{random.choice(fleet['rooms'])}/devices")
+
+
+async def poll_house_devices(call, fleet, args):
+    await call("GET", "/houses/{house_id}/devices", f"/houses/{random.choice(fleet['houses'])}/devices")
+
+
+async def poll_house_stats(call, fleet, args):
+    await call("GET", "/houses/{house_id}/stats", f"/houses/{random.choice(fleet['houses'])}/stats")
+
+
+async def send_readings(call, fleet, args):
+    device_id = random.choice(fleet["devices"])
+    await call("POST", "/devices/{device_id}/telemetry", f"/devices/{device_id}/telemetry",
+               json=[reading() for _ in range(args.readings_per_request)])
+
+
+async def upload_batch(call, fleet, args):
+    body = "\n".join(json.dumps(reading(random.choice(fleet["devices"]))) for _ in range(args.batch_readings))
+    await call("POST", "/telemetry/batch", "/telemetry/batch", content=body,
+               headers={"Content-Type": "application/x-ndjson"})
+
+
+async def set_status(call, fleet, args):
+    await call("POST", "/devices/{device_id}/status", f"/devices/{random.choice(fleet['devices'])}/status",
+               json={"status": random.random() < 0.5})
+
+
+async def onboard_house(call, fleet, args):
+    house = await call("POST", "/houses/", "/houses/", json={
+        "name": "Onboarded House", "address": "1 Load Test Way",
+        "latitude": random.uniform(-60, 60), "longitude": random.uniform(-180, 180),
+        "owner_ids": [str(uuid.uuid4())], "occupant_count": 2,
+    })
+    if house is None:
+        return
+    rooms = await call("POST", "/rooms/bulk", "/rooms/bulk", json=[
+        {"name": f"Room {r}", "floor": r % 3, "size": 20.0, "house_id": house["id"], "type": "bedroom"}
+        for r in range(args.rooms_per_house)
+    ])
+    if rooms is None:
+        return
+    await call("POST", "/devices/bulk", "/devices/bulk", json=[
+        {"type": DEVICE_TYPES[d % len(DEVICE_TYPES)], "name": f"Device {d}", "room_id": room_id, "settings": {}}
+        for room_id in rooms["created_ids"] for d in range(args.devices_per_room)
+    ])
+
+
+# (weight, operation) per mix
+MIXES = {
+    "polling": [
+        (50, poll_device_status), (20, poll_device), (10, poll_room_devices),
+        (10, poll_house_devices), (10, poll_house_stats),
+    ],
+    "telemetry": [(70, send_readings), (10, upload_batch), (20, set_status)],
+    "onboarding": [(1, onboard_house)],
+}
+
+
+async def run_mix(base_url: str, mix: str, fleet, args) -> dict:
+    weights, operations = zip(*MIXES[mix])
+    samples: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    limits = httpx.Limits(max_connections=args.clients, max_keepalive_connections=args.clients)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=120) as http:
+        async def call(method: str, route: str, url: str, **kwargs):
+            label = f"{method} {route}"
+            start = time.perf_counter()
+            try:
+                resp = await http.request(method, url, **kwargs)
+            except httpx.HTTPError:
+                errors[label] += 1
+                return None
+            samples[label].append(time.perf_counter() - start)
+            if resp.status_code != 200:
+                errors[label] += 1
+                return None
+            return resp.json()
+
+        async def client_loop(deadline: float):
+            while time.perf_counter() < deadline:
+                await random.choices(operations, weights)[0](call, fleet, args)
+
+        await asyncio.gather(*(client_loop(time.perf_counter() + args.warmup) for _ in range(args.clients)))
+        samples.clear()
+        errors.clear()
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop(start + args.duration) for _ in range(args.clients)))
+        elapsed = time.perf_counter() - start
+
+    routes = {
+        label: {"requests": len(samples[label]), "errors": errors[label],
+                "requests_per_s": round(len(samples[label]) / elapsed, 1), **percentiles(samples[label])}
+        for label in sorted(set(samples) | set(errors))
+    }
+    everything = [sample for route_samples in samples.values() for sample in route_samples]
+    total = {"requests": len(everything), "errors": sum(errors.values()),
+             "requests_per_s": round(len(everything) / elapsed, 1), **percentiles(everything)}
+    return {"routes": routes, "total": total}
+
+
+def compare(baseline: dict, current: dict, max_regression: float) -> List[str]:
+    """Routes whose p95 grew, or throughput fell, by more than `max_regression` against `baseline`."""
+    regressions = []
+    for mix, result in current["mixes"].items():
+        for label, now in result["routes"].items():
+            before = baseline.get("mixes", {}).get(mix, {}).get("routes", {}).get(label)
+            if before is None:
+                continue
+            if before["p95_ms"] > 0 and now["p95_ms"] > before["p95_ms"] * (1 + max_regression):
+                regressions.append(f"{mix} {label}: p95 {before['p95_ms']} -> {now['p95_ms']} ms")
+            if now["requests_per_s"] < before["requests_per_s"] * (1 - max_regression):
+                regressions.append(
+                    f"{mix} {label}: throughput {before['requests_per_s']} -> {now['requests_per_s']} req/s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--houses", type=int, default=1_000)
+    parser.add_argument("--rooms-per-house", type=int, default=6)
+    parser.add_argument("--devices-per-room", type=int, default=5)
+    parser.add_argument("--mixes", default=",".join(MIXES))
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=20.0, help="measured seconds per mix")
+    parser.add_argument("--warmup", type=float, default=3.0, help="unmeasured seconds before each mix")
+    parser.add_argument("--readings-per-request", type=int, default=10)
+    parser.add_argument("--batch-readings", type=int, default=500, help="readings per NDJSON batch upload")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    parser.add_argument("--baseline", help="JSON report of an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    args = parser.parse_args()
+    unknown = set(args.mixes.split(",")) - set(MIXES)
+    if unknown:
+        parser.error(f"unknown mixes: {', '.join(sorted(unknown))} (expected some of {', '.join(MIXES)})")
+
+    use_scratch_database("load_mix")
+    from sqlalchemy import create_engine
+    from shs_api import migrations
+    from shs_api.database import SQLALCHEMY_DATABASE_URL
+
+    seed_engine = create_engine(SQLALCHEMY_DATABASE_URL)
+    migrations.upgrade(seed_engine)
+    fleet = seed_fleet(seed_engine, args.houses, args.rooms_per_house, args.devices_per_room)
+    seed_engine.dispose()
+
+    report = {
+        "config": {key: getattr(args, key) for key in (
+            "houses", "rooms_per_house", "devices_per_room", "clients", "duration", "warmup",
+            "readings_per_request", "batch_readings")},
+        "mixes": {},
+    }
+    server = start_uvicorn(args.port)
+    try:
+        for mix in args.mixes.split(","):
+            report["mixes"][mix] = asyncio.run(run_mix(f"http://127.0.0.1:{args.port}", mix, fleet, args))
+    finally:
+        server.terminate()
+        server.wait()
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(json.load(f), report, args.max_regression)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
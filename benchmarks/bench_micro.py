@@ -0,0 +1,191 @@
+"""
+Micro-benchmarks of the per-request CPU work outside the database.
+
+Times, in-process and without HTTP or SQL:
+
+    domain      UserAPI.create_user, HouseAPI.create_house, RoomAPI.create_room
+                and DeviceAPI.create_device (validation, uuid4, timestamps)
+    serialize   ORM row -> schemas.*Response payload, as cache.to_payload
+                does for every GET-by-id miss
+    models      construction of models.User / House / Room / Device
+    asgi        a minimal ASGI app, bare and wrapped in metrics.MetricsMiddleware;
+                the difference is reported as metrics_middleware_overhead_ns,
+                and the run fails when it exceeds MIDDLEWARE_BUDGET_NS
+
+For each operation the timeit-style loop reports the best of --repeat runs
+of at least --min-time seconds as ops/s and ns/op, and tracemalloc reports
+per operation the memory blocks and bytes still held by its result and the
+peak allocated while it ran. Compare runs with --output / --baseline to see
+what changes such as __slots__ or cached validators buy.
+
+    python -m benchmarks.bench_micro --output micro.json
+    python -m benchmarks.bench_micro --filter serialize --baseline micro.json
+"""
+import argparse
+import json
+import sys
+import timeit
+import tracemalloc
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Tuple
+
+from benchmarks.common import use_scratch_database
+
+ALLOCATION_SAMPLES = 200  # Results kept alive per allocation measurement
+MIDDLEWARE_BUDGET_NS = 5000  # Per-request overhead allowed for MetricsMiddleware
+
+
+def _drive(coroutine):
+    """Run a coroutine that never suspends to completion, without an event loop."""
+    try:
+        coroutine.send(None)
+    except StopIteration:
+        return
+    raise RuntimeError("the coroutine suspended")
+
+
+async def _receive():
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+
+async def _send(message):
+    pass
+
+
+async def _bare_app(scope, receive, send):
+    await receive()
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"{}"})
+
+
+def build_cases() -> List[Tuple[str, Callable[[], object]]]:
+    from shs_api import models, schemas
+    from shs_api.cache import to_payload
+    from shs_api.metrics import Metrics, MetricsMiddleware
+    from shs_api.shs_api import (
+        DeviceAPI, DeviceType, HouseAPI, Location, RoomAPI, RoomType, UserAPI, UserPrivilege,
+    )
+
+    now = datetime(2026, 1, 1, 12, 0, 0)
+    location = Location(42.35, -71.06)
+    user = models.User(id="u1", name="Alice Smith", username="alice", phone_number="5551234567",
+                       email="alice@example.com", privilege="regular", created_at=now, updated_at=now, version=1)
+    house = models.House(id="h1", name="Main House", address="1 Main St", latitude=42.35, longitude=-71.06,
+                         geohash="drt2yzr9wd", owner_ids=["u1", "u2"], occupant_count=3,
+                         created_at=now, updated_at=now, version=1)
+    room = models.Room(id="r1", name="Kitchen", floor=0, size=18.5, house_id="h1", type="kitchen",
+                       created_at=now, updated_at=now, version=1)
+    device = models.Device(id="d1", type="thermostat", name="Hall Thermostat", room_id="r1",
+                           settings={"target": 21.5, "mode": "heat"}, status=True,
+                           last_data={"temperature": 20.9}, last_updated=now,
+                           created_at=now, updated_at=now, version=1)
+    # The route is set by the router inside the app; set up front, it is what the middleware reads when done
+    scope = {"type": "http", "method": "GET", "route": SimpleNamespace(path="/devices/{device_id}/status")}
+    middleware = MetricsMiddleware(_bare_app, Metrics())
+
+    return [
+        ("domain.create_user", lambda: UserAPI.create_user(
+            "Alice Smith", "alice", "5551234567", "alice@example.com", UserPrivilege.REGULAR)),
+        ("domain.create_house", lambda: HouseAPI.create_house(
+            "Main House", "1 Main St", location, ["u1", "u2"], 3)),
+        ("domain.create_room", lambda: RoomAPI.create_room("Kitchen", 0, 18.5, "h1", RoomType.KITCHEN)),
+        ("domain.create_device", lambda: DeviceAPI.create_device(DeviceType.THERMOSTAT, "Hall Thermostat", "r1")),
+        ("serialize.user", lambda: to_payload(schemas.UserResponse, user)),
+        ("serialize.house", lambda: to_payload(schemas.HouseResponse, house)),
+        ("serialize.room", lambda: to_payload(schemas.RoomResponse, room)),
+        ("serialize.device", lambda: to_payload(schemas.DeviceResponse, device)),
+        ("models.user", lambda: models.User(
+            id="u1", name="Alice Smith", username="alice", phone_number="5551234567",
+            email="alice@example.com", privilege="regular")),
+        ("models.house", lambda: models.House(
+            id="h1", name="Main House", address="1 Main St", latitude=42.35, longitude=-71.06,
+            geohash="drt2yzr9wd", owner_ids=["u1", "u2"], occupant_count=3)),
+        ("models.room", lambda: models.Room(
+            id="r1", name="Kitchen", floor=0, size=18.5, house_id="h1", type="kitchen")),
+        ("models.device", lambda: models.Device(
+            id="d1", type="thermostat", name="Hall Thermostat", room_id="r1", settings={}, status=False,
+            last_data={})),
+        ("asgi.bare", lambda: _drive(_bare_app(scope, _receive, _send))),
+        ("asgi.metrics_middleware", lambda: _drive(middleware(scope, _receive, _send))),
+    ]
+
+
+def time_operation(fn: Callable[[], object], min_time: float, repeat: int) -> Dict[str, float]:
+    timer = timeit.Timer(fn)
+    number, elapsed = timer.autorange()
+    number = max(1, int(number * min_time / max(elapsed, 1e-9)))
+    best = min(timer.repeat(repeat=repeat, number=number)) / number
+    return {"ops_per_s": round(1 / best), "ns_per_op": round(best * 1e9, 1)}
+
+
+def allocations(fn: Callable[[], object]) -> Dict[str, float]:
+    """Blocks and bytes held by each result, and the peak allocated during one call."""
+    fn()  # Warm caches (validators, lazy imports) out of the measurement
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+        baseline = tracemalloc.take_snapshot()
+        kept = [fn() for _ in range(ALLOCATION_SAMPLES)]
+        diff = tracemalloc.take_snapshot().compare_to(baseline, "filename")
+        del kept
+    finally:
+        tracemalloc.stop()
+    return {
+        "blocks_per_op": round(sum(stat.count_diff for stat in diff) / ALLOCATION_SAMPLES, 1),
+        "bytes_per_op": round(sum(stat.size_diff for stat in diff) / ALLOCATION_SAMPLES),
+        "peak_bytes": peak - before,
+    }
+
+
+def compare(baseline: dict, current: dict, max_regression: float) -> List[str]:
+    """Operations whose ops/s fell by more than `max_regression` against `baseline`."""
+    regressions = []
+    for name, now in current["operations"].items():
+        before = baseline.get("operations", {}).get(name)
+        if before and now["ops_per_s"] < before["ops_per_s"] * (1 - max_regression):
+            regressions.append(f"{name}: {before['ops_per_s']} -> {now['ops_per_s']} ops/s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filter", default="", help="only operations whose name contains this")
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per timing run")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    parser.add_argument("--baseline", help="JSON report of an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.1)
+    args = parser.parse_args()
+
+    use_scratch_database("micro")  # Nothing is written, but never point the models at ./smart_home.db
+    report = {"python": sys.version.split()[0], "operations": {}}
+    for name, fn in build_cases():
+        if args.filter in name:
+            report["operations"][name] = {**time_operation(fn, args.min_time, args.repeat), **allocations(fn)}
+    asgi = [report["operations"].get(name) for name in ("asgi.bare", "asgi.metrics_middleware")]
+    if all(asgi):
+        report["metrics_middleware_overhead_ns"] = round(asgi[1]["ns_per_op"] - asgi[0]["ns_per_op"], 1)
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    regressions = []
+    if report.get("metrics_middleware_overhead_ns", 0) > MIDDLEWARE_BUDGET_NS:
+        regressions.append(f"metrics middleware: {report['metrics_middleware_overhead_ns']} ns per request "
+                           f"(budget {MIDDLEWARE_BUDGET_NS})")
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions += compare(json.load(f), report, args.max_regression)
+    for regression in regressions:
+        print(f"REGRESSION {regression}", file=sys.stderr)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
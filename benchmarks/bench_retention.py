@@ -0,0 +1,86 @@
+"""
+Foreground write latency while the telemetry compactor runs.
+
+Seeds --devices lights with --readings-per-device expired readings each, then
+runs retention.compact() on one thread while another keeps ingesting fresh
+readings in small commits through telemetry.ingest(). Reports the compaction
+report and the write-latency percentiles measured before and during it.
+
+    python -m benchmarks.bench_retention --devices 200 --readings-per-device 5000
+"""
+import argparse
+import json
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.common import percentiles, seed_fleet, use_scratch_database
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, default=200)
+    parser.add_argument("--readings-per-device", type=int, default=5_000)
+    parser.add_argument("--batch-size", type=int, default=5_000)
+    parser.add_argument("--baseline-seconds", type=float, default=3.0)
+    args = parser.parse_args()
+
+    use_scratch_database("retention")
+    import main as app_main  # noqa: E402  (reads SHS_DATABASE_URL on import)
+    from shs_api import retention, telemetry
+    from shs_api.database import SessionLocal, engine
+
+    app_main.migrations.upgrade(engine)
+    device_ids = seed_fleet(engine, houses=max(1, args.devices // 5), rooms_per_house=1, devices_per_room=5)["devices"]
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    expired = now - timedelta(days=400)
+
+    db = SessionLocal()
+    try:
+        for device_id in device_ids:
+            telemetry.ingest(db, (
+                (device_id, expired + timedelta(seconds=i), {"brightness": i % 100})
+                for i in range(args.readings_per_device)
+            ))
+            db.commit()
+    finally:
+        db.close()
+
+    def write_loop(stop: threading.Event, samples: list):
+        session = SessionLocal()
+        try:
+            i = 0
+            while not stop.is_set():
+                start = time.perf_counter()
+                telemetry.ingest(session, [(device_ids[i % len(device_ids)], None, {"brightness": 50})] * 10)
+                session.commit()
+                samples.append(time.perf_counter() - start)
+                i += 1
+        finally:
+            session.close()
+
+    baseline, during = [], []
+    stop = threading.Event()
+    writer = threading.Thread(target=write_loop, args=(stop, baseline))
+    writer.start()
+    time.sleep(args.baseline_seconds)
+    stop.set()
+    writer.join()
+
+    stop = threading.Event()
+    writer = threading.Thread(target=write_loop, args=(stop, during))
+    writer.start()
+    report = retention.compact(engine, batch_size=args.batch_size)
+    stop.set()
+    writer.join()
+
+    print(json.dumps({
+        "expired_readings": args.devices * args.readings_per_device,
+        "compaction": report,
+        "writes_before": {"commits": len(baseline), **percentiles(baseline)},
+        "writes_during": {"commits": len(during), **percentiles(during)},
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Mixed read/write throughput with and without the SQLite pragma profile.
+
+For each profile in --profiles, seeds a fresh scratch database and runs
+--readers threads doing GET-by-id style lookups against --writers threads
+doing update-and-commit, for --seconds. Reports reads/s, writes/s and
+"database is locked" errors per profile.
+
+    python -m benchmarks.bench_sqlite_pragmas --readers 8 --writers 2
+"""
+import argparse
+import json
+import random
+import threading
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
+
+from benchmarks.common import seed_fleet, use_scratch_database
+
+
+def run_profile(profile: str, args) -> dict:
+    use_scratch_database(f"pragmas_{profile}")
+    from shs_api import migrations, models
+    from shs_api.database import apply_sqlite_pragmas, sqlite_pragmas
+    import os
+
+    engine = create_engine(
+        os.environ["SHS_DATABASE_URL"], connect_args={"check_same_thread": False},
+        poolclass=QueuePool, pool_size=args.readers + args.writers, max_overflow=-1,
+    )
+    apply_sqlite_pragmas(engine, sqlite_pragmas(profile, ""))
+    migrations.upgrade(engine)
+    device_ids = seed_fleet(engine, houses=max(1, args.devices // 30), rooms_per_house=6, devices_per_room=5)["devices"]
+    Session = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    counts = {"reads": 0, "writes": 0, "locked_errors": 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.seconds
+
+    def reader():
+        done = 0
+        while time.perf_counter() < deadline:
+            db = Session()
+            try:
+                db.query(models.Device).filter(models.Device.id == random.choice(device_ids)).first()
+                done += 1
+            except OperationalError:
+                with lock:
+                    counts["locked_errors"] += 1
+            finally:
+                db.close()
+        with lock:
+            counts["reads"] += done
+
+    def writer():
+        done = 0
+        while time.perf_counter() < deadline:
+            db = Session()
+            try:
+                device = db.query(models.Device).filter(models.Device.id == random.choice(device_ids)).first()
+                device.settings = {"brightness": random.randint(0, 100)}
+                db.commit()
+                done += 1
+            except OperationalError:
+                db.rollback()
+                with lock:
+                    counts["locked_errors"] += 1
+            finally:
+                db.close()
+        with lock:
+            counts["writes"] += done
+
+    threads = [threading.Thread(target=reader) for _ in range(args.readers)]
+    threads += [threading.Thread(target=writer) for _ in range(args.writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    engine.dispose()
+
+    return {
+        "reads_per_s": round(counts["reads"] / args.seconds),
+        "writes_per_s": round(counts["writes"] / args.seconds),
+        "locked_errors": counts["locked_errors"],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profiles", default="default,production")
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--devices", type=int, default=100_000)
+    args = parser.parse_args()
+
+    results = {profile: run_profile(profile, args) for profile in args.profiles.split(",")}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Throughput of telemetry ingestion.
+
+Seeds --devices devices, then appends --readings readings through the
+POST /devices/{device_id}/telemetry handler in requests of --batch-size
+readings spread round-robin over the devices, and reports readings/s. Request
+bodies are parsed into schemas.TelemetryReadingIn up front, so the figure
+covers the insert, the latest-reading projection and the commit. The
+telemetry.ingest() path on its own is timed as well, with one commit per
+--batch-size readings across many devices, and so is a single NDJSON upload
+of --readings readings to POST /telemetry/batch (JSON decoding, validation
+and the streamed transactions included).
+
+    python -m benchmarks.bench_telemetry_ingest --readings 500000 --batch-size 5000
+"""
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.common import seed_fleet, use_scratch_database
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--readings", type=int, default=500_000)
+    parser.add_argument("--batch-size", type=int, default=5_000)
+    parser.add_argument("--devices", type=int, default=1_000)
+    args = parser.parse_args()
+
+    use_scratch_database("telemetry_ingest")
+    import main as app_main  # noqa: E402  (reads SHS_DATABASE_URL on import)
+    from fastapi.testclient import TestClient
+    from shs_api import schemas, telemetry
+    from shs_api.database import SessionLocal, engine
+
+    app_main.migrations.upgrade(engine)
+    device_ids = seed_fleet(engine, houses=max(1, args.devices // 10), rooms_per_house=2, devices_per_room=5)["devices"]
+    base = datetime(2026, 1, 1)
+
+    requests = []
+    for start in range(0, args.readings, args.batch_size):
+        device_id = device_ids[(start // args.batch_size) % len(device_ids)]
+        requests.append((device_id, [
+            schemas.TelemetryReadingIn(ts=base + timedelta(seconds=i), data={"temperature": 20 + i % 50 / 10})
+            for i in range(start, min(args.readings, start + args.batch_size))
+        ]))
+
+    db = SessionLocal()
+    try:
+        start = time.perf_counter()
+        for device_id, readings in requests:
+            app_main.ingest_device_telemetry(device_id, readings, db)
+        endpoint_elapsed = time.perf_counter() - start
+
+        mixed = [
+            (device_ids[i % len(device_ids)], base + timedelta(days=1, seconds=i), {"temperature": 21.5})
+            for i in range(args.readings)
+        ]
+        start = time.perf_counter()
+        for offset in range(0, len(mixed), args.batch_size):
+            telemetry.ingest(db, mixed[offset:offset + args.batch_size])
+            db.commit()
+        ingest_elapsed = time.perf_counter() - start
+    finally:
+        db.close()
+
+    ndjson = "\n".join(
+        json.dumps({"device_id": device_ids[i % len(device_ids)],
+                    "ts": (base + timedelta(days=2, seconds=i)).isoformat(), "data": {"temperature": 21.5}})
+        for i in range(args.readings)
+    ).encode()
+    with TestClient(app_main.app) as client:
+        start = time.perf_counter()
+        resp = client.post("/telemetry/batch", content=ndjson, headers={"Content-Type": "application/x-ndjson"})
+        batch_elapsed = time.perf_counter() - start
+    resp.raise_for_status()
+
+    print(json.dumps({
+        "batch_size": args.batch_size,
+        "endpoint": {
+            "readings": args.readings,
+            "seconds": round(endpoint_elapsed, 3),
+            "readings_per_s": round(args.readings / endpoint_elapsed),
+        },
+        "ingest_many_devices": {
+            "readings": args.readings,
+            "devices": len(device_ids),
+            "seconds": round(ingest_elapsed, 3),
+            "readings_per_s": round(args.readings / ingest_elapsed),
+        },
+        "batch_ndjson": {
+            "readings": resp.json()["accepted"],
+            "body_mb": round(len(ndjson) / 1e6, 1),
+            "seconds": round(batch_elapsed, 3),
+            "readings_per_s": round(args.readings / batch_elapsed),
+        },
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Latency of GET /devices/{device_id}/telemetry chart queries.
+
+Ingests --days of readings every --interval seconds for one device through
+telemetry.ingest() (which maintains the rollups), then times the handler for
+a one-hour, one-day and whole-range window, comparing the resolution "auto"
+picks for --max-points against reading the raw samples of the same window.
+
+    python -m benchmarks.bench_telemetry_query --days 30 --interval 10
+"""
+import argparse
+import json
+from datetime import datetime, timedelta
+
+from benchmarks.common import percentiles, seed_fleet, time_calls, use_scratch_database
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--interval", type=int, default=10, help="seconds between readings")
+    parser.add_argument("--max-points", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    use_scratch_database("telemetry_query")
+    import main as app_main  # noqa: E402  (reads SHS_DATABASE_URL on import)
+    from shs_api import telemetry
+    from shs_api.database import SessionLocal, engine
+
+    app_main.migrations.upgrade(engine)
+    device_id = seed_fleet(engine, houses=1, rooms_per_house=1, devices_per_room=1)["devices"][0]
+    start = datetime(2026, 1, 1)
+    total = args.days * 86400 // args.interval
+
+    db = SessionLocal()
+    try:
+        for offset in range(0, total, 50_000):
+            telemetry.ingest(db, (
+                (device_id, start + timedelta(seconds=i * args.interval), {"temperature": 18 + i % 600 / 100})
+                for i in range(offset, min(total, offset + 50_000))
+            ))
+            db.commit()
+
+        results = {"readings": total}
+        for label, window in (("1h", timedelta(hours=1)), ("1d", timedelta(days=1)), ("all", timedelta(days=args.days))):
+            end = start + window
+            chosen = app_main.get_device_telemetry(device_id, start, end, "auto", args.max_points, db)
+            auto = time_calls(app_main.get_device_telemetry, [(device_id, start, end, "auto", args.max_points, db)] * args.repeat)
+            raw = time_calls(app_main.get_device_telemetry, [(device_id, start, end, "raw", 10_000, db)] * args.repeat)
+            results[label] = {
+                "auto_resolution": chosen["resolution"],
+                "auto_points": len(chosen["points"]),
+                "auto": percentiles(auto),
+                "raw_first_10k": percentiles(raw),
+            }
+    finally:
+        db.close()
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
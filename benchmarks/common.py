@@ -0,0 +1,140 @@
+"""
+Shared helpers for the benchmark scripts.
+
+Benchmarks run against a scratch SQLite file, never ./smart_home.db. Scripts
+that import `main` must call `use_scratch_database()` first, because the
+database URL is read when `shs_api.database` is imported.
+"""
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from typing import Dict, List, Optional
+
+
+def use_scratch_database(name: str) -> str:
+    """Point SHS_DATABASE_URL at a fresh file in the temp dir and return its path."""
+    path = os.path.join(tempfile.gettempdir(), f"shs_bench_{name}.db")
+    for suffix in ("", "-wal", "-shm", "-journal"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    os.environ["SHS_DATABASE_URL"] = f"sqlite:///{path}"
+    return path
+
+
+def start_uvicorn(port: int, env: Optional[Dict[str, str]] = None, timeout: float = 30.0) -> subprocess.Popen:
+    """Start `uvicorn main:app` on 127.0.0.1:`port` in a subprocess and wait until it answers."""
+    import httpx
+
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        env=dict(os.environ, **(env or {})),
+    )
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/devices/", params={"limit": 1}).status_code == 200:
+                return server
+        except httpx.TransportError:
+            pass
+        if server.poll() is not None:
+            break
+        time.sleep(0.2)
+    server.kill()
+    raise RuntimeError("uvicorn did not start")
+
+
+def seed_fleet(engine, houses: int, rooms_per_house: int, devices_per_room: int,
+               batch_size: int = 50_000) -> Dict[str, List[str]]:
+    """
+    Insert a synthetic fleet with executemany batches and return the generated ids.
+
+    Tables are expected to exist already (run migrations.upgrade first).
+    """
+    from shs_api import geo
+    from shs_api import models
+
+    house_ids = [str(uuid.uuid4()) for _ in range(houses)]
+    room_ids: List[str] = []
+    device_ids: List[str] = []
+    room_types = ["bedroom", "bathroom", "kitchen", "living room", "other"]
+    device_types = ["light", "thermostat", "security camera", "door lock", "other"]
+
+    with engine.begin() as conn:
+        house_rows = []
+        for i, house_id in enumerate(house_ids):
+            latitude, longitude = random.uniform(-60.0, 60.0), random.uniform(-180.0, 180.0)
+            house_rows.append({
+                "id": house_id,
+                "name": f"House {i}",
+                "address": f"{i} Benchmark St",
+                "latitude": latitude,
+                "longitude": longitude,
+                "geohash": geo.encode(latitude, longitude),
+                "owner_ids": [str(uuid.uuid4())],
+                "occupant_count": 2,
+            })
+        conn.execute(models.House.__table__.insert(), house_rows)
+        conn.execute(models.HouseOwner.__table__.insert(), [
+            {"user_id": row["owner_ids"][0], "house_id": row["id"]} for row in house_rows
+        ])
+
+        rooms, devices = [], []
+        for house_id in house_ids:
+            for r in range(rooms_per_house):
+                room_id = str(uuid.uuid4())
+                room_ids.append(room_id)
+                rooms.append({
+                    "id": room_id, "name": f"Room {r}", "floor": r % 3, "size": 20.0,
+                    "house_id": house_id, "type": room_types[r % len(room_types)],
+                })
+                for d in range(devices_per_room):
+                    device_id = str(uuid.uuid4())
+                    device_ids.append(device_id)
+                    devices.append({
+                        "id": device_id, "type": device_types[d % len(device_types)],
+                        "name": f"Device {d}", "room_id": room_id, "settings": {},
+                        "status": False, "last_data": {},
+                    })
+                if len(devices) >= batch_size:
+                    conn.execute(models.Room.__table__.insert(), rooms)
+                    conn.execute(models.Device.__table__.insert(), devices)
+                    rooms, devices = [], []
+        if rooms:
+            conn.execute(models.Room.__table__.insert(), rooms)
+        if devices:
+            conn.execute(models.Device.__table__.insert(), devices)
+
+    return {"houses": house_ids, "rooms": room_ids, "devices": device_ids}
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """Summarise latency samples (seconds) as p50/p95/p99/max in milliseconds."""
+    ordered = sorted(samples)
+    if not ordered:
+        return {"p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+
+    def pick(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+
+    return {
+        "p50_ms": round(pick(0.50), 4),
+        "p95_ms": round(pick(0.95), 4),
+        "p99_ms": round(pick(0.99), 4),
+        "max_ms": round(ordered[-1] * 1000, 4),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 4),
+    }
+
+
+def time_calls(fn, args_list) -> List[float]:
+    """Call fn(*args) for every entry in args_list and return per-call durations."""
+    samples = []
+    for args in args_list:
+        start = time.perf_counter()
+        fn(*args)
+        samples.append(time.perf_counter() - start)
+    return samples
@@ -1,12 +1,52 @@
-from fastapi import FastAPI, Depends, HTTPException
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import List, Optional
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, Request, Response, WebSocket
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from sqlalchemy import func, or_, text, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from shs_api.shs_api import UserAPI, UserPrivilege, HouseAPI, RoomAPI, DeviceAPI, Location, Room as ShsRoom, RoomType, DeviceType
+from shs_api.shs_api import UserAPI, UserPrivilege, HouseAPI, RoomAPI, DeviceAPI, Location, Room as ShsRoom, RoomType, DeviceType, SmartHomeError
 from shs_api import models
 from shs_api import schemas
-from shs_api.database import SessionLocal, engine
+from shs_api import cache
+from shs_api import cascade
+from shs_api import geo
+from shs_api import hotstate
+from shs_api import house_stats
+from shs_api import metrics
+from shs_api import migrations
+from shs_api import ownership
+from shs_api import pubsub
+from shs_api import retention
+from shs_api import search
+from shs_api import slowlog
+from shs_api import telemetry
+from shs_api import versioning
+from shs_api.database import ACTIVE_SQLITE_PRAGMAS, DB_MODE, SQLITE_PRAGMA_PROFILES, SQLITE_PROFILE, SessionLocal, engine
+from shs_api.pagination import (
+    CursorError, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, decode_cursor, encode_cursor, keyset_select, split_page,
+)
 
-models.Base.metadata.create_all(bind=engine)
-app = FastAPI(title="Smart Home System API")
+compactor = retention.RetentionCompactor(engine)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Bring the schema up to date when the server starts, not when main is imported
+    migrations.upgrade(engine)
+    # Telemetry retention runs in the background for the lifetime of the server
+    compactor.start()
+    # Recover device status from the hot-state log before serving requests
+    hotstate.store.ensure_loaded(engine)
+    yield
+    compactor.stop()
+    hotstate.store.close()
+
+app = FastAPI(title="Smart Home System API", lifespan=lifespan)
+app.add_middleware(metrics.MetricsMiddleware)
 
 def get_db():
     db = SessionLocal()
@@ -15,6 +55,152 @@ def get_db():
     finally:
         db.close()
 
+def _keyset_page(db: Session, model, cursor: Optional[str], limit: int, *criteria):
+    try:
+        stmt = keyset_select(model, cursor, limit, *criteria)
+    except CursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    items, next_cursor = split_page(db.execute(stmt).all(), limit)
+    return {"items": items, "next_cursor": next_cursor}
+
+def _cached_get(db: Session, entity: str, model, response_schema, entity_id: str, detail: str):
+    """
+    Serve a GET-by-id from the entity cache, loading and caching the response payload on a miss.
+    """
+    payload = cache.get(entity, entity_id)
+    if payload is None:
+        db_obj = db.query(model).filter(model.id == entity_id).first()
+        if not db_obj:
+            raise HTTPException(status_code=404, detail=detail)
+        payload = cache.to_payload(response_schema, db_obj)
+        cache.put(entity, entity_id, payload)
+    return payload
+
+def _patch_fields(patch) -> dict:
+    """The fields a merge patch actually contains, including explicit nulls."""
+    return {name: getattr(patch, name) for name in patch.model_fields_set}
+
+def _update_row(db: Session, entity: str, model, entity_id: str, changes: dict, detail: str,
+                if_match: Optional[str] = None, merge_columns=(), related=(), check=None):
+    """
+    Apply `changes` (a PUT's full set of fields or a merge patch) with one
+    compare-and-swap UPDATE ... RETURNING that sets only those columns and
+    bumps the version; with If-Match it only applies to a matching version.
+    JSON columns in `merge_columns` are merged inside SQLite with json_patch,
+    so their untouched keys are never re-serialized; null clears them. Other
+    columns cannot be removed. `check` is called with the updated row
+    before anything is committed, and rolls the update back by raising.
+    `related` statements run in the same transaction once the row has been
+    updated.
+    """
+    versions = versioning.expected_versions(if_match)
+    table = model.__table__
+    values = {}
+    for name, value in changes.items():
+        if name in merge_columns:
+            values[name] = {} if value is None else func.json_patch(table.c[name], json.dumps(value))
+        elif value is None:
+            raise HTTPException(status_code=400, detail=f"'{name}' cannot be removed")
+        else:
+            values[name] = value
+
+    if not values:
+        row = db.execute(table.select().where(table.c.id == entity_id)).mappings().first()
+        if row is None:
+            raise HTTPException(status_code=404, detail=detail)
+        if versions is not None and row["version"] not in versions:
+            versioning.missed(True, detail)
+        return dict(row)
+
+    try:
+        row = db.execute(versioning.cas_update(table, entity_id, values, versions)).mappings().first()
+    except IntegrityError:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=f"Update conflicts with an existing {entity}")
+    if row is None:
+        versioning.missed(_exists(db, model, entity_id), detail)
+    if check is not None:
+        try:
+            check(row)
+        except (SmartHomeError, ValueError) as e:
+            db.rollback()
+            raise HTTPException(status_code=400, detail=str(e))
+    for stmt in related:
+        db.execute(stmt)
+    db.commit()
+    cache.invalidate(entity, entity_id)
+    return dict(row)
+
+def _delete_row(db: Session, entity: str, model, entity_id: str, detail: str, if_match: Optional[str] = None,
+                children=()) -> dict:
+    """
+    Delete one row with a single (compare-and-swap, given If-Match) DELETE,
+    plus the set-based `children` deletes in the same transaction. Returns
+    the deleted child ids by entity.
+    """
+    versions = versioning.expected_versions(if_match)
+    if db.execute(versioning.cas_delete(model.__table__, entity_id, versions)).rowcount == 0:
+        versioning.missed(_exists(db, model, entity_id), detail)
+    removed = {child: db.execute(stmt).scalars().all() for child, stmt in children}
+    db.commit()
+    cache.invalidate(entity, entity_id)
+    cascade.forget(removed)
+    return removed
+
+def _exists(db: Session, model, entity_id: str) -> bool:
+    return db.query(model.id).filter(model.id == entity_id).first() is not None
+
+def _commit_created(db: Session, db_obj, response_schema) -> dict:
+    """
+    Flush a new row and serialize it before committing: the INSERT already
+    returned its server defaults (eager_defaults), while reading the row
+    after the commit would expire and re-SELECT it.
+    """
+    db.flush()
+    payload = cache.to_payload(response_schema, db_obj)
+    db.commit()
+    return payload
+
+def _patch_enum(changes: dict, name: str, enum_cls, detail: Optional[str] = None):
+    """Validate an enum-valued field of a patch in place, storing the enum's value."""
+    if changes.get(name) is not None:
+        try:
+            changes[name] = enum_cls(changes[name]).value
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=detail or str(e))
+
+# The checks create runs in the domain layer, applied to a whole (e.g. patched) row
+DOMAIN_CHECKS = {
+    "user": lambda row: UserAPI.create_user(row["name"], row["username"], row["phone_number"], row["email"],
+                                            UserPrivilege(row["privilege"])),
+    "house": lambda row: HouseAPI.create_house(row["name"], row["address"], Location(row["latitude"], row["longitude"]),
+                                               row["owner_ids"], row["occupant_count"]),
+    "room": lambda row: RoomAPI.create_room(row["name"], row["floor"], row["size"], row["house_id"],
+                                            RoomType(row["type"])),
+    "device": lambda row: DeviceAPI.create_device(DeviceType(row["type"]), row["name"], row["room_id"]),
+}
+
+BULK_LOOKUP_CHUNK = 500  # Keeps IN (...) lists well under SQLite's bound-parameter limit
+
+def _bulk_insert(db: Session, model, rows):
+    # One executemany INSERT and a single commit (one fsync) for the whole batch
+    if rows:
+        db.execute(model.__table__.insert(), rows)
+        db.commit()
+
+def _existing_user_keys(db: Session, new_users):
+    usernames, emails = set(), set()
+    for start in range(0, len(new_users), BULK_LOOKUP_CHUNK):
+        chunk = new_users[start:start + BULK_LOOKUP_CHUNK]
+        taken = db.query(models.User.username, models.User.email).filter(or_(
+            models.User.username.in_([u.username for u in chunk]),
+            models.User.email.in_([u.email for u in chunk]),
+        ))
+        for username, email in taken:
+            usernames.add(username)
+            emails.add(email)
+    return usernames, emails
+
 # --------------------------
 # User Endpoints
 # --------------------------
@@ -41,46 +227,121 @@ def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
         privilege=new_user.privilege.value  # Convert enum to string
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
-    return db_user
+    return _commit_created(db, db_user, schemas.UserResponse)
+
+@app.post("/users/bulk", response_model=schemas.BulkCreateResponse)
+def create_users_bulk(users: List[schemas.UserCreate], db: Session = Depends(get_db)):
+    """
+    Create many users in one transaction.
+
+    Every item is validated through UserAPI.create_user. Items that fail
+    validation or reuse an existing username/email are reported by index;
+    the rest are written with a single batched INSERT.
+    """
+    errors = []
+    validated = []
+    for index, user in enumerate(users):
+        try:
+            new_user = UserAPI.create_user(
+                user.name,
+                user.username,
+                user.phone_number,
+                user.email,
+                UserPrivilege(user.privilege)
+            )
+        except Exception as e:
+            errors.append({"index": index, "detail": str(e)})
+            continue
+        validated.append((index, new_user))
+
+    taken_usernames, taken_emails = _existing_user_keys(db, [u for _, u in validated])
+    rows = []
+    for index, new_user in validated:
+        if new_user.username in taken_usernames:
+            errors.append({"index": index, "detail": f"Username already exists: {new_user.username}"})
+            continue
+        if new_user.email in taken_emails:
+            errors.append({"index": index, "detail": f"Email already exists: {new_user.email}"})
+            continue
+        # Also reject duplicates within the batch itself
+        taken_usernames.add(new_user.username)
+        taken_emails.add(new_user.email)
+        rows.append({
+            "id": new_user.id,
+            "name": new_user.name,
+            "username": new_user.username,
+            "phone_number": new_user.phone_number,
+            "email": new_user.email,
+            "privilege": new_user.privilege.value
+        })
+
+    _bulk_insert(db, models.User, rows)
+    errors.sort(key=lambda error: error["index"])
+    return {"created_ids": [row["id"] for row in rows], "errors": errors}
+
+@app.get("/users/", response_model=schemas.UserPage)
+def list_users(
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(get_db),
+):
+    """
+    List users in creation order, one keyset page at a time.
+    """
+    return _keyset_page(db, models.User, cursor, limit)
 
 @app.get("/users/{user_id}", response_model=schemas.UserResponse)
-def get_user(user_id: str, db: Session = Depends(get_db)):
-    db_user = db.query(models.User).filter(models.User.id == user_id).first()
-    if not db_user:
-        raise HTTPException(status_code=404, detail="User not found")
-    return db_user
+def get_user(user_id: str, response: Response, if_none_match: Optional[str] = Header(None),
+             db: Session = Depends(get_db)):
+    user = _cached_get(db, "user", models.User, schemas.UserResponse, user_id, "User not found")
+    return versioning.conditional(user, response, if_none_match)
 
 @app.put("/users/{user_id}", response_model=schemas.UserResponse)
-def update_user(user_id: str, updated_data: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(models.User).filter(models.User.id == user_id).first()
-    if not db_user:
-        raise HTTPException(status_code=404, detail="User not found")
-
+def update_user(user_id: str, updated_data: schemas.UserCreate, response: Response,
+                if_match: Optional[str] = Header(None), db: Session = Depends(get_db)):
     try:
         privilege_enum = UserPrivilege(updated_data.privilege)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
     # Update fields
-    db_user.name = updated_data.name
-    db_user.username = updated_data.username
-    db_user.phone_number = updated_data.phone_number
-    db_user.email = updated_data.email
-    db_user.privilege = privilege_enum.value  # Store the enum's value (e.g., "admin")
+    user = _update_row(db, "user", models.User, user_id, {
+        "name": updated_data.name,
+        "username": updated_data.username,
+        "phone_number": updated_data.phone_number,
+        "email": updated_data.email,
+        "privilege": privilege_enum.value,  # Store the enum's value (e.g., "admin")
+    }, "User not found", if_match)
+    response.headers["ETag"] = versioning.etag(user)
+    return user
 
-    db.commit()
-    db.refresh(db_user)
-    return db_user
+@app.patch("/users/{user_id}", response_model=schemas.UserResponse)
+def patch_user(user_id: str, patch: schemas.UserPatch, response: Response,
+               if_match: Optional[str] = Header(None), db: Session = Depends(get_db)):
+    """
+    Partially update a user with a JSON merge patch (RFC 7386).
+    """
+    changes = _patch_fields(patch)
+    _patch_enum(changes, "privilege", UserPrivilege)
+    user = _update_row(db, "user", models.User, user_id, changes, "User not found", if_match,
+                       check=DOMAIN_CHECKS["user"])
+    response.headers["ETag"] = versioning.etag(user)
+    return user
 
-@app.delete("/users/{user_id}", response_model=dict)
-def delete_user(user_id: str, db: Session = Depends(get_db)):
-    db_user = db.query(models.User).filter(models.User.id == user_id).first()
-    if not db_user:
+@app.get("/users/{user_id}/houses", response_model=List[schemas.HouseResponse])
+def list_user_houses(user_id: str, db: Session = Depends(get_db)):
+    """
+    List the houses a user owns (served by the house_owners primary key).
+    """
+    # owner_ids may name ids without a user; only existing users are answered for
+    if not _exists(db, models.User, user_id):
         raise HTTPException(status_code=404, detail="User not found")
-    db.delete(db_user)
-    db.commit()
+    return db.execute(ownership.houses_of_user(user_id)).scalars().all()
+
+@app.delete("/users/{user_id}", response_model=dict)
+def delete_user(user_id: str, if_match: Optional[str] = Header(None), db: Session = Depends(get_db)):
+    _delete_row(db, "user", models.User, user_id, "User not found", if_match,
+                cascade.user_children_deletes(user_id))
     return {"detail": "User deleted"}
 
 # --------------------------
@@ -98,60 +359,167 @@ def create_house(house: schemas.HouseCreate, db: Session = Depends(get_db)):
         address=new_house.address,
         latitude=new_house.location.latitude,
         longitude=new_house.location.longitude,
+        geohash=geo.encode(new_house.location.latitude, new_house.location.longitude),
         owner_ids=new_house.owner_ids,
         occupant_count=new_house.occupant_count
     )
     db.add(db_house)
-    db.commit()
-    db.refresh(db_house)
-    return db_house
+    db.flush()  # Assigns the id the ownership rows refer to
+    for stmt in ownership.replace_owners(db_house.id, db_house.owner_ids):
+        db.execute(stmt)
+    return _commit_created(db, db_house, schemas.HouseResponse)
+
+@app.get("/houses/", response_model=schemas.HousePage)
+def list_houses(
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(get_db),
+):
+    """
+    List houses in creation order, one keyset page at a time.
+    """
+    return _keyset_page(db, models.House, cursor, limit)
+
+# Registered before /houses/{house_id}, which would otherwise match these paths
+@app.get("/houses/nearby", response_model=List[schemas.NearbyHouse])
+def list_nearby_houses(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    radius_km: float = Query(..., gt=0, le=geo.MAX_RADIUS_KM),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(get_db),
+):
+    """
+    List the houses within `radius_km` of a point, nearest first (served by the geohash index).
+    """
+    return [
+        {**cache.to_payload(schemas.HouseResponse, house), "distance_km": round(distance, 3)}
+        for house, distance in geo.nearest_houses(db, lat, lon, radius_km, limit)
+    ]
+
+@app.get("/houses/within", response_model=schemas.HousePage)
+def list_houses_within(
+    min_lat: float = Query(..., ge=-90, le=90),
+    min_lon: float = Query(..., ge=-180, le=180),
+    max_lat: float = Query(..., ge=-90, le=90),
+    max_lon: float = Query(..., ge=-180, le=180),
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(get_db),
+):
+    """
+    List every house inside a bounding box, one keyset page at a time (served
+    by the geohash index). A box with min_lon > max_lon crosses the antimeridian.
+    """
+    if min_lat > max_lat:
+        raise HTTPException(status_code=400, detail="min_lat must not exceed max_lat")
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except CursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    rows = geo.houses_in_box(db, geo.split_box(min_lat, min_lon, max_lat, max_lon), after, limit + 1)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last, last_geohash = rows[-1]
+        next_cursor = encode_cursor(last_geohash, last.id)
+    return {"items": [house for house, _ in rows], "next_cursor": next_cursor}
 
 @app.get("/houses/{house_id}", response_model=schemas.HouseResponse)
-def get_house(house_id: str, db: Session = Depends(get_db)):
+def get_house(house_id: str, response: Response, if_none_match: Optional[str] = Header(None),
+              db: Session = Depends(get_db)):
     """
     Retrieve a house by its ID.
     """
-    db_house = db.query(models.House).filter(models.House.id == house_id).first()
-    if not db_house:
+    house = _cached_get(db, "house", models.House, schemas.HouseResponse, house_id, "House not found")
+    return versioning.conditional(house, response, if_none_match)
+
+
+@app.get("/houses/{house_id}/rooms", response_model=List[schemas.RoomResponse])
+def list_house_rooms(house_id: str, db: Session = Depends(get_db)):
+    """
+    List the rooms of a house (served by the rooms.house_id index).
+    """
+    db_rooms = db.query(models.Room).filter(models.Room.house_id == house_id).all()
+    # Only an empty result needs the extra lookup to tell "no rooms" from "no house"
+    if not db_rooms and not db.query(models.House.id).filter(models.House.id == house_id).first():
         raise HTTPException(status_code=404, detail="House not found")
-    return db_house
+    return db_rooms
 
 
+@app.get("/houses/{house_id}/devices", response_model=List[schemas.DeviceResponse])
+def list_house_devices(house_id: str, db: Session = Depends(get_db)):
+    """
+    List every device in a house with a single join over the rooms.house_id
+    and devices.room_id indexes.
+    """
+    db_devices = (
+        db.query(models.Device)
+        .join(models.Room, models.Device.room_id == models.Room.id)
+        .filter(models.Room.house_id == house_id)
+        .all()
+    )
+    if not db_devices and not db.query(models.House.id).filter(models.House.id == house_id).first():
+        raise HTTPException(status_code=404, detail="House not found")
+    return db_devices
+
+
+@app.get("/houses/{house_id}/stats", response_model=schemas.HouseStats)
+def get_house_stats(house_id: str, db: Session = Depends(get_db)):
+    """
+    Room, floor-area and device counts of a house, read from the counters
+    that room and device writes maintain (no scan of rooms or devices).
+    """
+    stats = house_stats.for_house(db, house_id)
+    if not stats["rooms"] and not stats["devices"] and not _exists(db, models.House, house_id):
+        raise HTTPException(status_code=404, detail="House not found")
+    return stats
+
 @app.put("/houses/{house_id}", response_model=schemas.HouseResponse)
-def update_house(house_id: str, house_update: schemas.HouseCreate, db: Session = Depends(get_db)):
+def update_house(house_id: str, house_update: schemas.HouseCreate, response: Response,
+                 if_match: Optional[str] = Header(None), db: Session = Depends(get_db)):
     """
     Update an existing house.
     
     Note: For simplicity, we're using the same schema for update as for create.
-    In a production app, you might want a separate schema with optional fields.
+    PATCH /houses/{house_id} takes a merge patch of just the changed fields.
     """
-    db_house = db.query(models.House).filter(models.House.id == house_id).first()
-    if not db_house:
-        raise HTTPException(status_code=404, detail="House not found")
-    
-    db_house.name = house_update.name
-    db_house.address = house_update.address
-    db_house.latitude = house_update.latitude
-    db_house.longitude = house_update.longitude
-    db_house.owner_ids = house_update.owner_ids
-    db_house.occupant_count = house_update.occupant_count
+    house = _update_row(db, "house", models.House, house_id, {
+        "name": house_update.name,
+        "address": house_update.address,
+        "latitude": house_update.latitude,
+        "longitude": house_update.longitude,
+        "geohash": geo.encode(house_update.latitude, house_update.longitude),
+        "owner_ids": house_update.owner_ids,
+        "occupant_count": house_update.occupant_count,
+    }, "House not found", if_match, related=ownership.replace_owners(house_id, house_update.owner_ids))
+    response.headers["ETag"] = versioning.etag(house)
+    return house
 
-    db.commit()
-    db.refresh(db_house)
-    return db_house
+
+@app.patch("/houses/{house_id}", response_model=schemas.HouseResponse)
+def patch_house(house_id: str, patch: schemas.HousePatch, response: Response,
+                if_match: Optional[str] = Header(None), db: Session = Depends(get_db)):
+    """
+    Partially update a house with a JSON merge patch (RFC 7386).
+    """
+    changes = _patch_fields(patch)
+    related = ownership.replace_owners(house_id, changes["owner_ids"]) if changes.get("owner_ids") is not None else ()
+    changes.update(geo.geohash_change(changes))
+    house = _update_row(db, "house", models.House, house_id, changes, "House not found", if_match, related=related,
+                        check=DOMAIN_CHECKS["house"])
+    response.headers["ETag"] = versioning.etag(house)
+    return house
 
 
 @app.delete("/houses/{house_id}", response_model=dict)
-def delete_house(house_id: str, db: Session = Depends(get_db)):
+def delete_house(house_id: str, if_match: Optional[str] = Header(None), db: Session = Depends(get_db)):
     """
-    Delete a house by its ID.
+    Delete a house by its ID, along with its rooms and their devices.
     """
-    db_house = db.query(models.House).filter(models.House.id == house_id).first()
-    if not db_house:
-        raise HTTPException(status_code=404, detail="House not found")
-    db.delete(db_house)
-    db.commit()
-    return {"detail": "House deleted"}
+    removed = _delete_row(db, "house", models.House, house_id, "House not found", if_match,
+                          cascade.house_children_deletes(house_id))
+    return {"detail": "House deleted", "rooms_deleted": len(removed["room"]), "devices_deleted": len(removed["device"])}
 
 # --------------------------
 # Room Endpoints
@@ -172,55 +540,110 @@ def create_room(room: schemas.RoomCreate, db: Session = Depends(get_db)):
         type=new_room.type.value  # Convert enum to string for storage
     )
     db.add(db_room)
-    db.commit()
-    db.refresh(db_room)
-    return db_room
+    return _commit_created(db, db_room, schemas.RoomResponse)
+
+@app.post("/rooms/bulk", response_model=schemas.BulkCreateResponse)
+def create_rooms_bulk(rooms: List[schemas.RoomCreate], db: Session = Depends(get_db)):
+    """
+    Create many rooms in one transaction.
+
+    Every item is validated through RoomAPI.create_room; invalid items are
+    reported by index and the rest are written with a single batched INSERT.
+    """
+    errors = []
+    rows = []
+    for index, room in enumerate(rooms):
+        try:
+            new_room = RoomAPI.create_room(room.name, room.floor, room.size, room.house_id, RoomType(room.type))
+        except Exception as e:
+            errors.append({"index": index, "detail": str(e)})
+            continue
+        rows.append({
+            "id": new_room.id,
+            "name": new_room.name,
+            "floor": new_room.floor,
+            "size": new_room.size,
+            "house_id": new_room.house_id,
+            "type": new_room.type.value
+        })
+
+    _bulk_insert(db, models.Room, rows)
+    return {"created_ids": [row["id"] for row in rows], "errors": errors}
+
+@app.get("/rooms/", response_model=schemas.RoomPage)
+def list_rooms(
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(get_db),
+):
+    """
+    List rooms in creation order, one keyset page at a time.
+    """
+    return _keyset_page(db, models.Room, cursor, limit)
 
 @app.get("/rooms/{room_id}", response_model=schemas.RoomResponse)
-def get_room(room_id: str, db: Session = Depends(get_db)):
+def get_room(room_id: str, response: Response, if_none_match: Optional[str] = Header(None),
+             db: Session = Depends(get_db)):
     """
     Retrieve a room by its ID.
     """
-    db_room = db.query(models.Room).filter(models.Room.id == room_id).first()
-    if not db_room:
+    room = _cached_get(db, "room", models.Room, schemas.RoomResponse, room_id, "Room not found")
+    return versioning.conditional(room, response, if_none_match)
+
+
+@app.get("/rooms/{room_id}/devices", response_model=List[schemas.DeviceResponse])
+def list_room_devices(room_id: str, db: Session = Depends(get_db)):
+    """
+    List the devices in a room (served by the devices.room_id index).
+    """
+    db_devices = db.query(models.Device).filter(models.Device.room_id == room_id).all()
+    if not db_devices and not db.query(models.Room.id).filter(models.Room.id == room_id).first():
         raise HTTPException(status_code=404, detail="Room not found")
-    return db_room
+    return db_devices
 
 
 @app.put("/rooms/{room_id}", response_model=schemas.RoomResponse)
-def update_room(room_id: str, room_update: schemas.RoomCreate, db: Session = Depends(get_db)):
+def update_room(room_id: str, room_update: schemas.RoomCreate, response: Response,
+                if_match: Optional[str] = Header(None), db: Session = Depends(get_db)):
     """
     Update an existing room.
     
     For simplicity, we're using the same schema for updates as for creation.
     """
-    db_room = db.query(models.Room).filter(models.Room.id == room_id).first()
-    if not db_room:
-        raise HTTPException(status_code=404, detail="Room not found")
-    
     # Update room details
-    db_room.name = room_update.name
-    db_room.floor = room_update.floor
-    db_room.size = room_update.size
-    db_room.house_id = room_update.house_id
-    db_room.type = room_update.type  
+    room = _update_row(db, "room", models.Room, room_id, {
+        "name": room_update.name,
+        "floor": room_update.floor,
+        "size": room_update.size,
+        "house_id": room_update.house_id,
+        "type": room_update.type,
+    }, "Room not found", if_match)
+    response.headers["ETag"] = versioning.etag(room)
+    return room
 
-    db.commit()
-    db.refresh(db_room)
-    return db_room
+
+@app.patch("/rooms/{room_id}", response_model=schemas.RoomResponse)
+def patch_room(room_id: str, patch: schemas.RoomPatch, response: Response,
+               if_match: Optional[str] = Header(None), db: Session = Depends(get_db)):
+    """
+    Partially update a room with a JSON merge patch (RFC 7386).
+    """
+    changes = _patch_fields(patch)
+    _patch_enum(changes, "type", RoomType)
+    room = _update_row(db, "room", models.Room, room_id, changes, "Room not found", if_match,
+                       check=DOMAIN_CHECKS["room"])
+    response.headers["ETag"] = versioning.etag(room)
+    return room
 
 
 @app.delete("/rooms/{room_id}", response_model=dict)
-def delete_room(room_id: str, db: Session = Depends(get_db)):
+def delete_room(room_id: str, if_match: Optional[str] = Header(None), db: Session = Depends(get_db)):
     """
-    Delete a room by its ID.
+    Delete a room by its ID, along with its devices.
     """
-    db_room = db.query(models.Room).filter(models.Room.id == room_id).first()
-    if not db_room:
-        raise HTTPException(status_code=404, detail="Room not found")
-    db.delete(db_room)
-    db.commit()
-    return {"detail": "Room deleted"}
+    removed = _delete_row(db, "room", models.Room, room_id, "Room not found", if_match,
+                          cascade.room_children_deletes(room_id))
+    return {"detail": "Room deleted", "devices_deleted": len(removed["device"])}
 
 # --------------------------
 # Device Endpoints
@@ -244,27 +667,66 @@ def create_device(device: schemas.DeviceCreate, db: Session = Depends(get_db)):
         last_updated=new_device.last_updated
     )
     db.add(db_device)
-    db.commit()
-    db.refresh(db_device)
-    return db_device
+    payload = _commit_created(db, db_device, schemas.DeviceResponse)
+    hotstate.store.track(payload["id"], payload["status"], payload["last_updated"], payload["last_data"])
+    return payload
+
+@app.post("/devices/bulk", response_model=schemas.BulkCreateResponse)
+def create_devices_bulk(devices: List[schemas.DeviceCreate], db: Session = Depends(get_db)):
+    """
+    Create many devices in one transaction, e.g. when onboarding a building.
+
+    Every item is validated through DeviceAPI.create_device; invalid items are
+    reported by index and the rest are written with a single batched INSERT.
+    """
+    errors = []
+    rows = []
+    for index, device in enumerate(devices):
+        try:
+            new_device = DeviceAPI.create_device(DeviceType(device.type), device.name, device.room_id)
+        except Exception as e:
+            errors.append({"index": index, "detail": str(e)})
+            continue
+        rows.append({
+            "id": new_device.id,
+            "type": new_device.type.value,
+            "name": new_device.name,
+            "room_id": new_device.room_id,
+            "settings": device.settings or {},
+            "status": new_device.status,
+            "last_data": new_device.last_data,
+            "last_updated": new_device.last_updated
+        })
+
+    _bulk_insert(db, models.Device, rows)
+    for row in rows:
+        hotstate.store.track(row["id"], row["status"], row["last_updated"], row["last_data"])
+    return {"created_ids": [row["id"] for row in rows], "errors": errors}
+
+@app.get("/devices/", response_model=schemas.DevicePage)
+def list_devices(
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: Session = Depends(get_db),
+):
+    """
+    List devices in creation order, one keyset page at a time.
+    """
+    return _keyset_page(db, models.Device, cursor, limit)
 
 @app.get("/devices/{device_id}", response_model=schemas.DeviceResponse)
-def get_device(device_id: str, db: Session = Depends(get_db)):
+def get_device(device_id: str, response: Response, if_none_match: Optional[str] = Header(None),
+               db: Session = Depends(get_db)):
     """
     Retrieve a device by its ID.
     """
-    db_device = db.query(models.Device).filter(models.Device.id == device_id).first()
-    if not db_device:
-        raise HTTPException(status_code=404, detail="Device not found")
-    return db_device
+    device = _cached_get(db, "device", models.Device, schemas.DeviceResponse, device_id, "Device not found")
+    return versioning.conditional(hotstate.store.overlay(device_id, device), response, if_none_match)
 
 
 @app.put("/devices/{device_id}", response_model=schemas.DeviceResponse)
-def update_device(device_id: str, device_update: schemas.DeviceCreate, db: Session = Depends(get_db)):
-    db_device = db.query(models.Device).filter(models.Device.id == device_id).first()
-    if not db_device:
-        raise HTTPException(status_code=404, detail="Device not found")
-    
+def update_device(device_id: str, device_update: schemas.DeviceCreate, response: Response,
+                  if_match: Optional[str] = Header(None), db: Session = Depends(get_db)):
     # Check if device_update.type is already a DeviceType
     if isinstance(device_update.type, DeviceType):
         device_type_enum = device_update.type
@@ -273,30 +735,343 @@ def update_device(device_id: str, device_update: schemas.DeviceCreate, db: Sessi
             device_type_enum = DeviceType(device_update.type)
         except Exception as e:
             raise HTTPException(status_code=400, detail="Invalid device type")
-    
-    
-    db_device.type = device_type_enum.value
-    db_device.name = device_update.name
-    db_device.room_id = device_update.room_id
-    db_device.settings = device_update.settings  
-    
-    db.commit()
-    db.refresh(db_device)
-    return db_device
+
+    device = _update_row(db, "device", models.Device, device_id, {
+        "type": device_type_enum.value,
+        "name": device_update.name,
+        "room_id": device_update.room_id,
+        "settings": device_update.settings or {},
+    }, "Device not found", if_match)
+    pubsub.notify_devices(db, [device_id], "device_updated")
+    device = hotstate.store.overlay(device_id, device)
+    response.headers["ETag"] = versioning.etag(device)
+    return device
+
+
+@app.patch("/devices/{device_id}", response_model=schemas.DeviceResponse)
+def patch_device(device_id: str, patch: schemas.DevicePatch, response: Response,
+                 if_match: Optional[str] = Header(None), db: Session = Depends(get_db)):
+    """
+    Partially update a device with a JSON merge patch (RFC 7386), e.g.
+    {"settings": {"brightness": 40}} changes one key and leaves the rest.
+    """
+    changes = _patch_fields(patch)
+    _patch_enum(changes, "type", DeviceType, "Invalid device type")
+    device = _update_row(db, "device", models.Device, device_id, changes, "Device not found", if_match,
+                         merge_columns=("settings",), check=DOMAIN_CHECKS["device"])
+    if changes:
+        pubsub.notify_devices(db, [device_id], "device_updated")
+    device = hotstate.store.overlay(device_id, device)
+    response.headers["ETag"] = versioning.etag(device)
+    return device
 
 
 @app.delete("/devices/{device_id}", response_model=dict)
-def delete_device(device_id: str, db: Session = Depends(get_db)):
+def delete_device(device_id: str, if_match: Optional[str] = Header(None), db: Session = Depends(get_db)):
     """
     Delete a device by its ID.
     """
-    db_device = db.query(models.Device).filter(models.Device.id == device_id).first()
-    if not db_device:
+    _delete_row(db, "device", models.Device, device_id, "Device not found", if_match)
+    hotstate.store.discard(device_id)
+    return {"detail": "Device deleted"}
+
+@app.post("/devices/{device_id}/status", response_model=schemas.DeviceStatus)
+def set_device_status(device_id: str, update: schemas.DeviceStatusUpdate, db: Session = Depends(get_db)):
+    """
+    Fast path for status changes: recorded in the hot-state store and its
+    log, and written back to the devices table in the background, without
+    touching the row's other columns or updated_at.
+    """
+    hotstate.store.ensure_loaded(db.get_bind())
+    try:
+        state = hotstate.store.set_status(device_id, update.status, update.data)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if state is None:
         raise HTTPException(status_code=404, detail="Device not found")
-    
-    db.delete(db_device)
+    pubsub.notify_devices(db, [device_id], "device_status")
+    return state
+
+@app.get("/devices/{device_id}/status", response_model=schemas.DeviceStatus)
+def get_device_status(device_id: str, db: Session = Depends(get_db)):
+    """
+    Current status of a device, served from the hot-state store.
+    """
+    hotstate.store.ensure_loaded(db.get_bind())
+    state = hotstate.store.get(device_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Device not found")
+    return state
+
+# --------------------------
+# Command Endpoints
+# --------------------------
+def _apply_device_command(db: Session, command: schemas.DeviceCommand, *criteria) -> List[str]:
+    """
+    Apply a status/settings change to every device matching `criteria` and
+    the command's filter with one UPDATE ... RETURNING.
+    """
+    values = {}
+    if command.status is not None:
+        values["status"] = command.status
+    if command.settings:
+        # Merged in SQL, so each row's other settings keys are left as stored
+        values["settings"] = func.json_patch(models.Device.settings, json.dumps(command.settings))
+    if not values:
+        raise HTTPException(status_code=400, detail="Command must set status or settings")
+    if command.filter.type is not None:
+        try:
+            criteria += (models.Device.type == DeviceType(command.filter.type).value,)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    values["version"] = models.Device.version + 1
+    stmt = update(models.Device).where(*criteria).values(**values).returning(models.Device.id)
+    affected_ids = list(db.execute(stmt, execution_options={"synchronize_session": False}).scalars())
     db.commit()
-    return {"detail": "Device deleted"}
+    cache.invalidate("device", *affected_ids)
+    if command.status is not None:
+        hotstate.store.record(affected_ids, command.status)
+    pubsub.notify_devices(db, affected_ids, "device_updated")
+    return affected_ids
+
+@app.post("/houses/{house_id}/commands", response_model=schemas.DeviceCommandResponse)
+def command_house_devices(house_id: str, command: schemas.DeviceCommand, db: Session = Depends(get_db)):
+    """
+    Apply a command to every matching device in a house, e.g. all lights off.
+    """
+    rooms = db.query(models.Room.id).filter(models.Room.house_id == house_id)
+    affected_ids = _apply_device_command(db, command, models.Device.room_id.in_(rooms.scalar_subquery()))
+    if not affected_ids and not db.query(models.House.id).filter(models.House.id == house_id).first():
+        raise HTTPException(status_code=404, detail="House not found")
+    return {"affected_ids": affected_ids}
+
+@app.post("/rooms/{room_id}/commands", response_model=schemas.DeviceCommandResponse)
+def command_room_devices(room_id: str, command: schemas.DeviceCommand, db: Session = Depends(get_db)):
+    """
+    Apply a command to every matching device in a room.
+    """
+    affected_ids = _apply_device_command(db, command, models.Device.room_id == room_id)
+    if not affected_ids and not db.query(models.Room.id).filter(models.Room.id == room_id).first():
+        raise HTTPException(status_code=404, detail="Room not found")
+    return {"affected_ids": affected_ids}
+
+# --------------------------
+# Telemetry Endpoints
+# --------------------------
+@app.post("/devices/{device_id}/telemetry", response_model=schemas.TelemetryIngestResponse)
+def ingest_device_telemetry(device_id: str, readings: List[schemas.TelemetryReadingIn], db: Session = Depends(get_db)):
+    """
+    Append readings to a device's telemetry history in one transaction and
+    refresh its last_data/last_updated projection.
+    """
+    if not db.query(models.Device.id).filter(models.Device.id == device_id).first():
+        raise HTTPException(status_code=404, detail="Device not found")
+    accepted, _ = telemetry.ingest(db, ((device_id, reading.ts, reading.data) for reading in readings))
+    db.commit()
+    cache.invalidate("device", device_id)
+    hotstate.store.refresh(db, [device_id])
+    pubsub.notify_devices(db, [device_id], "telemetry")
+    return {"device_id": device_id, "accepted": accepted}
+
+@app.get("/devices/{device_id}/telemetry", response_model=schemas.TelemetrySeries)
+def get_device_telemetry(
+    device_id: str,
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    resolution: str = "auto",
+    max_points: int = Query(telemetry.DEFAULT_MAX_POINTS, ge=1, le=10000),
+    db: Session = Depends(get_db),
+):
+    """
+    Read a device's telemetry in [from, to), by default the last 24 hours.
+
+    resolution is "raw", "1m", "1h", "1d" or "auto"; auto serves the finest
+    resolution that fits in max_points, so long ranges are answered from the
+    rollup tables instead of raw samples.
+    """
+    if not db.query(models.Device.id).filter(models.Device.id == device_id).first():
+        raise HTTPException(status_code=404, detail="Device not found")
+    end = telemetry.to_utc_naive(end)
+    start = telemetry.to_utc_naive(start) if start else end - timedelta(days=1)
+    try:
+        resolution, points, truncated = telemetry.query_series(db, device_id, start, end, resolution, max_points)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"device_id": device_id, "resolution": resolution, "points": points, "truncated": truncated}
+
+@app.post("/telemetry/batch", response_model=schemas.TelemetryBatchResponse)
+async def ingest_telemetry_batch(request: Request, db: Session = Depends(get_db)):
+    """
+    Ingest a gateway's buffered readings in one request.
+
+    The body is NDJSON (one {device_id, ts, data} object per line) or a JSON
+    array of such objects. It is decoded as it streams in and written in
+    transactions of up to telemetry.BATCH_TRANSACTION_ROWS readings, so
+    memory stays bounded whatever the upload size. Unreadable items and
+    unknown devices are reported by index without failing the rest.
+    """
+    parser = telemetry.StreamItemParser()
+    ingestor = telemetry.BatchIngestor(db)
+    # Only receiving runs on the event loop: decoding and validating each chunk is
+    # CPU work that would stall every other request, so it goes to the threadpool too
+    async for chunk in request.stream():
+        await run_in_threadpool(ingestor.feed, parser, chunk)
+    await run_in_threadpool(ingestor.finish, parser)
+    return {"accepted": ingestor.accepted, "rejected": ingestor.rejected, "rejects": ingestor.rejects}
+
+@app.post("/admin/orphans/purge", response_model=schemas.OrphanPurgeReport)
+def purge_orphans(db: Session = Depends(get_db)):
+    """
+    Delete rooms, devices, telemetry and rollups whose parent no longer
+    exists, in short batches that leave the database writable throughout.
+    """
+    return cascade.purge_orphans(db.get_bind())
+
+@app.post("/admin/telemetry/compact", response_model=schemas.CompactionReport)
+def compact_telemetry(db: Session = Depends(get_db)):
+    """
+    Apply the per-device-type retention policies now instead of waiting for
+    the background compactor, and report the rows and bytes reclaimed.
+    """
+    return retention.compact(db.get_bind())
+
+@app.post("/admin/house-stats/rebuild", response_model=dict)
+def rebuild_house_stats(db: Session = Depends(get_db)):
+    """
+    Recompute every house's stats from rooms and devices in one pass.
+    """
+    house_stats.rebuild(db.get_bind())
+    return {"detail": "House stats rebuilt"}
+
+@app.post("/admin/search/rebuild", response_model=dict)
+def rebuild_search(db: Session = Depends(get_db)):
+    """
+    Rebuild the full-text indexes from their tables (e.g. after rows were
+    changed with triggers bypassed).
+    """
+    search.rebuild(db.get_bind())
+    return {"detail": "Search indexes rebuilt"}
+
+# --------------------------
+# Search Endpoints
+# --------------------------
+@app.get("/search", response_model=List[schemas.SearchHit])
+def search_entities(
+    q: str = Query(..., min_length=1, max_length=200),
+    types: Optional[str] = Query(None, description="Comma-separated subset of user,house,room,device"),
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db),
+):
+    """
+    Ranked full-text search of user, house, room and device names (plus
+    usernames, emails and addresses). Every word of `q` must match; the last
+    one may be the start of a word.
+    """
+    entities = list(search.SEARCH_INDEXES)
+    if types:
+        entities = [entity.strip() for entity in types.split(",") if entity.strip()]
+        unknown = sorted(set(entities) - set(search.SEARCH_INDEXES))
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown search types: {', '.join(unknown)}")
+    return search.search(db, q, list(dict.fromkeys(entities)), limit)
+
+# --------------------------
+# Live Update Endpoints
+# --------------------------
+def _house_exists(db: Session, house_id: str) -> bool:
+    try:
+        return db.query(models.House.id).filter(models.House.id == house_id).first() is not None
+    finally:
+        db.close()  # Streams stay open for hours; don't hold a pooled connection meanwhile
+
+@app.websocket("/ws/houses/{house_id}")
+async def house_updates_ws(websocket: WebSocket, house_id: str, db: Session = Depends(get_db)):
+    """
+    Push a JSON delta for every device change in the house (see shs_api/pubsub.py).
+    """
+    if not await run_in_threadpool(_house_exists, db, house_id):
+        await websocket.close(code=4404, reason="House not found")
+        return
+    subscription = pubsub.broker.subscribe(house_id)
+    try:
+        await websocket.accept()
+
+        async def send_events():
+            while True:
+                await websocket.send_json(await subscription.get())
+
+        async def wait_for_disconnect():
+            # Client messages are ignored; this only notices the socket closing while idle
+            while (await websocket.receive())["type"] != "websocket.disconnect":
+                pass
+
+        tasks = [asyncio.create_task(send_events()), asyncio.create_task(wait_for_disconnect())]
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+    finally:
+        pubsub.broker.unsubscribe(subscription)
+
+@app.get("/sse/houses/{house_id}")
+async def house_updates_sse(house_id: str, db: Session = Depends(get_db)):
+    """
+    Server-Sent Events equivalent of /ws/houses/{house_id}.
+    """
+    if not await run_in_threadpool(_house_exists, db, house_id):
+        raise HTTPException(status_code=404, detail="House not found")
+    subscription = pubsub.broker.subscribe(house_id)
+
+    async def stream():
+        try:
+            async for frame in pubsub.sse_stream(subscription):
+                yield frame
+        finally:
+            pubsub.broker.unsubscribe(subscription)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+# --------------------------
+# Diagnostics Endpoints
+# --------------------------
+@app.get("/diagnostics/sqlite", response_model=schemas.SqliteDiagnostics)
+def sqlite_diagnostics(db: Session = Depends(get_db)):
+    """
+    Report the SQLite pragma profile and the values in effect on a pooled connection.
+    """
+    effective = {}
+    if db.get_bind().dialect.name == "sqlite":
+        names = sorted(set(SQLITE_PRAGMA_PROFILES["production"]) | set(ACTIVE_SQLITE_PRAGMAS))
+        for name in names:
+            effective[name] = db.execute(text(f"PRAGMA {name}")).scalar()
+    return {"profile": SQLITE_PROFILE, "configured": ACTIVE_SQLITE_PRAGMAS, "effective": effective}
+
+@app.get("/diagnostics/cache", response_model=dict)
+def cache_diagnostics():
+    """
+    Report the entity cache backend's size and hit/miss/eviction counters.
+    """
+    return cache.stats()
+
+@app.get("/diagnostics/slow-queries", response_model=dict)
+def slow_query_diagnostics():
+    """
+    Report the slow-query log's settings, counters and most recent entries.
+    """
+    return slowlog.sink.stats()
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def prometheus_metrics():
+    """
+    Per-route request metrics in the Prometheus text exposition format.
+    """
+    return PlainTextResponse(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+if DB_MODE == "async":
+    # Serve the core CRUD endpoints from the AsyncEngine instead of the threadpool
+    from shs_api import async_api
+    async_api.install(app)
 
 if __name__ == "__main__":
+    import uvicorn
     uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True)
\ No newline at end of file
@@ -0,0 +1,336 @@
+# async_api.py
+"""Async versions of the core CRUD and list endpoints, swapped in by `install(app)` when SHS_DB_MODE=async."""
+from typing import Optional
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
+from fastapi.routing import APIRoute
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from shs_api import cache
+from shs_api import cascade
+from shs_api import database
+from shs_api import geo
+from shs_api import hotstate
+from shs_api import models
+from shs_api import ownership
+from shs_api import pubsub
+from shs_api import schemas
+from shs_api import versioning
+from shs_api.pagination import CursorError, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, keyset_select, split_page
+from shs_api.shs_api import UserAPI, UserPrivilege, HouseAPI, RoomAPI, DeviceAPI, Location, RoomType, DeviceType
+
+router = APIRouter()
+
+
+async def get_async_db():
+    async with database.AsyncSessionLocal() as db:
+        yield db
+
+
+def install(app):
+    """Replace the app's sync routes with the async routes defined on `router`."""
+    overridden = {(route.path, method) for route in router.routes for method in route.methods}
+    app.router.routes = [
+        route for route in app.router.routes
+        if not (isinstance(route, APIRoute) and any((route.path, method) in overridden for method in route.methods))
+    ]
+    app.include_router(router)
+
+
+async def _keyset_page(db: AsyncSession, model, cursor: Optional[str], limit: int):
+    try:
+        stmt = keyset_select(model, cursor, limit)
+    except CursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    items, next_cursor = split_page((await db.execute(stmt)).all(), limit)
+    return {"items": items, "next_cursor": next_cursor}
+
+
+async def _get_or_404(db: AsyncSession, model, entity_id: str, detail: str):
+    entity = await db.get(model, entity_id)
+    if not entity:
+        raise HTTPException(status_code=404, detail=detail)
+    return entity
+
+
+async def _cached_get(db: AsyncSession, entity: str, model, response_schema, entity_id: str, detail: str):
+    payload = cache.get(entity, entity_id)
+    if payload is None:
+        payload = cache.to_payload(response_schema, await _get_or_404(db, model, entity_id, detail))
+        cache.put(entity, entity_id, payload)
+    return payload
+
+
+async def _update_row(db: AsyncSession, entity: str, model, entity_id: str, values: dict, detail: str,
+                      if_match: Optional[str], related=()):
+    # One compare-and-swap UPDATE ... RETURNING, as in main._update_row
+    versions = versioning.expected_versions(if_match)
+    try:
+        stmt = versioning.cas_update(model.__table__, entity_id, values, versions)
+        row = (await db.execute(stmt)).mappings().first()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=f"Update conflicts with an existing {entity}")
+    if row is None:
+        versioning.missed(await db.get(model, entity_id) is not None, detail)
+    for stmt in related:
+        await db.execute(stmt)
+    await db.commit()
+    cache.invalidate(entity, entity_id)
+    return dict(row)
+
+
+async def _delete_row(db: AsyncSession, entity: str, model, entity_id: str, detail: str, if_match: Optional[str],
+                      children=()) -> dict:
+    versions = versioning.expected_versions(if_match)
+    if (await db.execute(versioning.cas_delete(model.__table__, entity_id, versions))).rowcount == 0:
+        versioning.missed(await db.get(model, entity_id) is not None, detail)
+    removed = {child: (await db.execute(stmt)).scalars().all() for child, stmt in children}
+    await db.commit()
+    cache.invalidate(entity, entity_id)
+    cascade.forget(removed)
+    return removed
+
+
+# --------------------------
+# User Endpoints
+# --------------------------
+@router.post("/users/", response_model=schemas.UserResponse)
+async def create_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
+    try:
+        privilege_enum = UserPrivilege(user.privilege)
+        new_user = UserAPI.create_user(user.name, user.username, user.phone_number, user.email, privilege_enum)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    db_user = models.User(
+        name=new_user.name,
+        username=new_user.username,
+        phone_number=new_user.phone_number,
+        email=new_user.email,
+        privilege=new_user.privilege.value
+    )
+    db.add(db_user)
+    await db.commit()  # expire_on_commit=False, and the INSERT returned the server defaults
+    return db_user
+
+@router.get("/users/", response_model=schemas.UserPage)
+async def list_users(
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_async_db),
+):
+    return await _keyset_page(db, models.User, cursor, limit)
+
+@router.get("/users/{user_id}", response_model=schemas.UserResponse)
+async def get_user(user_id: str, response: Response, if_none_match: Optional[str] = Header(None),
+                   db: AsyncSession = Depends(get_async_db)):
+    user = await _cached_get(db, "user", models.User, schemas.UserResponse, user_id, "User not found")
+    return versioning.conditional(user, response, if_none_match)
+
+@router.put("/users/{user_id}", response_model=schemas.UserResponse)
+async def update_user(user_id: str, updated_data: schemas.UserCreate, response: Response,
+                      if_match: Optional[str] = Header(None), db: AsyncSession = Depends(get_async_db)):
+    try:
+        privilege_enum = UserPrivilege(updated_data.privilege)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    user = await _update_row(db, "user", models.User, user_id, {
+        "name": updated_data.name,
+        "username": updated_data.username,
+        "phone_number": updated_data.phone_number,
+        "email": updated_data.email,
+        "privilege": privilege_enum.value,
+    }, "User not found", if_match)
+    response.headers["ETag"] = versioning.etag(user)
+    return user
+
+@router.delete("/users/{user_id}", response_model=dict)
+async def delete_user(user_id: str, if_match: Optional[str] = Header(None), db: AsyncSession = Depends(get_async_db)):
+    await _delete_row(db, "user", models.User, user_id, "User not found", if_match,
+                      cascade.user_children_deletes(user_id))
+    return {"detail": "User deleted"}
+
+# --------------------------
+# House Endpoints
+# --------------------------
+@router.post("/houses/", response_model=schemas.HouseResponse)
+async def create_house(house: schemas.HouseCreate, db: AsyncSession = Depends(get_async_db)):
+    try:
+        loc = Location(latitude=house.latitude, longitude=house.longitude)
+        new_house = HouseAPI.create_house(house.name, house.address, loc, house.owner_ids, house.occupant_count)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    db_house = models.House(
+        name=new_house.name,
+        address=new_house.address,
+        latitude=new_house.location.latitude,
+        longitude=new_house.location.longitude,
+        geohash=geo.encode(new_house.location.latitude, new_house.location.longitude),
+        owner_ids=new_house.owner_ids,
+        occupant_count=new_house.occupant_count
+    )
+    db.add(db_house)
+    await db.flush()
+    for stmt in ownership.replace_owners(db_house.id, db_house.owner_ids):
+        await db.execute(stmt)
+    await db.commit()  # expire_on_commit=False, and the INSERT returned the server defaults
+    return db_house
+
+@router.get("/houses/", response_model=schemas.HousePage)
+async def list_houses(
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_async_db),
+):
+    return await _keyset_page(db, models.House, cursor, limit)
+
+@router.get("/houses/{house_id}", response_model=schemas.HouseResponse)
+async def get_house(house_id: str, response: Response, if_none_match: Optional[str] = Header(None),
+                    db: AsyncSession = Depends(get_async_db)):
+    house = await _cached_get(db, "house", models.House, schemas.HouseResponse, house_id, "House not found")
+    return versioning.conditional(house, response, if_none_match)
+
+@router.put("/houses/{house_id}", response_model=schemas.HouseResponse)
+async def update_house(house_id: str, house_update: schemas.HouseCreate, response: Response,
+                       if_match: Optional[str] = Header(None), db: AsyncSession = Depends(get_async_db)):
+    house = await _update_row(db, "house", models.House, house_id, {
+        "name": house_update.name,
+        "address": house_update.address,
+        "latitude": house_update.latitude,
+        "longitude": house_update.longitude,
+        "geohash": geo.encode(house_update.latitude, house_update.longitude),
+        "owner_ids": house_update.owner_ids,
+        "occupant_count": house_update.occupant_count,
+    }, "House not found", if_match, related=ownership.replace_owners(house_id, house_update.owner_ids))
+    response.headers["ETag"] = versioning.etag(house)
+    return house
+
+@router.delete("/houses/{house_id}", response_model=dict)
+async def delete_house(house_id: str, if_match: Optional[str] = Header(None), db: AsyncSession = Depends(get_async_db)):
+    removed = await _delete_row(db, "house", models.House, house_id, "House not found", if_match,
+                                cascade.house_children_deletes(house_id))
+    return {"detail": "House deleted", "rooms_deleted": len(removed["room"]), "devices_deleted": len(removed["device"])}
+
+# --------------------------
+# Room Endpoints
+# --------------------------
+@router.post("/rooms/", response_model=schemas.RoomResponse)
+async def create_room(room: schemas.RoomCreate, db: AsyncSession = Depends(get_async_db)):
+    try:
+        room_type = RoomType(room.type)
+        new_room = RoomAPI.create_room(room.name, room.floor, room.size, room.house_id, room_type)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    db_room = models.Room(
+        name=new_room.name,
+        floor=new_room.floor,
+        size=new_room.size,
+        house_id=new_room.house_id,
+        type=new_room.type.value
+    )
+    db.add(db_room)
+    await db.commit()  # expire_on_commit=False, and the INSERT returned the server defaults
+    return db_room
+
+@router.get("/rooms/", response_model=schemas.RoomPage)
+async def list_rooms(
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_async_db),
+):
+    return await _keyset_page(db, models.Room, cursor, limit)
+
+@router.get("/rooms/{room_id}", response_model=schemas.RoomResponse)
+async def get_room(room_id: str, response: Response, if_none_match: Optional[str] = Header(None),
+                   db: AsyncSession = Depends(get_async_db)):
+    room = await _cached_get(db, "room", models.Room, schemas.RoomResponse, room_id, "Room not found")
+    return versioning.conditional(room, response, if_none_match)
+
+@router.put("/rooms/{room_id}", response_model=schemas.RoomResponse)
+async def update_room(room_id: str, room_update: schemas.RoomCreate, response: Response,
+                      if_match: Optional[str] = Header(None), db: AsyncSession = Depends(get_async_db)):
+    room = await _update_row(db, "room", models.Room, room_id, {
+        "name": room_update.name,
+        "floor": room_update.floor,
+        "size": room_update.size,
+        "house_id": room_update.house_id,
+        "type": room_update.type,
+    }, "Room not found", if_match)
+    response.headers["ETag"] = versioning.etag(room)
+    return room
+
+@router.delete("/rooms/{room_id}", response_model=dict)
+async def delete_room(room_id: str, if_match: Optional[str] = Header(None), db: AsyncSession = Depends(get_async_db)):
+    removed = await _delete_row(db, "room", models.Room, room_id, "Room not found", if_match,
+                                cascade.room_children_deletes(room_id))
+    return {"detail": "Room deleted", "devices_deleted": len(removed["device"])}
+
+# --------------------------
+# Device Endpoints
+# --------------------------
+@router.post("/devices/", response_model=schemas.DeviceResponse)
+async def create_device(device: schemas.DeviceCreate, db: AsyncSession = Depends(get_async_db)):
+    try:
+        device_type = DeviceType(device.type)
+        new_device = DeviceAPI.create_device(device_type, device.name, device.room_id)
+        new_device.settings = device.settings or {}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    db_device = models.Device(
+        type=new_device.type.value,
+        name=new_device.name,
+        room_id=new_device.room_id,
+        settings=new_device.settings,
+        status=new_device.status,
+        last_data=new_device.last_data,
+        last_updated=new_device.last_updated
+    )
+    db.add(db_device)
+    await db.commit()  # expire_on_commit=False, and the INSERT returned the server defaults
+    hotstate.store.track(db_device.id, db_device.status, db_device.last_updated, db_device.last_data)
+    return db_device
+
+@router.get("/devices/", response_model=schemas.DevicePage)
+async def list_devices(
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    db: AsyncSession = Depends(get_async_db),
+):
+    return await _keyset_page(db, models.Device, cursor, limit)
+
+@router.get("/devices/{device_id}", response_model=schemas.DeviceResponse)
+async def get_device(device_id: str, response: Response, if_none_match: Optional[str] = Header(None),
+                     db: AsyncSession = Depends(get_async_db)):
+    device = await _cached_get(db, "device", models.Device, schemas.DeviceResponse, device_id, "Device not found")
+    return versioning.conditional(hotstate.store.overlay(device_id, device), response, if_none_match)
+
+@router.put("/devices/{device_id}", response_model=schemas.DeviceResponse)
+async def update_device(device_id: str, device_update: schemas.DeviceCreate, response: Response,
+                        if_match: Optional[str] = Header(None), db: AsyncSession = Depends(get_async_db)):
+    try:
+        device_type_enum = DeviceType(device_update.type)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid device type")
+
+    device = await _update_row(db, "device", models.Device, device_id, {
+        "type": device_type_enum.value,
+        "name": device_update.name,
+        "room_id": device_update.room_id,
+        "settings": device_update.settings or {},
+    }, "Device not found", if_match)
+    if pubsub.broker.active:
+        rows = (await db.execute(pubsub.device_changes_select([device_id]))).all()
+        pubsub.publish_device_changes(rows, "device_updated")
+    device = hotstate.store.overlay(device_id, device)
+    response.headers["ETag"] = versioning.etag(device)
+    return device
+
+@router.delete("/devices/{device_id}", response_model=dict)
+async def delete_device(device_id: str, if_match: Optional[str] = Header(None),
+                        db: AsyncSession = Depends(get_async_db)):
+    await _delete_row(db, "device", models.Device, device_id, "Device not found", if_match)
+    hotstate.store.discard(device_id)
+    return {"detail": "Device deleted"}
@@ -0,0 +1,130 @@
+# cache.py
+"""Read-through cache of serialized GET-by-id payloads; writers call `invalidate()` after committing."""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+class CacheBackend:
+    """Interface for entity cache backends"""
+
+    def get(self, key: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: dict):
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        raise NotImplementedError
+
+
+class LRUTTLCache(CacheBackend):
+    """Bounded, thread-safe in-process cache with least-recently-used eviction and a TTL"""
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 30.0, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._entries = OrderedDict()  # key -> (expires_at, value), oldest first
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= self._clock():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: dict):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (self._clock() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": "lru_ttl",
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+# SHS_CACHE_MAX_ENTRIES=0 disables caching
+_backend: CacheBackend = LRUTTLCache(
+    max_entries=int(os.getenv("SHS_CACHE_MAX_ENTRIES", "10000")),
+    ttl_seconds=float(os.getenv("SHS_CACHE_TTL_SECONDS", "30")),
+)
+
+
+def set_backend(backend: CacheBackend):
+    global _backend
+    _backend = backend
+
+
+def get_backend() -> CacheBackend:
+    return _backend
+
+
+def _key(entity: str, entity_id: str) -> str:
+    return f"{entity}:{entity_id}"
+
+
+def get(entity: str, entity_id: str) -> Optional[dict]:
+    return _backend.get(_key(entity, entity_id))
+
+
+def put(entity: str, entity_id: str, payload: dict):
+    _backend.set(_key(entity, entity_id), payload)
+
+
+def invalidate(entity: str, *entity_ids: str):
+    for entity_id in entity_ids:
+        _backend.delete(_key(entity, entity_id))
+
+
+def stats() -> dict:
+    return _backend.stats()
+
+
+def to_payload(response_schema, db_obj) -> dict:
+    """Serialize an ORM row through its `schemas.*Response` model."""
+    return response_schema.model_validate(db_obj, from_attributes=True).model_dump()
@@ -0,0 +1,133 @@
+# cascade.py
+"""Cascading deletes for the house -> room -> device hierarchy, and a batched sweep of orphaned rows."""
+import time
+from typing import Dict, List
+
+from sqlalchemy import delete, select
+
+from shs_api import cache
+from shs_api import hotstate
+from shs_api import models
+from shs_api.retention import BATCH_PAUSE_SECONDS, DELETE_BATCH_ROWS
+
+ORPHAN_DEVICE_CHECK = 500  # Telemetry device ids checked against `devices` per query
+
+
+def house_children_deletes(house_id: str):
+    """(entity, DELETE ... RETURNING id) for a house's devices, rooms and owners, in execution order."""
+    rooms, devices, owners = models.Room.__table__, models.Device.__table__, models.HouseOwner.__table__
+    house_rooms = select(rooms.c.id).where(rooms.c.house_id == house_id)
+    return [
+        ("device", delete(devices).where(devices.c.room_id.in_(house_rooms)).returning(devices.c.id)),
+        ("room", delete(rooms).where(rooms.c.house_id == house_id).returning(rooms.c.id)),
+        ("house_owner", delete(owners).where(owners.c.house_id == house_id).returning(owners.c.user_id)),
+    ]
+
+
+def room_children_deletes(room_id: str):
+    devices = models.Device.__table__
+    return [("device", delete(devices).where(devices.c.room_id == room_id).returning(devices.c.id))]
+
+
+def user_children_deletes(user_id: str):
+    """A deleted user's house_owners rows; the houses' owner_ids keep the id, as for any unknown owner."""
+    owners = models.HouseOwner.__table__
+    return [("house_owner", delete(owners).where(owners.c.user_id == user_id).returning(owners.c.house_id))]
+
+
+def forget(removed: Dict[str, List[str]]):
+    """Drop deleted children from the entity cache and the device hot-state store."""
+    for entity in ("room", "device"):
+        cache.invalidate(entity, *removed.get(entity, ()))
+    for device_id in removed.get("device", ()):
+        hotstate.store.discard(device_id)
+
+
+def _sweep_table(engine, table: str, parent_table: str, parent_column: str, batch_size: int, pause: float) -> List[str]:
+    """Delete rows of `table` whose parent is missing, one primary-key range per transaction."""
+    deleted = []
+    last_id = ""
+    while True:
+        with engine.begin() as conn:
+            upper = conn.exec_driver_sql(
+                f"SELECT max(id) FROM (SELECT id FROM {table} WHERE id > ? ORDER BY id LIMIT ?)",
+                (last_id, batch_size),
+            ).scalar()
+            if upper is None:
+                return deleted
+            deleted += conn.exec_driver_sql(
+                f"DELETE FROM {table} WHERE id > ? AND id <= ? AND NOT EXISTS "
+                f"(SELECT 1 FROM {parent_table} p WHERE p.id = {table}.{parent_column}) RETURNING id",
+                (last_id, upper),
+            ).scalars().all()
+        last_id = upper
+        time.sleep(pause)
+
+
+def _orphan_telemetry_devices(engine, table: str):
+    """Yield chunks of device ids that have rows in `table` but no longer exist."""
+    last_id = ""
+    while True:
+        candidates = []
+        with engine.connect() as conn:
+            # Skip-scan of the (device_id, ...) index: one seek per distinct device
+            while len(candidates) < ORPHAN_DEVICE_CHECK:
+                device_id = conn.exec_driver_sql(
+                    f"SELECT device_id FROM {table} WHERE device_id > ? ORDER BY device_id LIMIT 1", (last_id,)
+                ).scalar()
+                if device_id is None:
+                    break
+                candidates.append(device_id)
+                last_id = device_id
+            if not candidates:
+                return
+            existing = set(conn.exec_driver_sql(
+                f"SELECT id FROM devices WHERE id IN ({', '.join('?' for _ in candidates)})", tuple(candidates)
+            ).scalars())
+        orphans = [device_id for device_id in candidates if device_id not in existing]
+        if orphans:
+            yield orphans
+
+
+def _delete_device_rows(engine, sql: str, device_id: str, batch_size: int, pause: float) -> int:
+    deleted = 0
+    while True:
+        with engine.begin() as conn:
+            removed = conn.exec_driver_sql(sql, (device_id, batch_size)).rowcount
+        deleted += removed
+        if removed < batch_size:
+            return deleted
+        time.sleep(pause)
+
+
+def purge_orphans(engine, batch_size: int = DELETE_BATCH_ROWS, pause: float = BATCH_PAUSE_SECONDS) -> dict:
+    """
+    Delete rooms without a house, devices without a room, and telemetry and
+    rollups without a device, in bounded transactions. Returns what was removed.
+    """
+    started = time.perf_counter()
+    # Rooms first, so devices of the rooms removed here are swept in the same pass
+    rooms = _sweep_table(engine, "rooms", "houses", "house_id", batch_size, pause)
+    devices = _sweep_table(engine, "devices", "rooms", "room_id", batch_size, pause)
+    forget({"room": rooms, "device": devices})
+
+    report = {"rooms_deleted": len(rooms), "devices_deleted": len(devices),
+              "readings_deleted": 0, "rollups_deleted": 0, "seconds": 0.0}
+    for orphans in _orphan_telemetry_devices(engine, "telemetry_readings"):
+        for device_id in orphans:
+            report["readings_deleted"] += _delete_device_rows(
+                engine,
+                "DELETE FROM telemetry_readings WHERE id IN "
+                "(SELECT id FROM telemetry_readings WHERE device_id = ? LIMIT ?)",
+                device_id, batch_size, pause,
+            )
+    for orphans in _orphan_telemetry_devices(engine, "telemetry_rollups"):
+        for device_id in orphans:
+            report["rollups_deleted"] += _delete_device_rows(
+                engine,
+                "DELETE FROM telemetry_rollups WHERE (device_id, resolution, bucket, metric) IN "
+                "(SELECT device_id, resolution, bucket, metric FROM telemetry_rollups WHERE device_id = ? LIMIT ?)",
+                device_id, batch_size, pause,
+            )
+    report["seconds"] = round(time.perf_counter() - started, 3)
+    return report
@@ -1,13 +1,110 @@
 # database.py
-from sqlalchemy import create_engine
+import os
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./smart_home.db"  
+from shs_api import metrics
+
+SQLALCHEMY_DATABASE_URL = os.getenv("SHS_DATABASE_URL", "sqlite:///./smart_home.db")
+# "sync" serves requests from FastAPI's threadpool; "async" switches the core
+# CRUD endpoints to an AsyncEngine (see shs_api/async_api.py)
+DB_MODE = os.getenv("SHS_DB_MODE", "sync").lower()
+DB_POOL_SIZE = int(os.getenv("SHS_DB_POOL_SIZE", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("SHS_DB_POOL_TIMEOUT", "120"))
+
+# PRAGMAs applied to every new SQLite connection, selected with SHS_SQLITE_PROFILE.
+# Individual values can be overridden with SHS_SQLITE_PRAGMAS="cache_size=-131072;mmap_size=0".
+SQLITE_PRAGMA_PROFILES = {
+    "default": {},
+    "production": {
+        # Lets the telemetry compactor return freed pages to the filesystem; only
+        # takes effect on databases created with it (existing ones need a VACUUM)
+        "auto_vacuum": "INCREMENTAL",
+        "journal_mode": "WAL",  # Readers no longer block on a writer
+        "synchronous": "NORMAL",  # WAL stays consistent; only the last commits can be lost on power failure
+        "mmap_size": 268435456,  # 256 MiB of memory-mapped reads
+        "cache_size": -65536,  # Negative values are KiB: 64 MiB page cache per connection
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,  # ms to wait for a lock before raising "database is locked"
+    },
+}
+SQLITE_PROFILE = os.getenv("SHS_SQLITE_PROFILE", "production").lower()
+
+
+def sqlite_pragmas(profile: str = SQLITE_PROFILE, overrides: str = os.getenv("SHS_SQLITE_PRAGMAS", "")) -> dict:
+    if profile not in SQLITE_PRAGMA_PROFILES:
+        raise ValueError(f"Invalid SHS_SQLITE_PROFILE: {profile!r} (expected one of {sorted(SQLITE_PRAGMA_PROFILES)})")
+    pragmas = dict(SQLITE_PRAGMA_PROFILES[profile])
+    for item in filter(None, (part.strip() for part in overrides.split(";"))):
+        name, _, value = item.partition("=")
+        pragmas[name.strip()] = value.strip()
+    return pragmas
+
+
+def apply_sqlite_pragmas(engine, pragmas: dict):
+    """Run `pragmas` on every connection `engine` opens (sync engines or AsyncEngine.sync_engine)."""
+    if engine.dialect.name != "sqlite" or not pragmas:
+        return
+
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+
+def is_memory_sqlite(url: str) -> bool:
+    return url.startswith("sqlite") and (":memory:" in url or url.split("://", 1)[1] in ("", "/"))
+
+
+engine_options = {}
+if not is_memory_sqlite(SQLALCHEMY_DATABASE_URL):
+    # Overflow is unbounded: get_db() sessions are closed on the same threadpool
+    # that runs the handlers, so with a hard pool limit every worker thread can
+    # end up waiting for a connection held by a request awaiting its teardown.
+    # SQLite connections are cheap and the threadpool already bounds concurrency.
+    engine_options = {"poolclass": QueuePool, "pool_size": DB_POOL_SIZE, "max_overflow": -1}
 
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}, **engine_options
 )
+ACTIVE_SQLITE_PRAGMAS = sqlite_pragmas()
+apply_sqlite_pragmas(engine, ACTIVE_SQLITE_PRAGMAS)
+metrics.instrument_engine(engine)  # Per-request DB time for /metrics
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
\ No newline at end of file
+Base = declarative_base()
+
+
+def make_async_engine(url: str = SQLALCHEMY_DATABASE_URL, **kwargs):
+    """Build an AsyncEngine for `url`, using the aiosqlite driver for sqlite URLs."""
+    # Imported lazily so the sync mode does not require aiosqlite/greenlet
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    if url.startswith("sqlite://"):
+        url = "sqlite+aiosqlite://" + url[len("sqlite://"):]
+    if "poolclass" not in kwargs and not is_memory_sqlite(url):
+        # Requests beyond the pool queue for a connection instead of failing after the default 30s
+        kwargs.update(pool_size=DB_POOL_SIZE, max_overflow=DB_POOL_SIZE, pool_timeout=DB_POOL_TIMEOUT)
+    return create_async_engine(url, **kwargs)
+
+
+def make_async_sessionmaker(bind):
+    from sqlalchemy.ext.asyncio import AsyncSession
+
+    # expire_on_commit=False: expired attributes cannot be lazy-loaded outside an await
+    return sessionmaker(bind=bind, class_=AsyncSession, autocommit=False, autoflush=False, expire_on_commit=False)
+
+
+async_engine = None
+AsyncSessionLocal = None
+if DB_MODE == "async":
+    async_engine = make_async_engine()
+    apply_sqlite_pragmas(async_engine.sync_engine, ACTIVE_SQLITE_PRAGMAS)
+    metrics.instrument_engine(async_engine.sync_engine)
+    AsyncSessionLocal = make_async_sessionmaker(async_engine)
+elif DB_MODE != "sync":
+    raise ValueError(f"Invalid SHS_DB_MODE: {DB_MODE!r} (expected 'sync' or 'async')")
@@ -0,0 +1,202 @@
+# geo.py
+"""Geohash index for house locations, with nearby and bounding-box queries served by range scans of it."""
+import heapq
+import math
+from typing import List, Optional, Tuple
+
+from sqlalchemy import and_, event, func, or_, select, tuple_
+from sqlalchemy.engine import Engine
+
+from shs_api import models
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+GEOHASH_PRECISION = 10
+MAX_COVER_CELLS = 16  # Geohash cells a bounding box is covered with, before merging adjacent ones
+EARTH_RADIUS_KM = 6371.0088
+MAX_RADIUS_KM = 20000.0  # Half the circumference: the whole planet
+
+# (min_lat, min_lon, max_lat, max_lon), with min_lon <= max_lon
+Box = Tuple[float, float, float, float]
+
+
+def _cells(precision: int) -> Tuple[int, int]:
+    """(latitude, longitude) cells per axis; longitude takes the odd bit."""
+    bits = 5 * precision
+    return 1 << (bits // 2), 1 << ((bits + 1) // 2)
+
+
+def _cell_index(value: float, low: float, span: float, cells: int) -> int:
+    return min(max(int((value - low) / span * cells), 0), cells - 1)
+
+
+def _code(lat_index: int, lon_index: int, precision: int) -> int:
+    """Interleave the cell indexes, longitude bit first, into a geohash's integer value."""
+    bits = 5 * precision
+    lat_bits, lon_bits = bits // 2, (bits + 1) // 2
+    code = 0
+    for position in range(bits):
+        if position % 2 == 0:
+            bit = (lon_index >> (lon_bits - 1 - position // 2)) & 1
+        else:
+            bit = (lat_index >> (lat_bits - 1 - position // 2)) & 1
+        code = (code << 1) | bit
+    return code
+
+
+def _text(code: int, precision: int) -> str:
+    return "".join(BASE32[(code >> (5 * (precision - 1 - n))) & 31] for n in range(precision))
+
+
+def encode(latitude: float, longitude: float, precision: int = GEOHASH_PRECISION) -> str:
+    """Geohash of a point; coordinates outside the valid range are clamped to it."""
+    lat_cells, lon_cells = _cells(precision)
+    return _text(_code(_cell_index(latitude, -90.0, 180.0, lat_cells),
+                       _cell_index(longitude, -180.0, 360.0, lon_cells), precision), precision)
+
+
+@event.listens_for(Engine, "connect")
+def register_sqlite_functions(dbapi_connection, connection_record):
+    """Make geohash_encode() available on every new SQLite connection, sync or async."""
+    if hasattr(dbapi_connection, "create_function"):
+        dbapi_connection.create_function("geohash_encode", 2, encode, deterministic=True)
+
+
+def geohash_change(changes: dict) -> dict:
+    """
+    The geohash SET clause for an update of `changes`: a coordinate that is
+    not being changed is read from the row by the same UPDATE.
+    """
+    latitude, longitude = changes.get("latitude"), changes.get("longitude")
+    if latitude is None and longitude is None:
+        return {}  # Nothing moves (a null coordinate is rejected by the update itself)
+    return {"geohash": func.geohash_encode(
+        models.House.latitude if latitude is None else latitude,
+        models.House.longitude if longitude is None else longitude,
+    )}
+
+
+def _cover_box(box: Box) -> List[Tuple[str, str]]:
+    """[low, high) geohash ranges whose cells cover `box`."""
+    min_lat, min_lon, max_lat, max_lon = box
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        lat_cells, lon_cells = _cells(precision)
+        lat_range = range(_cell_index(min_lat, -90.0, 180.0, lat_cells),
+                          _cell_index(max_lat, -90.0, 180.0, lat_cells) + 1)
+        lon_range = range(_cell_index(min_lon, -180.0, 360.0, lon_cells),
+                          _cell_index(max_lon, -180.0, 360.0, lon_cells) + 1)
+        if len(lat_range) * len(lon_range) <= MAX_COVER_CELLS:
+            break
+    else:
+        return [("", "{")]  # '{' sorts after every base32 character
+    codes = sorted(_code(i, j, precision) for i in lat_range for j in lon_range)
+    ranges = []
+    first = last = codes[0]
+    for code in codes[1:] + [None]:
+        if code == last + 1:
+            last = code
+            continue
+        ranges.append((_text(first, precision), _text(last, precision) + "{"))
+        first = last = code
+    return ranges
+
+
+def _merge(ranges: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+    merged = []
+    for low, high in sorted(ranges):
+        if merged and low <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(high, merged[-1][1]))
+        else:
+            merged.append((low, high))
+    return merged
+
+
+def split_box(min_lat: float, min_lon: float, max_lat: float, max_lon: float) -> List[Box]:
+    """A box as one or two boxes; min_lon > max_lon means it crosses the antimeridian."""
+    if min_lon > max_lon:
+        return [(min_lat, min_lon, max_lat, 180.0), (min_lat, -180.0, max_lat, max_lon)]
+    return [(min_lat, min_lon, max_lat, max_lon)]
+
+
+def radius_boxes(latitude: float, longitude: float, radius_km: float) -> List[Box]:
+    """Bounding boxes of the circle of `radius_km` around a point."""
+    angular = radius_km / EARTH_RADIUS_KM
+    min_lat, max_lat = latitude - math.degrees(angular), latitude + math.degrees(angular)
+    if min_lat <= -90.0 or max_lat >= 90.0:
+        return [(max(min_lat, -90.0), -180.0, min(max_lat, 90.0), 180.0)]  # Reaches a pole
+    spread = math.sin(angular) / math.cos(math.radians(latitude))
+    if spread >= 1.0:
+        return [(min_lat, -180.0, max_lat, 180.0)]
+    delta = math.degrees(math.asin(spread))
+    min_lon, max_lon = longitude - delta, longitude + delta
+    if min_lon < -180.0:
+        return split_box(min_lat, min_lon + 360.0, max_lat, max_lon)
+    if max_lon > 180.0:
+        return split_box(min_lat, min_lon, max_lat, max_lon - 360.0)
+    return [(min_lat, min_lon, max_lat, max_lon)]
+
+
+def distance_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle (haversine) distance."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    a = (math.sin((phi2 - phi1) / 2) ** 2
+         + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _in_boxes(boxes: List[Box]):
+    house = models.House
+    return or_(*[
+        and_(house.latitude.between(min_lat, max_lat), house.longitude.between(min_lon, max_lon))
+        for min_lat, min_lon, max_lat, max_lon in boxes
+    ])
+
+
+def _candidates(boxes: List[Box], *columns):
+    """Select `columns` of the houses in `boxes`, one range scan of the geohash index per covering range."""
+    house = models.House
+    ranges = _merge([r for box in boxes for r in _cover_box(box)])
+    return (
+        select(*columns)
+        .where(or_(*[and_(house.geohash >= low, house.geohash < high) for low, high in ranges]))
+        .where(_in_boxes(boxes))
+    )
+
+
+def houses_in_box(db, boxes: List[Box], after: Optional[Tuple[str, str]], limit: int) -> List:
+    """
+    Up to `limit` houses inside `boxes`, in (geohash, id) order starting after
+    the `after` key. Returns (house, geohash) pairs.
+    """
+    house = models.House
+    ranges = _merge([r for box in boxes for r in _cover_box(box)])
+    keys = []
+    for low, high in ranges:
+        if after is not None and high <= after[0]:
+            continue
+        stmt = (
+            select(house.geohash, house.id)
+            .where(house.geohash >= low, house.geohash < high, _in_boxes(boxes))
+            .order_by(house.geohash, house.id)
+            .limit(limit - len(keys))
+        )
+        if after is not None:
+            stmt = stmt.where(tuple_(house.geohash, house.id) > tuple_(*after))
+        keys += db.execute(stmt).all()
+        if len(keys) >= limit:
+            break
+    houses = {h.id: h for h in db.execute(select(house).where(house.id.in_([k.id for k in keys]))).scalars()}
+    return [(houses[k.id], k.geohash) for k in keys if k.id in houses]
+
+
+def nearest_houses(db, latitude: float, longitude: float, radius_km: float, limit: int) -> List:
+    """Up to `limit` (house, distance_km) pairs within `radius_km` of a point, nearest first."""
+    house = models.House
+    candidates = db.execute(_candidates(
+        radius_boxes(latitude, longitude, radius_km), house.id, house.latitude, house.longitude,
+    ))
+    nearest = heapq.nsmallest(limit, (
+        (distance, house_id) for house_id, lat, lon in candidates
+        if (distance := distance_km(latitude, longitude, lat, lon)) <= radius_km
+    ))
+    houses = {h.id: h for h in db.execute(select(house).where(house.id.in_([i for _, i in nearest]))).scalars()}
+    return [(houses[house_id], distance) for distance, house_id in nearest if house_id in houses]
@@ -0,0 +1,291 @@
+# hotstate.py
+"""In-process device status, logged before each write is acknowledged and written back to `devices` in batches."""
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+MAX_LAST_DATA_BYTES = 1024  # Larger readings belong in telemetry
+WRITEBACK_INTERVAL_SECONDS = float(os.getenv("SHS_HOTSTATE_WRITEBACK_SECONDS", "5"))
+SYNC_MODE = os.getenv("SHS_HOTSTATE_SYNC", "normal").lower()
+LOG_PATH = os.getenv("SHS_HOTSTATE_LOG")  # Defaults to <database file>-status.log
+LOAD_CHUNK = 5000
+REFRESH_CHUNK = 500
+
+# Status always wins; last_data only if the row has nothing newer (e.g. from telemetry)
+_WRITEBACK = (
+    "UPDATE devices SET status = ?, "
+    "last_data = CASE WHEN last_updated IS NULL OR last_updated <= ? THEN ? ELSE last_data END, "
+    "last_updated = CASE WHEN last_updated IS NULL OR last_updated <= ? THEN ? ELSE last_updated END "
+    "WHERE id = ?"
+)
+
+
+def _now_text() -> str:
+    # Same text format SQLAlchemy uses for DateTime columns on SQLite
+    return datetime.now(timezone.utc).replace(tzinfo=None).isoformat(" ", "microseconds")
+
+
+def _ts_text(value) -> Optional[str]:
+    if value is None or isinstance(value, str):
+        return value
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.isoformat(" ", "microseconds")
+
+
+class DeviceState:
+    """One device's hot state; timestamps and last_data are kept as their stored text"""
+    __slots__ = ("status", "last_updated", "last_data")
+
+    def __init__(self, status: bool, last_updated: Optional[str], last_data: str):
+        self.status = status
+        self.last_updated = last_updated
+        self.last_data = last_data
+
+    def to_dict(self, device_id: str) -> dict:
+        return {
+            "device_id": device_id,
+            "status": self.status,
+            "last_updated": datetime.fromisoformat(self.last_updated) if self.last_updated else None,
+            "last_data": json.loads(self.last_data),
+        }
+
+
+class HotStateStore:
+    """Status table for every device, backed by an append-only log and periodic writeback"""
+
+    def __init__(self, log_path: Optional[str] = LOG_PATH, sync_mode: str = SYNC_MODE,
+                 writeback_interval: float = WRITEBACK_INTERVAL_SECONDS):
+        if sync_mode not in ("normal", "full"):
+            raise ValueError(f"Invalid SHS_HOTSTATE_SYNC: {sync_mode!r} (expected 'normal' or 'full')")
+        self.log_path = log_path
+        self.sync_mode = sync_mode
+        self.writeback_interval = writeback_interval
+        self.engine = None
+        self._states: Dict[str, DeviceState] = {}
+        self._dirty = set()
+        self._log = None
+        self._lock = threading.RLock()
+        self._writeback_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.engine is not None
+
+    # Loading and recovery
+    def ensure_loaded(self, engine):
+        """Load the table from `engine` and replay the log, once."""
+        if self.engine is not None:
+            return
+        with self._lock:
+            if self.engine is not None:
+                return
+            if self.log_path is None:
+                database = engine.url.database
+                if database and database != ":memory:":
+                    self.log_path = f"{database}-status.log"
+            self._load(engine)
+            if self.log_path:
+                for path in (self.log_path + ".1", self.log_path):
+                    self._replay(path)
+                self._log = open(self.log_path, "a", encoding="utf-8")
+            self.engine = engine
+        self.writeback()  # Fold anything recovered from the log into the database
+        if self.writeback_interval > 0 and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="device-hotstate", daemon=True)
+            self._thread.start()
+
+    def _load(self, engine):
+        last_id = ""
+        while True:
+            with engine.connect() as conn:
+                rows = conn.exec_driver_sql(
+                    "SELECT id, status, last_updated, last_data FROM devices WHERE id > ? ORDER BY id LIMIT ?",
+                    (last_id, LOAD_CHUNK),
+                ).all()
+            if not rows:
+                return
+            for device_id, status, last_updated, last_data in rows:
+                self._states[device_id] = DeviceState(bool(status), last_updated, last_data or "{}")
+            last_id = rows[-1][0]
+
+    def _replay(self, path: str):
+        try:
+            log = open(path, encoding="utf-8")
+        except FileNotFoundError:
+            return
+        with log:
+            for line in log:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break  # Torn final write; nothing after it was acknowledged
+                state = self._states.get(entry["id"])
+                if state is None:
+                    continue  # Deleted since
+                state.status = entry["s"]
+                state.last_updated = entry["t"]
+                if entry["d"] is not None:
+                    state.last_data = entry["d"]
+                self._dirty.add(entry["id"])
+
+    # Reads
+    def get(self, device_id: str) -> Optional[dict]:
+        state = self._states.get(device_id)
+        return state.to_dict(device_id) if state is not None else None
+
+    def overlay(self, device_id: str, payload: dict) -> dict:
+        """Return a device response payload with the hot state laid over it."""
+        state = self._states.get(device_id)
+        if state is None:
+            return payload
+        hot = state.to_dict(device_id)
+        del hot["device_id"]
+        return {**payload, **hot}
+
+    # Writes
+    def set_status(self, device_id: str, status: bool, data: Optional[dict] = None) -> Optional[dict]:
+        """Record a status change (and optionally new last_data); None if the device is unknown."""
+        data_text = None
+        if data is not None:
+            data_text = json.dumps(data, separators=(",", ":"))
+            if len(data_text) > MAX_LAST_DATA_BYTES:
+                raise ValueError(f"last_data exceeds {MAX_LAST_DATA_BYTES} bytes")
+        with self._lock:
+            state = self._states.get(device_id)
+            if state is None:
+                return None
+            ts = _now_text()
+            self._append(device_id, status, ts, data_text)
+            state.status = status
+            state.last_updated = ts
+            if data_text is not None:
+                state.last_data = data_text
+            self._dirty.add(device_id)
+            return state.to_dict(device_id)
+
+    def record(self, device_ids: Iterable[str], status: bool):
+        """Mirror a status already committed to SQL, so a replayed log cannot undo it."""
+        if not self.loaded:
+            return
+        with self._lock:
+            ts = _now_text()
+            for device_id in device_ids:
+                state = self._states.get(device_id)
+                if state is not None:
+                    self._append(device_id, status, ts, None)
+                    state.status = status
+                    state.last_updated = ts
+                    self._dirty.add(device_id)
+
+    def track(self, device_id: str, status: bool, last_updated, last_data: dict):
+        """Add a newly created device."""
+        if not self.loaded:
+            return
+        with self._lock:
+            self._states[device_id] = DeviceState(status, _ts_text(last_updated), json.dumps(last_data))
+
+    def discard(self, device_id: str):
+        with self._lock:
+            self._states.pop(device_id, None)
+            self._dirty.discard(device_id)
+
+    def refresh(self, db, device_ids: Iterable[str]):
+        """Pick up last_data/last_updated that were written to SQL directly (telemetry)."""
+        if not self.loaded:
+            return
+        device_ids = [device_id for device_id in device_ids if device_id in self._states]
+        connection = db.connection()
+        for start in range(0, len(device_ids), REFRESH_CHUNK):
+            chunk = device_ids[start:start + REFRESH_CHUNK]
+            rows = connection.exec_driver_sql(
+                f"SELECT id, last_updated, last_data FROM devices WHERE id IN ({', '.join('?' for _ in chunk)})",
+                tuple(chunk),
+            ).all()
+            with self._lock:
+                for device_id, last_updated, last_data in rows:
+                    state = self._states.get(device_id)
+                    if state is None or last_updated is None:
+                        continue
+                    if state.last_updated is None or last_updated > state.last_updated:
+                        state.last_updated = last_updated
+                        state.last_data = last_data
+
+    def _append(self, device_id: str, status: bool, ts: str, data_text: Optional[str]):
+        # Caller holds self._lock, so log order matches the order changes were applied
+        if self._log is None:
+            return
+        self._log.write(json.dumps({"id": device_id, "s": status, "t": ts, "d": data_text}) + "\n")
+        self._log.flush()
+        if self.sync_mode == "full":
+            os.fsync(self._log.fileno())
+
+    # Writeback
+    def writeback(self) -> int:
+        """Write dirty entries to the devices table; returns how many were written."""
+        if not self.loaded:
+            return 0
+        with self._writeback_lock:
+            with self._lock:
+                if not self._dirty:
+                    return 0
+                rows = []
+                for device_id in self._dirty:
+                    state = self._states.get(device_id)
+                    if state is not None:
+                        rows.append((state.status, state.last_updated, state.last_data,
+                                     state.last_updated, state.last_updated, device_id))
+                self._dirty = set()
+                self._rotate_log()
+            try:
+                with self.engine.begin() as conn:
+                    conn.exec_driver_sql(_WRITEBACK, rows)
+            except Exception:
+                # Keep the rotated segment for recovery and retry these devices next time
+                with self._lock:
+                    self._dirty.update(row[-1] for row in rows)
+                raise
+            if self.log_path and os.path.exists(self.log_path + ".1"):
+                os.remove(self.log_path + ".1")  # Everything it recorded is committed now
+            return len(rows)
+
+    def _rotate_log(self):
+        # Caller holds self._lock
+        if self._log is None or os.path.exists(self.log_path + ".1"):
+            return  # A previous writeback failed; keep appending until one succeeds
+        self._log.flush()
+        os.fsync(self._log.fileno())
+        self._log.close()
+        os.replace(self.log_path, self.log_path + ".1")
+        self._log = open(self.log_path, "a", encoding="utf-8")
+
+    def _run(self):
+        while not self._stop.wait(self.writeback_interval):
+            try:
+                self.writeback()
+            except Exception:
+                logger.exception("Device status writeback failed")
+
+    def close(self):
+        """Stop the writeback thread and flush everything to the database."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(10.0)
+            self._thread = None
+        try:
+            self.writeback()
+        finally:
+            with self._lock:
+                if self._log is not None:
+                    self._log.close()
+                    self._log = None
+
+
+store = HotStateStore()
@@ -0,0 +1,113 @@
+# house_stats.py
+"""Trigger-maintained per-house room, floor area and device counts."""
+from sqlalchemy import DDL, event, select
+
+from shs_api import models
+from shs_api.database import Base
+
+_ROOM_HOUSE = "(SELECT house_id FROM rooms WHERE id = {device}.room_id)"
+
+_ADD_ROOM = (
+    "INSERT INTO house_stats (house_id, rooms, floor_area) VALUES (new.house_id, 1, new.size) "
+    "ON CONFLICT (house_id) DO UPDATE SET rooms = rooms + 1, floor_area = floor_area + excluded.floor_area;"
+)
+_REMOVE_ROOM = (
+    "UPDATE house_stats SET rooms = rooms - 1, floor_area = floor_area - old.size WHERE house_id = old.house_id;"
+)
+_ADD_DEVICE = (
+    "INSERT INTO house_device_stats (house_id, type, devices, active_devices) "
+    "SELECT house_id, new.type, 1, new.status FROM rooms WHERE id = new.room_id "
+    "ON CONFLICT (house_id, type) DO UPDATE SET devices = devices + 1, "
+    "active_devices = active_devices + excluded.active_devices;"
+)
+_REMOVE_DEVICE = (
+    "UPDATE house_device_stats SET devices = devices - 1, active_devices = active_devices - old.status "
+    f"WHERE house_id = {_ROOM_HOUSE.format(device='old')} AND type = old.type;"
+)
+# A room's devices, taken from or added to a house's totals when the room goes or moves
+_REMOVE_ROOM_DEVICES = (
+    "UPDATE house_device_stats SET "
+    "devices = devices - (SELECT count(*) FROM devices WHERE room_id = old.id AND type = house_device_stats.type), "
+    "active_devices = active_devices - "
+    "(SELECT total(status) FROM devices WHERE room_id = old.id AND type = house_device_stats.type) "
+    "WHERE house_id = old.house_id AND type IN (SELECT type FROM devices WHERE room_id = old.id);"
+)
+_ADD_ROOM_DEVICES = (
+    "INSERT INTO house_device_stats (house_id, type, devices, active_devices) "
+    "SELECT new.house_id, type, count(*), sum(status) FROM devices WHERE room_id = new.id GROUP BY type "
+    "ON CONFLICT (house_id, type) DO UPDATE SET devices = devices + excluded.devices, "
+    "active_devices = active_devices + excluded.active_devices;"
+)
+
+TRIGGERS = [
+    f"CREATE TRIGGER IF NOT EXISTS house_stats_room_ai AFTER INSERT ON rooms BEGIN {_ADD_ROOM} END",
+    # Room deletes remove the room first and its devices after (see cascade.room_children_deletes), so the
+    # room's devices are all still there to subtract here. Their own delete triggers then find no room to
+    # resolve a house from and change nothing; the same holds for devices the orphan purge removes later.
+    f"CREATE TRIGGER IF NOT EXISTS house_stats_room_ad AFTER DELETE ON rooms BEGIN {_REMOVE_ROOM} "
+    f"{_REMOVE_ROOM_DEVICES} END",
+    f"CREATE TRIGGER IF NOT EXISTS house_stats_room_au AFTER UPDATE OF house_id, size ON rooms "
+    f"WHEN old.house_id IS NOT new.house_id OR old.size IS NOT new.size BEGIN {_REMOVE_ROOM} {_ADD_ROOM} END",
+    f"CREATE TRIGGER IF NOT EXISTS house_stats_room_moved AFTER UPDATE OF house_id ON rooms "
+    f"WHEN old.house_id IS NOT new.house_id BEGIN {_REMOVE_ROOM_DEVICES} {_ADD_ROOM_DEVICES} END",
+    f"CREATE TRIGGER IF NOT EXISTS house_stats_device_ai AFTER INSERT ON devices BEGIN {_ADD_DEVICE} END",
+    f"CREATE TRIGGER IF NOT EXISTS house_stats_device_ad AFTER DELETE ON devices BEGIN {_REMOVE_DEVICE} END",
+    # Commands and PUTs often rewrite a device's status or room unchanged; those cost nothing here
+    f"CREATE TRIGGER IF NOT EXISTS house_stats_device_au AFTER UPDATE OF room_id, type, status ON devices "
+    f"WHEN old.room_id IS NOT new.room_id OR old.type IS NOT new.type OR old.status IS NOT new.status "
+    f"BEGIN {_REMOVE_DEVICE} {_ADD_DEVICE} END",
+    "CREATE TRIGGER IF NOT EXISTS house_stats_house_ad AFTER DELETE ON houses BEGIN "
+    "DELETE FROM house_stats WHERE house_id = old.id; DELETE FROM house_device_stats WHERE house_id = old.id; END",
+]
+
+for _statement in TRIGGERS:
+    event.listen(Base.metadata, "after_create", DDL(_statement).execute_if(dialect="sqlite"))
+
+# Each fills its (empty) table in one grouped pass over rooms / devices
+REBUILD_STATEMENTS = {
+    "house_stats": (
+        "INSERT INTO house_stats (house_id, rooms, floor_area) "
+        "SELECT house_id, count(*), total(size) FROM rooms WHERE house_id IN (SELECT id FROM houses) "
+        "GROUP BY house_id"
+    ),
+    "house_device_stats": (
+        "INSERT INTO house_device_stats (house_id, type, devices, active_devices) "
+        "SELECT rooms.house_id, devices.type, count(*), sum(devices.status) FROM devices "
+        "JOIN rooms ON rooms.id = devices.room_id WHERE rooms.house_id IN (SELECT id FROM houses) "
+        "GROUP BY rooms.house_id, devices.type"
+    ),
+}
+
+
+def rebuild(engine):
+    """Recompute every house's stats from rooms and devices, in one transaction."""
+    with engine.begin() as conn:
+        for table, statement in REBUILD_STATEMENTS.items():
+            conn.exec_driver_sql(f"DELETE FROM {table}")
+            conn.exec_driver_sql(statement)
+
+
+def for_house(db, house_id: str) -> dict:
+    """The stats of one house (zeros for a house without rooms); the caller checks that it exists."""
+    totals, by_type = models.HouseStats.__table__, models.HouseDeviceStats.__table__
+    room_totals = db.execute(
+        select(totals.c.rooms, totals.c.floor_area).where(totals.c.house_id == house_id)
+    ).first()
+    device_counts = db.execute(
+        select(by_type.c.type, by_type.c.devices, by_type.c.active_devices)
+        .where(by_type.c.house_id == house_id, by_type.c.devices > 0)
+    ).all()
+    return {
+        "house_id": house_id,
+        "rooms": room_totals.rooms if room_totals else 0,
+        "floor_area": round(room_totals.floor_area, 6) if room_totals else 0.0,
+        "devices": sum(row.devices for row in device_counts),
+        "active_devices": sum(row.active_devices for row in device_counts),
+        "devices_by_type": {row.type: row.devices for row in device_counts},
+        "active_devices_by_type": {row.type: row.active_devices for row in device_counts if row.active_devices},
+    }
+
+
+if __name__ == "__main__":
+    from shs_api.database import engine
+    rebuild(engine)
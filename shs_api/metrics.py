@@ -0,0 +1,216 @@
+# metrics.py
+"""Per-route request metrics in Prometheus text format, and per-request SQL statement counts."""
+import logging
+import os
+import re
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import event
+
+from shs_api import slowlog
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+UNMATCHED_ROUTE = "<unmatched>"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEBUG_HEADERS = os.getenv("SHS_DEBUG", "").lower() in ("1", "true", "yes")
+REPEATED_STATEMENT_THRESHOLD = int(os.getenv("SHS_REPEATED_STATEMENT_THRESHOLD", "20"))
+
+logger = logging.getLogger(__name__)
+
+# Placeholder lists of any length, e.g. expanded IN (...) and multi-row VALUES
+_PLACEHOLDER_LIST = re.compile(r"\?(?:, \?)+")
+_ROW_LIST = re.compile(r"\(\?\)(?:, \(\?\))+")
+
+
+def statement_shape(statement: str) -> str:
+    """`statement` with every list of bound parameters collapsed to one, so IN lists of any size share a shape."""
+    return _ROW_LIST.sub("(?)", _PLACEHOLDER_LIST.sub("?", statement))
+
+
+class RequestStats:
+    """Database work done on behalf of one request"""
+    __slots__ = ("scope", "db_seconds", "queries", "statements")
+
+    def __init__(self, scope: dict):
+        self.scope = scope
+        self.db_seconds = 0.0
+        self.queries = 0
+        self.statements: Dict[str, int] = {}  # Executions per SQL text
+
+    @property
+    def route(self) -> str:
+        route = self.scope.get("route")
+        return route.path if route is not None else UNMATCHED_ROUTE
+
+    def repeated(self, threshold: int = REPEATED_STATEMENT_THRESHOLD) -> Dict[str, int]:
+        """Statement shapes executed more than `threshold` times."""
+        if self.queries <= threshold:
+            return {}
+        shapes: Dict[str, int] = {}
+        for statement, count in self.statements.items():
+            shape = statement_shape(statement)
+            shapes[shape] = shapes.get(shape, 0) + count
+        return {shape: count for shape, count in shapes.items() if count > threshold}
+
+
+current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request", default=None)
+
+
+def instrument_engine(engine):
+    """Time every statement `engine` executes into the current request's stats (sync or AsyncEngine.sync_engine)."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info["query_started"] = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def stop_timer(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info.pop("query_started")
+        stats = current_request.get()
+        if stats is not None:
+            stats.db_seconds += elapsed
+            stats.queries += 1
+            stats.statements[statement] = stats.statements.get(statement, 0) + 1
+        if elapsed >= slowlog.sink.threshold:
+            route = f"{stats.scope['method']} {stats.route}" if stats is not None else None
+            slowlog.sink.observe(conn, statement_shape(statement), statement, parameters, executemany, elapsed, route)
+
+
+class _Series:
+    """Histogram buckets (non-cumulative) plus sum and count"""
+    __slots__ = ("buckets", "total", "count")
+
+    def __init__(self, size: int):
+        self.buckets = [0] * size
+        self.total = 0.0
+        self.count = 0
+
+
+class Metrics:
+    """Request metrics, updated and read on the event loop thread only"""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.in_flight = 0
+        # (route, method, status) -> values
+        self.latency: Dict[Tuple[str, str, int], _Series] = {}
+        self.db_time: Dict[Tuple[str, str, int], _Series] = {}
+        self.queries: Dict[Tuple[str, str, int], int] = {}
+        self.request_bytes: Dict[Tuple[str, str, int], int] = {}
+        self.response_bytes: Dict[Tuple[str, str, int], int] = {}
+        self.repeated_statements: Dict[Tuple[str, str, int], int] = {}
+
+    def _observe(self, series: Dict, key, value: float):
+        entry = series.get(key)
+        if entry is None:
+            entry = series[key] = _Series(len(self.buckets) + 1)
+        entry.buckets[bisect_left(self.buckets, value)] += 1
+        entry.total += value
+        entry.count += 1
+
+    def record(self, route: str, method: str, status: int, seconds: float,
+               stats: RequestStats, request_bytes: int, response_bytes: int):
+        key = (route, method, status)
+        self._observe(self.latency, key, seconds)
+        self._observe(self.db_time, key, stats.db_seconds)
+        self.queries[key] = self.queries.get(key, 0) + stats.queries
+        self.request_bytes[key] = self.request_bytes.get(key, 0) + request_bytes
+        self.response_bytes[key] = self.response_bytes.get(key, 0) + response_bytes
+        repeated = stats.repeated() if stats.queries > REPEATED_STATEMENT_THRESHOLD else None
+        if repeated:
+            self.repeated_statements[key] = self.repeated_statements.get(key, 0) + 1
+            for shape, count in repeated.items():
+                logger.warning("%s %s ran the same statement %d times (possible N+1): %s", method, route, count, shape)
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        lines = [
+            "# HELP shs_http_requests_in_flight Requests being handled.",
+            "# TYPE shs_http_requests_in_flight gauge",
+            f"shs_http_requests_in_flight {self.in_flight}",
+        ]
+        for name, attr, help_text in (
+            ("shs_http_request_duration_seconds", "latency", "Request latency by route, method and status."),
+            ("shs_http_request_db_seconds", "db_time", "Time each request spent executing SQL."),
+        ):
+            histograms = getattr(self, attr)
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+            for key in sorted(histograms):
+                series, labels = histograms[key], _labels(key)
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), series.buckets):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+                lines.append(f"{name}_sum{{{labels}}} {series.total!r}")
+                lines.append(f"{name}_count{{{labels}}} {series.count}")
+        for name, attr, help_text in (
+            ("shs_db_queries_total", "queries", "SQL statements executed by requests."),
+            ("shs_http_request_bytes_total", "request_bytes", "Request body bytes received."),
+            ("shs_http_response_bytes_total", "response_bytes", "Response body bytes sent."),
+            ("shs_db_repeated_statement_requests_total", "repeated_statements",
+             "Requests that repeated a statement shape more than the N+1 threshold."),
+        ):
+            counters = getattr(self, attr)
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+            lines += [f"{name}{{{_labels(key)}}} {counters[key]}" for key in sorted(counters)]
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(key: Tuple[str, str, int]) -> str:
+    route, method, status = key
+    return f'route="{_escape(route)}",method="{method}",status="{status}"'
+
+
+registry = Metrics()
+
+
+class MetricsMiddleware:
+    """ASGI middleware feeding `metrics` (the module registry by default)"""
+
+    def __init__(self, app, metrics: Metrics = registry):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats(scope)
+        token = current_request.set(stats)
+        self.metrics.in_flight += 1
+        started = time.perf_counter()
+        sizes = [0, 0, 500]  # Request bytes, response bytes, status (500 unless a response starts)
+
+        async def counting_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                sizes[0] += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            if message["type"] == "http.response.body":
+                sizes[1] += len(message.get("body", b""))
+            elif message["type"] == "http.response.start":
+                sizes[2] = message["status"]
+                if DEBUG_HEADERS:
+                    message = dict(message, headers=list(message.get("headers", [])) + [
+                        (b"x-db-queries", str(stats.queries).encode()),
+                        (b"x-db-time", f"{stats.db_seconds * 1000:.3f}".encode()),
+                    ])
+            await send(message)
+
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.metrics.in_flight -= 1
+            self.metrics.record(stats.route, scope["method"], sizes[2], elapsed, stats, sizes[0], sizes[1])
+            current_request.reset(token)
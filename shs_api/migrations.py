@@ -0,0 +1,81 @@
+# migrations.py
+from sqlalchemy import inspect
+from sqlalchemy.schema import CreateColumn
+
+from shs_api import geo  # noqa: F401  (registers the SQL functions backfills use)
+from shs_api import house_stats
+from shs_api import models  # noqa: F401  (registers all tables on Base.metadata)
+from shs_api import search
+from shs_api.database import Base
+
+# Run once, in order, when the table they fill is first created on an existing database
+BACKFILLS = {
+    "house_owners": [
+        "INSERT OR IGNORE INTO house_owners (user_id, house_id) "
+        "SELECT owner.value, houses.id FROM houses, json_each(houses.owner_ids) AS owner"
+    ],
+    **{index.keys: search.rebuild_statements(index) for index in search.SEARCH_INDEXES.values()},
+    **{table: [statement] for table, statement in house_stats.REBUILD_STATEMENTS.items()},
+}
+
+# Run once, when the column they fill is first added to an existing table
+COLUMN_BACKFILLS = {
+    ("houses", "geohash"): "UPDATE houses SET geohash = geohash_encode(latitude, longitude)",
+}
+
+# Indexes that older schemas created and the models no longer declare.
+# ix_<table>_id duplicated the primary-key index and doubled id maintenance on every insert.
+DROPPED_INDEXES = ["ix_users_id", "ix_houses_id", "ix_rooms_id", "ix_devices_id"]
+
+# Updates, deletes and creates rely on INSERT/UPDATE/DELETE ... RETURNING
+MIN_SQLITE_VERSION = (3, 35, 0)
+
+
+def upgrade(engine):
+    """
+    Bring a database up to date with the current models.
+
+    `create_all` only creates missing tables, so columns and indexes that were
+    added to existing tables are applied here. Every step is idempotent and
+    safe to run at each startup.
+    """
+    if engine.dialect.name == "sqlite" and engine.dialect.dbapi.sqlite_version_info < MIN_SQLITE_VERSION:
+        raise RuntimeError(f"SQLite {engine.dialect.dbapi.sqlite_version} is too old; "
+                           f"{'.'.join(map(str, MIN_SQLITE_VERSION))} or later is required for RETURNING")
+    existing_tables = set(inspect(engine).get_table_names())
+    # Older search indexes were keyed on their tables' rowids, which a VACUUM may renumber;
+    # they are replaced by keyed ones, which the backfill of their keys table then fills
+    stale_indexes = [index for index in search.SEARCH_INDEXES.values()
+                     if index.name in existing_tables and index.keys not in existing_tables]
+    if stale_indexes:
+        with engine.begin() as conn:
+            for index in stale_indexes:
+                for statement in search.drop_statements(index):
+                    conn.exec_driver_sql(statement)
+    Base.metadata.create_all(bind=engine)
+    inspector = inspect(engine)
+    added_columns = set()
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_ddl = CreateColumn(column).compile(dialect=engine.dialect)
+                    conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {column_ddl}")
+                    added_columns.add((table.name, column.name))
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
+        for index_name in DROPPED_INDEXES:
+            conn.exec_driver_sql(f"DROP INDEX IF EXISTS {index_name}")
+        for table_name, statements in BACKFILLS.items():
+            if table_name not in existing_tables:
+                for statement in statements:
+                    conn.exec_driver_sql(statement)
+        for column_key, backfill in COLUMN_BACKFILLS.items():
+            if column_key in added_columns:
+                conn.exec_driver_sql(backfill)
+
+
+if __name__ == "__main__":
+    from shs_api.database import engine
+    upgrade(engine)
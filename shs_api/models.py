@@ -1,5 +1,5 @@
 # models.py
-from sqlalchemy import Column, String, DateTime, Integer, Float, Boolean, JSON
+from sqlalchemy import Column, String, DateTime, Integer, Float, Boolean, JSON, Index, ForeignKey
 from sqlalchemy.sql import func
 import uuid
 from shs_api.database import Base
@@ -7,8 +7,12 @@ from shs_api.database import Base
 # User model
 class User(Base):
     __tablename__ = "users"
+    # Keyset pagination walks (created_at, id) in order
+    __table_args__ = (Index("ix_users_created_at_id", "created_at", "id"),)
+    # INSERTs return the server-generated timestamps, so a new row needs no re-SELECT
+    __mapper_args__ = {"eager_defaults": True}
     
-    id = Column(String, primary_key=True, index=True, default=lambda: str(uuid.uuid4()))
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     name = Column(String, nullable=False)
     username = Column(String, unique=True, nullable=False)
     phone_number = Column(String, nullable=False)
@@ -16,46 +20,119 @@ class User(Base):
     privilege = Column(String, nullable=False)  # Stored as string (e.g., "admin", "regular", "guest")
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    version = Column(Integer, nullable=False, default=1, server_default="1")  # Bumped by every write; exposed as the ETag
 
 # House model
 class House(Base):
     __tablename__ = "houses"
+    __table_args__ = (
+        Index("ix_houses_created_at_id", "created_at", "id"),
+        # Location queries range-scan geohash prefixes and test the box on the index entry alone
+        Index("ix_houses_geohash", "geohash", "id", "latitude", "longitude"),
+    )
+    __mapper_args__ = {"eager_defaults": True}
     
-    id = Column(String, primary_key=True, index=True, default=lambda: str(uuid.uuid4()))
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     name = Column(String, nullable=False)
     address = Column(String, nullable=False)
     latitude = Column(Float, nullable=False)
     longitude = Column(Float, nullable=False)
+    geohash = Column(String)  # Of (latitude, longitude); kept in step by every write (see geo.py)
     # Owner IDs stored as a JSON array (list of strings)
     owner_ids = Column(JSON, nullable=False)
     occupant_count = Column(Integer, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+
+# House ownership, normalized from House.owner_ids so "houses of user X" is an index range scan
+class HouseOwner(Base):
+    __tablename__ = "house_owners"
+    __table_args__ = (
+        Index("ix_house_owners_house_id", "house_id"),  # Replacing or deleting one house's owners
+        {"sqlite_with_rowid": False},  # The (user_id, house_id) key is the table
+    )
+
+    user_id = Column(String, primary_key=True)
+    house_id = Column(String, ForeignKey("houses.id"), primary_key=True)
+
+# Per-house room totals, maintained by triggers (see house_stats.py)
+class HouseStats(Base):
+    __tablename__ = "house_stats"
+
+    house_id = Column(String, ForeignKey("houses.id"), primary_key=True)
+    rooms = Column(Integer, nullable=False, default=0)
+    floor_area = Column(Float, nullable=False, default=0.0)
+
+# Per-house device counts by type, maintained by triggers (see house_stats.py)
+class HouseDeviceStats(Base):
+    __tablename__ = "house_device_stats"
+    __table_args__ = {"sqlite_with_rowid": False}
+
+    house_id = Column(String, ForeignKey("houses.id"), primary_key=True)
+    type = Column(String, primary_key=True)
+    devices = Column(Integer, nullable=False, default=0)
+    active_devices = Column(Integer, nullable=False, default=0)
 
 # Room model
 class Room(Base):
     __tablename__ = "rooms"
+    __table_args__ = (Index("ix_rooms_created_at_id", "created_at", "id"),)
+    __mapper_args__ = {"eager_defaults": True}
     
-    id = Column(String, primary_key=True, index=True, default=lambda: str(uuid.uuid4()))
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     name = Column(String, nullable=False)
     floor = Column(Integer, nullable=False)
     size = Column(Float, nullable=False)  
-    house_id = Column(String, nullable=False)  
+    house_id = Column(String, ForeignKey("houses.id"), nullable=False, index=True)
     type = Column(String, nullable=False)  # Room type stored as string (e.g., "bedroom", "kitchen")
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    version = Column(Integer, nullable=False, default=1, server_default="1")
 
 # Device model
 class Device(Base):
     __tablename__ = "devices"
+    __table_args__ = (Index("ix_devices_created_at_id", "created_at", "id"),)
+    __mapper_args__ = {"eager_defaults": True}
     
-    id = Column(String, primary_key=True, index=True, default=lambda: str(uuid.uuid4()))
+    id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     type = Column(String, nullable=False)  # Device type as string (e.g., "light", "thermostat")
     name = Column(String, nullable=False)
-    room_id = Column(String, nullable=False)  
+    room_id = Column(String, ForeignKey("rooms.id"), nullable=False, index=True)
     settings = Column(JSON, nullable=False, default=dict)  # Device settings stored as JSON
     status = Column(Boolean, nullable=False, default=False)
     last_data = Column(JSON, nullable=False, default=dict)  # Stores the last received data from the device
     last_updated = Column(DateTime(timezone=True), server_default=func.now())
     created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
\ No newline at end of file
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+
+# Telemetry reading model (append-only; the device row keeps only the latest reading)
+class TelemetryReading(Base):
+    __tablename__ = "telemetry_readings"
+    # Range scans of one device's history walk (device_id, ts) in order
+    __table_args__ = (Index("ix_telemetry_readings_device_id_ts", "device_id", "ts"),)
+
+    # Integer rowid key: appends land at the end of the table b-tree
+    id = Column(Integer, primary_key=True)
+    device_id = Column(String, ForeignKey("devices.id"), nullable=False)
+    ts = Column(DateTime, nullable=False)  # Reading time, naive UTC
+    data = Column(JSON, nullable=False)
+
+# Telemetry rollup model: per-bucket aggregates of each numeric field, maintained on ingest
+class TelemetryRollup(Base):
+    __tablename__ = "telemetry_rollups"
+    # Clustered on the primary key, so a device's buckets for one resolution are contiguous
+    __table_args__ = {"sqlite_with_rowid": False}
+
+    device_id = Column(String, ForeignKey("devices.id"), primary_key=True)
+    resolution = Column(String, primary_key=True)  # "1m", "1h" or "1d"
+    bucket = Column(DateTime, primary_key=True)  # Bucket start, naive UTC
+    metric = Column(String, primary_key=True)  # Key in the reading's data
+    value_count = Column(Integer, nullable=False)
+    value_sum = Column(Float, nullable=False)
+    value_min = Column(Float, nullable=False)
+    value_max = Column(Float, nullable=False)
+    value_last = Column(Float, nullable=False)
+    last_ts = Column(DateTime, nullable=False)
@@ -0,0 +1,29 @@
+# ownership.py
+"""Keeps the house_owners table in step with House.owner_ids."""
+from typing import List
+
+from sqlalchemy import delete, insert, select
+
+from shs_api import models
+
+owners = models.HouseOwner.__table__
+
+
+def replace_owners(house_id: str, owner_ids: List[str]) -> list:
+    """Statements that make house_owners list exactly `owner_ids` for the house."""
+    statements = [delete(owners).where(owners.c.house_id == house_id)]
+    if owner_ids:
+        statements.append(insert(owners).values([
+            {"user_id": user_id, "house_id": house_id} for user_id in dict.fromkeys(owner_ids)
+        ]))
+    return statements
+
+
+def houses_of_user(user_id: str):
+    """Select the houses a user owns: a range scan of the house_owners key plus primary-key lookups."""
+    return (
+        select(models.House)
+        .join(owners, owners.c.house_id == models.House.id)
+        .where(owners.c.user_id == user_id)
+        .order_by(owners.c.house_id)  # Key order, so no sort step
+    )
@@ -0,0 +1,60 @@
+# pagination.py
+import base64
+import json
+from typing import List, Optional, Tuple
+
+from sqlalchemy import String, select, tuple_, type_coerce
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+class CursorError(ValueError):
+    """Raised when a pagination cursor cannot be decoded"""
+    pass
+
+
+def encode_cursor(created_at: str, entity_id: str) -> str:
+    """Build an opaque cursor pointing just after the given (created_at, id) key."""
+    raw = json.dumps([created_at, entity_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, entity_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except Exception:
+        raise CursorError("Invalid pagination cursor")
+    if not isinstance(created_at, str) or not isinstance(entity_id, str):
+        raise CursorError("Invalid pagination cursor")
+    return created_at, entity_id
+
+
+def keyset_select(model, cursor: Optional[str], limit: int, *criteria):
+    """
+    Select one page of `model` ordered by (created_at, id).
+
+    The page is located with a row-value comparison on the (created_at, id)
+    index instead of OFFSET, so the cost of a page does not grow with its
+    position. created_at is compared as its stored text: SQLite keeps
+    server-side timestamps without fractional seconds, which a bound datetime
+    parameter would not match. One extra row is fetched to tell whether
+    another page follows.
+    """
+    created_at = type_coerce(model.created_at, String)
+    stmt = select(model, created_at.label("cursor_created_at")).where(*criteria)
+    if cursor:
+        after_created_at, after_id = decode_cursor(cursor)
+        stmt = stmt.where(tuple_(created_at, model.id) > tuple_(after_created_at, after_id))
+    return stmt.order_by(model.created_at, model.id).limit(limit + 1)
+
+
+def split_page(rows, limit: int) -> Tuple[List, Optional[str]]:
+    """Turn rows from keyset_select into (items, next_cursor)."""
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last, last_created_at = rows[-1]
+        next_cursor = encode_cursor(last_created_at, last.id)
+    return [entity for entity, _ in rows], next_cursor
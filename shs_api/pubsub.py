@@ -0,0 +1,125 @@
+# pubsub.py
+"""In-process fan-out of device changes to WebSocket and SSE subscribers."""
+import asyncio
+import json
+import threading
+from typing import Dict, Iterable, List, Set
+
+from sqlalchemy import select
+
+from shs_api import hotstate
+from shs_api import models
+
+SUBSCRIBER_QUEUE_SIZE = 256
+SSE_KEEPALIVE_SECONDS = 15.0
+DEVICE_LOOKUP_CHUNK = 500
+
+
+class Subscription:
+    """One subscriber's queue of events for a topic"""
+
+    def __init__(self, topic: str, maxsize: int):
+        self.topic = topic
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize)
+        self.dropped = 0
+
+    def _offer(self, event: dict):
+        # Runs on the subscriber's event loop
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(event)
+
+    async def get(self) -> dict:
+        return await self.queue.get()
+
+
+class Broker:
+    """Topic-keyed registry of subscriptions"""
+
+    def __init__(self, queue_size: int = SUBSCRIBER_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._topics: Dict[str, Set[Subscription]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def active(self) -> bool:
+        """Whether anyone is listening; publishers skip building events otherwise."""
+        return bool(self._topics)
+
+    def subscribe(self, topic: str) -> Subscription:
+        """Must be called from the event loop that will consume the subscription."""
+        subscription = Subscription(topic, self.queue_size)
+        with self._lock:
+            self._topics.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            subscribers = self._topics.get(subscription.topic)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._topics[subscription.topic]
+
+    def publish(self, topic: str, event: dict):
+        with self._lock:
+            subscribers = list(self._topics.get(topic, ()))
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription._offer, event)
+            except RuntimeError:  # The subscriber's loop has closed
+                self.unsubscribe(subscription)
+
+
+broker = Broker()
+
+
+def device_changes_select(device_ids: Iterable[str]):
+    """Select each device with its house id, for building change events."""
+    return (
+        select(models.Device, models.Room.house_id)
+        .join(models.Room, models.Device.room_id == models.Room.id)
+        .where(models.Device.id.in_(list(device_ids)))
+    )
+
+
+def publish_device_changes(rows: List[tuple], event_type: str):
+    """Publish a delta for each (Device, house_id) row to the device's house."""
+    for device, house_id in rows:
+        # Status may not have been written back yet; the hot-state store is authoritative
+        state = hotstate.store.get(device.id) or {
+            "status": device.status, "last_data": device.last_data, "last_updated": device.last_updated,
+        }
+        broker.publish(house_id, {
+            "event": event_type,
+            "device_id": device.id,
+            "room_id": device.room_id,
+            "status": state["status"],
+            "settings": device.settings,
+            "last_data": state["last_data"],
+            "last_updated": state["last_updated"].isoformat() if state["last_updated"] else None,
+        })
+
+
+def notify_devices(db, device_ids: Iterable[str], event_type: str):
+    """Publish change events for `device_ids` from a sync session; a no-op without subscribers."""
+    if not broker.active:
+        return
+    device_ids = list(device_ids)
+    for start in range(0, len(device_ids), DEVICE_LOOKUP_CHUNK):
+        chunk = device_ids[start:start + DEVICE_LOOKUP_CHUNK]
+        publish_device_changes(db.execute(device_changes_select(chunk)).all(), event_type)
+
+
+async def sse_stream(subscription: Subscription, keepalive: float = SSE_KEEPALIVE_SECONDS):
+    """Format a subscription as a text/event-stream, with comment keepalives while idle."""
+    yield ": connected\n\n"
+    while True:
+        try:
+            event = await asyncio.wait_for(subscription.get(), keepalive)
+        except asyncio.TimeoutError:
+            yield ": keepalive\n\n"
+            continue
+        yield f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
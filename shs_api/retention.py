@@ -0,0 +1,192 @@
+# retention.py
+"""Per-DeviceType telemetry retention, applied in short batches by a background compactor."""
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+from shs_api.shs_api import DeviceType
+from shs_api.telemetry import format_ts
+
+logger = logging.getLogger(__name__)
+
+DELETE_BATCH_ROWS = 5000
+DEVICE_CHUNK = 500
+VACUUM_STEP_PAGES = 1000
+BATCH_PAUSE_SECONDS = 0.01  # Gap between batches in which foreground writers can take the lock
+COMPACT_INTERVAL_SECONDS = float(os.getenv("SHS_RETENTION_INTERVAL_SECONDS", "3600"))  # 0 disables the compactor
+
+
+@dataclass(frozen=True)
+class RetentionPolicy:
+    """How much telemetry is kept for one device type"""
+    raw_ttl: timedelta
+    rollup_ttl: timedelta
+    max_raw_rows: int  # Per device; the oldest readings beyond it are dropped
+
+
+RETENTION_POLICIES: Dict[DeviceType, RetentionPolicy] = {
+    DeviceType.SECURITY_CAMERA: RetentionPolicy(timedelta(days=7), timedelta(days=90), 100_000),
+    DeviceType.LIGHT: RetentionPolicy(timedelta(days=30), timedelta(days=365), 50_000),
+    DeviceType.THERMOSTAT: RetentionPolicy(timedelta(days=90), timedelta(days=730), 200_000),
+    DeviceType.DOOR_LOCK: RetentionPolicy(timedelta(days=365), timedelta(days=730), 100_000),  # Audit trail
+    DeviceType.OTHER: RetentionPolicy(timedelta(days=30), timedelta(days=365), 100_000),
+}
+
+_compact_lock = threading.Lock()
+
+
+def _placeholders(values) -> str:
+    return ", ".join("?" for _ in values)
+
+
+def _delete_in_batches(engine, sql: str, params: tuple, batch_size: int, pause: float) -> int:
+    """Run a DELETE whose subquery ends in LIMIT ? until it removes fewer than batch_size rows."""
+    deleted = 0
+    while True:
+        with engine.begin() as conn:
+            removed = conn.exec_driver_sql(sql, params + (batch_size,)).rowcount
+        deleted += removed
+        if removed < batch_size:
+            return deleted
+        time.sleep(pause)
+
+
+def _pragma(engine, name: str) -> int:
+    with engine.connect() as conn:
+        return conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+
+
+def _incremental_vacuum(engine, pages: int):
+    with engine.connect() as conn:
+        # pysqlite's execute() steps a statement once, which frees a single page;
+        # executescript() runs the pragma to completion
+        conn.connection.driver_connection.executescript(f"PRAGMA incremental_vacuum({pages});")
+
+
+def _compact_devices(engine, device_ids, policy: RetentionPolicy, now: datetime, batch_size: int,
+                     pause: float, report: dict):
+    devices = _placeholders(device_ids)
+    report["raw_rows_deleted"] += _delete_in_batches(
+        engine,
+        f"DELETE FROM telemetry_readings WHERE id IN (SELECT id FROM telemetry_readings "
+        f"WHERE device_id IN ({devices}) AND ts < ? LIMIT ?)",
+        (*device_ids, format_ts(now - policy.raw_ttl)), batch_size, pause,
+    )
+    report["rollup_rows_deleted"] += _delete_in_batches(
+        engine,
+        f"DELETE FROM telemetry_rollups WHERE (device_id, resolution, bucket, metric) IN ("
+        f"SELECT device_id, resolution, bucket, metric FROM telemetry_rollups "
+        f"WHERE device_id IN ({devices}) AND bucket < ? LIMIT ?)",
+        (*device_ids, format_ts(now - policy.rollup_ttl)), batch_size, pause,
+    )
+
+    # Index-only count; only devices over the cap pay for finding their cutoff
+    with engine.connect() as conn:
+        over_cap = conn.exec_driver_sql(
+            f"SELECT device_id FROM telemetry_readings WHERE device_id IN ({devices}) "
+            f"GROUP BY device_id HAVING COUNT(*) > ?",
+            (*device_ids, policy.max_raw_rows),
+        ).scalars().all()
+    for device_id in over_cap:
+        with engine.connect() as conn:
+            cutoff = conn.exec_driver_sql(
+                "SELECT ts FROM telemetry_readings WHERE device_id = ? ORDER BY ts DESC LIMIT 1 OFFSET ?",
+                (device_id, policy.max_raw_rows),
+            ).scalar()
+        report["capped_rows_deleted"] += _delete_in_batches(
+            engine,
+            "DELETE FROM telemetry_readings WHERE id IN (SELECT id FROM telemetry_readings "
+            "WHERE device_id = ? AND ts <= ? LIMIT ?)",
+            (device_id, cutoff), batch_size, pause,
+        )
+
+
+def compact(engine, policies: Dict[DeviceType, RetentionPolicy] = RETENTION_POLICIES,
+            now: Optional[datetime] = None, batch_size: int = DELETE_BATCH_ROWS,
+            pause: float = BATCH_PAUSE_SECONDS) -> dict:
+    """
+    Apply `policies` to every device's telemetry and return what was reclaimed:
+    rows deleted per kind, bytes freed inside the database file (reusable by
+    new rows) and bytes released back to the filesystem by incremental vacuum.
+    """
+    now = now or datetime.now(timezone.utc).replace(tzinfo=None)
+    report = {"raw_rows_deleted": 0, "capped_rows_deleted": 0, "rollup_rows_deleted": 0,
+              "freed_bytes": 0, "released_bytes": 0, "seconds": 0.0}
+    started = time.perf_counter()
+    with _compact_lock:
+        page_size = _pragma(engine, "page_size")
+        freelist_before = _pragma(engine, "freelist_count")
+
+        # Walk devices in primary-key chunks so memory stays flat however large the fleet is
+        last_id = ""
+        while True:
+            with engine.connect() as conn:
+                rows = conn.exec_driver_sql(
+                    "SELECT id, type FROM devices WHERE id > ? ORDER BY id LIMIT ?", (last_id, DEVICE_CHUNK)
+                ).all()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            by_type = {}
+            for device_id, device_type in rows:
+                by_type.setdefault(device_type, []).append(device_id)
+            for device_type, device_ids in by_type.items():
+                try:
+                    policy = policies[DeviceType(device_type)]
+                except (ValueError, KeyError):
+                    continue
+                _compact_devices(engine, device_ids, policy, now, batch_size, pause, report)
+
+        freelist_after = _pragma(engine, "freelist_count")
+        report["freed_bytes"] = max(0, freelist_after - freelist_before) * page_size
+
+        if _pragma(engine, "auto_vacuum") == 2:  # INCREMENTAL
+            pages_before = _pragma(engine, "page_count")
+            free_pages = _pragma(engine, "freelist_count")
+            while free_pages:
+                _incremental_vacuum(engine, VACUUM_STEP_PAGES)
+                remaining = _pragma(engine, "freelist_count")
+                if remaining >= free_pages:
+                    break  # Concurrent writers are reusing the pages as fast as they are released
+                free_pages = remaining
+                time.sleep(pause)
+            report["released_bytes"] = max(0, pages_before - _pragma(engine, "page_count")) * page_size
+
+    report["seconds"] = round(time.perf_counter() - started, 3)
+    return report
+
+
+class RetentionCompactor:
+    """Runs compact() every `interval` seconds on a daemon thread until stop() is called."""
+
+    def __init__(self, engine, interval: float = COMPACT_INTERVAL_SECONDS, **compact_kwargs):
+        self.engine = engine
+        self.interval = interval
+        self.compact_kwargs = compact_kwargs
+        self.last_report = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="telemetry-compactor", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.last_report = compact(self.engine, **self.compact_kwargs)
+                logger.info("Telemetry compaction: %s", self.last_report)
+            except Exception:
+                logger.exception("Telemetry compaction failed")
@@ -1,6 +1,6 @@
 # schemas.py
 from pydantic import BaseModel, Field
-from typing import List, Dict, Optional
+from typing import Any, List, Dict, Optional
 from datetime import datetime
 
 # --------------------------
@@ -23,10 +23,26 @@ class UserResponse(BaseModel):
     privilege: str
     created_at: datetime
     updated_at: datetime
+    version: int  # Also sent as the ETag header
 
     class Config:
         orm_mode = True
 
+class UserPage(BaseModel):
+    items: List[UserResponse]
+    next_cursor: Optional[str] = None  # Pass back as ?cursor= to fetch the next page
+
+class UserPatch(BaseModel):
+    """RFC 7386 merge patch: only the fields present are changed"""
+    name: Optional[str] = None
+    username: Optional[str] = None
+    phone_number: Optional[str] = None
+    email: Optional[str] = None
+    privilege: Optional[str] = None
+
+    class Config:
+        extra = "forbid"
+
 # --------------------------
 # House Schemas
 # --------------------------
@@ -49,10 +65,39 @@ class HouseResponse(BaseModel):
     occupant_count: int
     created_at: datetime
     updated_at: datetime
+    version: int
 
     class Config:
         orm_mode = True
 
+class HousePage(BaseModel):
+    items: List[HouseResponse]
+    next_cursor: Optional[str] = None
+
+class HouseStats(BaseModel):
+    house_id: str
+    rooms: int
+    floor_area: float  # Sum of room sizes
+    devices: int
+    active_devices: int  # Status as of the last hot-state writeback
+    devices_by_type: Dict[str, int]
+    active_devices_by_type: Dict[str, int]
+
+class NearbyHouse(HouseResponse):
+    distance_km: float  # Great-circle distance from the queried point
+
+class HousePatch(BaseModel):
+    """RFC 7386 merge patch: only the fields present are changed"""
+    name: Optional[str] = None
+    address: Optional[str] = None
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    owner_ids: Optional[List[str]] = None  # Arrays are replaced, not merged
+    occupant_count: Optional[int] = None
+
+    class Config:
+        extra = "forbid"
+
 # --------------------------
 # Room Schemas
 # --------------------------
@@ -73,10 +118,26 @@ class RoomResponse(BaseModel):
     type: str
     created_at: datetime
     updated_at: datetime
+    version: int
 
     class Config:
         orm_mode = True
 
+class RoomPage(BaseModel):
+    items: List[RoomResponse]
+    next_cursor: Optional[str] = None
+
+class RoomPatch(BaseModel):
+    """RFC 7386 merge patch: only the fields present are changed"""
+    name: Optional[str] = None
+    floor: Optional[int] = None
+    size: Optional[float] = None
+    house_id: Optional[str] = None
+    type: Optional[str] = None
+
+    class Config:
+        extra = "forbid"
+
 # --------------------------
 # Device Schemas
 # --------------------------
@@ -98,6 +159,120 @@ class DeviceResponse(BaseModel):
     last_updated: datetime
     created_at: datetime
     updated_at: datetime
+    version: int
 
     class Config:
-        orm_mode = True
\ No newline at end of file
+        orm_mode = True
+
+class DevicePage(BaseModel):
+    items: List[DeviceResponse]
+    next_cursor: Optional[str] = None
+
+class DevicePatch(BaseModel):
+    """RFC 7386 merge patch: only the fields present are changed"""
+    type: Optional[str] = None
+    name: Optional[str] = None
+    room_id: Optional[str] = None
+    settings: Optional[Dict[str, Any]] = None  # Merged key by key; null clears all settings
+
+    class Config:
+        extra = "forbid"
+
+class DeviceStatusUpdate(BaseModel):
+    status: bool
+    data: Optional[Dict[str, Any]] = None  # Replaces last_data when given; kept small (see hotstate)
+
+class DeviceStatus(BaseModel):
+    device_id: str
+    status: bool
+    last_updated: Optional[datetime] = None
+    last_data: Dict[str, Any]
+
+class DeviceCommandFilter(BaseModel):
+    type: Optional[str] = None  # Only devices of this type, e.g. "light"
+
+class DeviceCommand(BaseModel):
+    filter: DeviceCommandFilter = Field(default_factory=DeviceCommandFilter)
+    status: Optional[bool] = None
+    settings: Optional[Dict[str, Any]] = None  # JSON merge patch applied to each device's settings
+
+class DeviceCommandResponse(BaseModel):
+    affected_ids: List[str]
+
+# --------------------------
+# Telemetry Schemas
+# --------------------------
+
+class TelemetryReadingIn(BaseModel):
+    ts: Optional[datetime] = None  # Defaults to the time of ingestion; stored as UTC
+    data: Dict[str, Any]
+
+class TelemetryIngestResponse(BaseModel):
+    device_id: str
+    accepted: int
+
+class TelemetryBatchItem(BaseModel):
+    device_id: str
+    ts: Optional[datetime] = None
+    data: Dict[str, Any]
+
+class TelemetryPoint(BaseModel):
+    ts: datetime  # Reading time, or bucket start for rollups
+    data: Dict[str, Any]  # Raw reading, or {field: {min, max, avg, count, last}} for rollups
+
+class TelemetrySeries(BaseModel):
+    device_id: str
+    resolution: str  # "raw", "1m", "1h" or "1d"
+    points: List[TelemetryPoint]
+    truncated: bool  # More points than max_points were in range
+
+class CompactionReport(BaseModel):
+    raw_rows_deleted: int  # Past the device type's raw TTL
+    capped_rows_deleted: int  # Beyond the device type's per-device row limit
+    rollup_rows_deleted: int
+    freed_bytes: int  # Pages freed inside the database file
+    released_bytes: int  # Returned to the filesystem by incremental vacuum
+    seconds: float
+
+class OrphanPurgeReport(BaseModel):
+    rooms_deleted: int  # Whose house no longer exists
+    devices_deleted: int  # Whose room no longer exists
+    readings_deleted: int  # Telemetry of devices that no longer exist
+    rollups_deleted: int
+    seconds: float
+
+# --------------------------
+# Bulk Schemas
+# --------------------------
+
+class BulkItemError(BaseModel):
+    index: int  # Position of the rejected item in the request body
+    detail: str
+
+class BulkCreateResponse(BaseModel):
+    created_ids: List[str]
+    errors: List[BulkItemError]
+
+class TelemetryBatchResponse(BaseModel):
+    accepted: int
+    rejected: int
+    rejects: List[BulkItemError]  # Capped at telemetry.MAX_REPORTED_REJECTS; `rejected` is the full count
+
+# --------------------------
+# Search Schemas
+# --------------------------
+
+class SearchHit(BaseModel):
+    type: str  # "user", "house", "room" or "device"
+    id: str
+    name: str
+    score: float  # Relevance; higher is better
+
+# --------------------------
+# Diagnostics Schemas
+# --------------------------
+
+class SqliteDiagnostics(BaseModel):
+    profile: str
+    configured: Dict[str, Any]  # Pragmas applied on connect
+    effective: Dict[str, Any]  # Values read back from a pooled connection
@@ -0,0 +1,142 @@
+# search.py
+"""Full-text search over users, houses, rooms and devices (SQLite FTS5), kept current by triggers."""
+import heapq
+import re
+import unicodedata
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import DDL, event
+
+from shs_api.database import Base
+
+MIN_PREFIX_CHARS = 2  # Shorter terms are matched whole: one-letter prefixes match most of the index
+
+
+@dataclass(frozen=True)
+class SearchIndex:
+    """An FTS5 index over some text columns of one table"""
+    entity: str
+    table: str
+    columns: Tuple[str, ...]
+    weights: Tuple[float, ...]  # bm25 weight of each column
+
+    @property
+    def name(self) -> str:
+        return f"search_{self.table}"
+
+    @property
+    def keys(self) -> str:
+        """Table giving each row of `table` the integer key the index refers to it by"""
+        return f"search_{self.table}_keys"
+
+
+SEARCH_INDEXES: Dict[str, SearchIndex] = {index.entity: index for index in (
+    SearchIndex("user", "users", ("name", "username", "email"), (10.0, 5.0, 2.0)),
+    SearchIndex("house", "houses", ("name", "address"), (10.0, 5.0)),
+    SearchIndex("room", "rooms", ("name",), (10.0,)),
+    SearchIndex("device", "devices", ("name",), (10.0,)),
+)}
+
+
+def _ddl(index: SearchIndex) -> List[str]:
+    # The tables have TEXT primary keys, and a VACUUM may renumber their implicit rowids, so the
+    # (contentless) index is keyed on an INTEGER PRIMARY KEY of its own, which a VACUUM keeps
+    columns = ", ".join(index.columns)
+    new = ", ".join(f"new.{column}" for column in index.columns)
+    old = ", ".join(f"old.{column}" for column in index.columns)
+    key = f"(SELECT key FROM {index.keys} WHERE id = old.id)"  # Unchanged by updates: ids never change
+    delete_old = f"INSERT INTO {index.name} ({index.name}, rowid, {columns}) VALUES ('delete', {key}, {old});"
+    insert_new = f"INSERT INTO {index.name} (rowid, {columns}) VALUES ({key}, {new});"
+    return [
+        f"CREATE TABLE IF NOT EXISTS {index.keys} (key INTEGER PRIMARY KEY, id TEXT NOT NULL UNIQUE)",
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {index.name} USING fts5({columns}, content='', "
+        f"prefix='2 3', tokenize='unicode61 remove_diacritics 2')",
+        # last_insert_rowid() is the key just inserted for as long as the trigger runs
+        f"CREATE TRIGGER IF NOT EXISTS {index.name}_ai AFTER INSERT ON {index.table} BEGIN "
+        f"INSERT INTO {index.keys} (id) VALUES (new.id); "
+        f"INSERT INTO {index.name} (rowid, {columns}) VALUES (last_insert_rowid(), {new}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {index.name}_ad AFTER DELETE ON {index.table} BEGIN {delete_old} "
+        f"DELETE FROM {index.keys} WHERE id = old.id; END",
+        f"CREATE TRIGGER IF NOT EXISTS {index.name}_au AFTER UPDATE OF {columns} ON {index.table} "
+        f"BEGIN {delete_old} {insert_new} END",
+    ]
+
+
+def _drop_tables(index: SearchIndex) -> List[str]:
+    return [f"DROP TABLE IF EXISTS {index.name}", f"DROP TABLE IF EXISTS {index.keys}"]
+
+
+def drop_statements(index: SearchIndex) -> List[str]:
+    """Drop the index with its triggers and keys (also an older index keyed on the table's rowids)."""
+    return [f"DROP TRIGGER IF EXISTS {index.name}_{suffix}" for suffix in ("ai", "ad", "au")] + _drop_tables(index)
+
+
+for _index in SEARCH_INDEXES.values():
+    for _statement in _ddl(_index):
+        event.listen(Base.metadata, "after_create", DDL(_statement).execute_if(dialect="sqlite"))
+    # Triggers go with their table; the index and its keys have to be dropped explicitly
+    for _statement in _drop_tables(_index):
+        event.listen(Base.metadata, "before_drop", DDL(_statement).execute_if(dialect="sqlite"))
+
+
+def rebuild_statements(index: SearchIndex) -> List[str]:
+    """Refill the index and its keys from every row of its table (when first created, or after a bypass)."""
+    columns = ", ".join(index.columns)
+    return [
+        f"INSERT INTO {index.name} ({index.name}) VALUES ('delete-all')",
+        f"DELETE FROM {index.keys}",
+        f"INSERT INTO {index.keys} (id) SELECT id FROM {index.table}",
+        f"INSERT INTO {index.name} (rowid, {columns}) "
+        f"SELECT k.key, {', '.join(f't.{column}' for column in index.columns)} "
+        f"FROM {index.keys} AS k JOIN {index.table} AS t ON t.id = k.id",
+    ]
+
+
+def rebuild(engine):
+    with engine.begin() as conn:
+        for index in SEARCH_INDEXES.values():
+            for statement in rebuild_statements(index):
+                conn.exec_driver_sql(statement)
+
+
+def _words(text: str) -> List[str]:
+    """Lowercased words without diacritics, as the unicode61 tokenizer sees them."""
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return re.findall(r"[^\W_]+", "".join(char for char in decomposed if not unicodedata.combining(char)))
+
+
+def match_expression(terms: List[str]) -> Optional[str]:
+    """
+    An FTS5 query matching rows that contain every term: the last one as a
+    word prefix (search-as-you-type), the others as whole words, which keeps
+    common words from expanding into huge prefix scans. Terms are quoted, so
+    FTS5 operators in the input are searched for literally.
+    """
+    if not terms:
+        return None
+    *words, last = terms
+    prefix = f'"{last}"*' if len(last) >= MIN_PREFIX_CHARS else f'"{last}"'
+    return " ".join([f'"{word}"' for word in words] + [prefix])
+
+
+def search(db, query: str, entities: List[str], limit: int) -> List[dict]:
+    """The `limit` best matches across `entities`, best first, each index ranked by FTS5's bm25()."""
+    expression = match_expression(_words(query))
+    if expression is None:
+        return []
+    connection = db.connection()
+    hits = []
+    for entity in entities:
+        index = SEARCH_INDEXES[entity]
+        weights = ", ".join(map(str, index.weights))
+        rows = connection.exec_driver_sql(
+            f"SELECT t.id, t.name, m.score FROM (SELECT rowid, bm25({index.name}, {weights}) AS score "
+            f"FROM {index.name} WHERE {index.name} MATCH ? ORDER BY score LIMIT ?) AS m "
+            f"JOIN {index.keys} AS k ON k.key = m.rowid JOIN {index.table} AS t ON t.id = k.id",
+            (expression, limit),
+        ).all()
+        # bm25() is lower for better matches
+        hits += [{"type": entity, "id": entity_id, "name": name, "score": round(-score, 4)}
+                 for entity_id, name, score in rows]
+    return heapq.nlargest(limit, hits, key=lambda hit: hit["score"])
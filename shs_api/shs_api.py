@@ -1,7 +1,7 @@
 from typing import List, Dict, Optional
 from enum import Enum
 from dataclasses import dataclass
-from datetime import datetime
+from datetime import datetime, timezone
 import uuid
 
 # Exception classes 
@@ -139,7 +139,8 @@ class Device:
         self.settings = {}
         self.status = False
         self.last_data = {}
-        self.last_updated = datetime.now()
+        # Naive UTC, like telemetry timestamps and status writes, which are only applied when newer
+        self.last_updated = datetime.now(timezone.utc).replace(tzinfo=None)
         self.created_at = datetime.now()
         self.updated_at = self.created_at
 
@@ -0,0 +1,120 @@
+# slowlog.py
+"""Sampled, rate-limited JSON log of slow SQL statements with their query plans."""
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_MS = float(os.getenv("SHS_SLOW_QUERY_MS", "100"))  # 0 disables the log
+SAMPLE_RATE = float(os.getenv("SHS_SLOW_QUERY_SAMPLE_RATE", "1"))
+MAX_PER_MINUTE = float(os.getenv("SHS_SLOW_QUERY_MAX_PER_MINUTE", "60"))
+MAX_PLANS = 1000  # Statement shapes whose plan is remembered
+RECENT_ENTRIES = 50
+
+_EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE")
+
+
+def parameter_shape(parameters, executemany: bool):
+    """Type names of the bound parameters (of the first row, for executemany), without their values."""
+    if executemany:
+        rows = list(parameters or ())
+        return {"rows": len(rows), "types": parameter_shape(rows[0], False) if rows else []}
+    if isinstance(parameters, dict):
+        return {name: type(value).__name__ for name, value in parameters.items()}
+    return [type(value).__name__ for value in parameters or ()]
+
+
+class SlowQueryLog:
+    """A sampling, rate-limited sink for slow statements"""
+
+    def __init__(self, threshold_ms: float = SLOW_QUERY_MS, sample_rate: float = SAMPLE_RATE,
+                 max_per_minute: float = MAX_PER_MINUTE):
+        # Compared against every statement's duration, so kept in seconds and infinite when disabled
+        self.threshold = threshold_ms / 1000 if threshold_ms > 0 else float("inf")
+        self.sample_rate = sample_rate
+        self.max_per_minute = max_per_minute
+        self.recent = deque(maxlen=RECENT_ENTRIES)
+        self.logged = 0
+        self.suppressed = 0  # Dropped by the rate limit, in total
+        self._lock = threading.Lock()
+        self._tokens = max_per_minute
+        self._refilled = time.monotonic()
+        self._pending_suppressed = 0  # Dropped since the last logged entry
+        self._plans: "OrderedDict[str, List[str]]" = OrderedDict()
+
+    def _take_token(self) -> Optional[int]:
+        """Suppressed count to report if an entry may be logged now, else None."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.max_per_minute,
+                               self._tokens + (now - self._refilled) * self.max_per_minute / 60)
+            self._refilled = now
+            if self._tokens < 1:
+                self.suppressed += 1
+                self._pending_suppressed += 1
+                return None
+            self._tokens -= 1
+            self.logged += 1
+            suppressed, self._pending_suppressed = self._pending_suppressed, 0
+            return suppressed
+
+    def _plan(self, conn, shape: str, statement: str, parameters, executemany: bool) -> List[str]:
+        with self._lock:
+            plan = self._plans.get(shape)
+        if plan is not None:
+            return plan
+        plan = []
+        if conn.dialect.name == "sqlite" and statement.lstrip().upper().startswith(_EXPLAINABLE):
+            if executemany:
+                parameters = next(iter(parameters or ()), ())
+            cursor = conn.connection.dbapi_connection.cursor()
+            try:
+                cursor.execute(f"EXPLAIN QUERY PLAN {statement}", parameters or ())
+                plan = [row[-1] for row in cursor.fetchall()]
+            except Exception as e:  # The plan is best effort; the statement itself already ran
+                plan = [f"unavailable: {e}"]
+            finally:
+                cursor.close()
+        with self._lock:
+            self._plans[shape] = plan
+            if len(self._plans) > MAX_PLANS:
+                self._plans.popitem(last=False)
+        return plan
+
+    def observe(self, conn, shape: str, statement: str, parameters, executemany: bool,
+                seconds: float, route: Optional[str]):
+        """Log a statement that took `seconds` (at least the threshold), subject to sampling and the rate limit."""
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            return
+        suppressed = self._take_token()
+        if suppressed is None:
+            return
+        entry = {
+            "duration_ms": round(seconds * 1000, 3),
+            "route": route,
+            "statement": statement,
+            "parameters": parameter_shape(parameters, executemany),
+            "plan": self._plan(conn, shape, statement, parameters, executemany),
+            "suppressed": suppressed,
+        }
+        self.recent.append(entry)
+        logger.warning("Slow query: %s", json.dumps(entry, default=str))
+
+    def stats(self) -> dict:
+        return {
+            "threshold_ms": self.threshold * 1000 if self.threshold != float("inf") else None,
+            "sample_rate": self.sample_rate,
+            "max_per_minute": self.max_per_minute,
+            "logged": self.logged,
+            "suppressed": self.suppressed,
+            "recent": list(self.recent),
+        }
+
+
+sink = SlowQueryLog()
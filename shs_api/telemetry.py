@@ -0,0 +1,410 @@
+# telemetry.py
+"""Telemetry ingestion, 1m/1h/1d rollups and series queries."""
+import codecs
+import json
+import re
+from datetime import datetime, timezone
+from typing import Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from shs_api import cache
+from shs_api import hotstate
+from shs_api import models
+from shs_api import pubsub
+from shs_api import schemas
+
+INSERT_CHUNK = 10000
+BATCH_TRANSACTION_ROWS = 50000  # Readings per commit for streamed uploads
+MAX_ITEM_BYTES = 64 * 1024  # Longest NDJSON line / array item buffered while waiting for its end
+MAX_REPORTED_REJECTS = 1000
+DEVICE_LOOKUP_CHUNK = 500
+DEFAULT_MAX_POINTS = 500
+
+# Finest first. Rollup buckets are derived from the formatted timestamp:
+# (resolution, prefix kept, suffix appended)
+RESOLUTIONS = ["raw", "1m", "1h", "1d"]
+ROLLUP_BUCKETS = [
+    ("1m", 16, ":00.000000"),
+    ("1h", 13, ":00:00.000000"),
+    ("1d", 10, " 00:00:00.000000"),
+]
+
+# Pre-formatted parameters: ts is rendered in SQLAlchemy's SQLite DateTime
+# storage format so ORM reads of the column round-trip
+_INSERT_READINGS = "INSERT INTO telemetry_readings (device_id, ts, data) VALUES (?, ?, ?)"
+
+# Out-of-order readings never move the projection backwards
+_PROJECT_LATEST = text(
+    "UPDATE devices SET last_data = :data, last_updated = :ts "
+    "WHERE id = :device_id AND (last_updated IS NULL OR last_updated <= :ts)"
+)
+
+# Merges a batch's partial aggregate into the stored bucket
+_UPSERT_ROLLUPS = (
+    "INSERT INTO telemetry_rollups (device_id, resolution, bucket, metric, value_count, value_sum, "
+    "value_min, value_max, value_last, last_ts) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT (device_id, resolution, bucket, metric) DO UPDATE SET "
+    "value_count = value_count + excluded.value_count, "
+    "value_sum = value_sum + excluded.value_sum, "
+    "value_min = min(value_min, excluded.value_min), "
+    "value_max = max(value_max, excluded.value_max), "
+    "value_last = CASE WHEN excluded.last_ts >= last_ts THEN excluded.value_last ELSE value_last END, "
+    "last_ts = max(last_ts, excluded.last_ts)"
+)
+
+_encode_json = json.JSONEncoder(separators=(",", ":")).encode
+
+
+def to_utc_naive(ts: Optional[datetime]) -> datetime:
+    """Readings are stored as naive UTC; a missing timestamp means "now"."""
+    if ts is None:
+        return datetime.now(timezone.utc).replace(tzinfo=None)
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts
+
+
+def format_ts(ts: datetime) -> str:
+    return ts.isoformat(" ", "microseconds")
+
+
+def ingest(db: Session, readings: Iterable[Tuple[str, Optional[datetime], dict]]) -> Tuple[int, Set[str]]:
+    """
+    Append `readings` -- (device_id, ts, data) tuples -- and refresh the latest
+    projection and rollups of every device they touch. Runs in the caller's
+    transaction; returns the number of readings written and the ids of the
+    devices touched.
+    """
+    connection = db.connection()
+    latest = {}
+    rollups = {}
+    chunk = []
+    count = 0
+    for device_id, ts, data in readings:
+        ts_text = format_ts(to_utc_naive(ts))
+        row = (device_id, ts_text, _encode_json(data))
+        chunk.append(row)
+        current = latest.get(device_id)
+        if current is None or ts_text >= current[1]:
+            latest[device_id] = row
+        for metric, value in data.items():
+            if type(value) not in (int, float):  # Also skips bools
+                continue
+            for resolution, prefix, suffix in ROLLUP_BUCKETS:
+                key = (device_id, resolution, ts_text[:prefix] + suffix, metric)
+                agg = rollups.get(key)
+                if agg is None:
+                    rollups[key] = [1, value, value, value, value, ts_text]
+                    continue
+                agg[0] += 1
+                agg[1] += value
+                if value < agg[2]:
+                    agg[2] = value
+                if value > agg[3]:
+                    agg[3] = value
+                if ts_text >= agg[5]:
+                    agg[4] = value
+                    agg[5] = ts_text
+        if len(chunk) >= INSERT_CHUNK:
+            connection.exec_driver_sql(_INSERT_READINGS, chunk)
+            count += len(chunk)
+            chunk = []
+    if chunk:
+        connection.exec_driver_sql(_INSERT_READINGS, chunk)
+        count += len(chunk)
+
+    if latest:
+        db.execute(_PROJECT_LATEST, [
+            {"device_id": device_id, "ts": ts, "data": data} for device_id, ts, data in latest.values()
+        ])
+    if rollups:
+        connection.exec_driver_sql(_UPSERT_ROLLUPS, [key + tuple(agg) for key, agg in rollups.items()])
+    return count, set(latest)
+
+
+def bucket_start(ts: datetime, resolution: str) -> datetime:
+    for name, prefix, suffix in ROLLUP_BUCKETS:
+        if name == resolution:
+            return datetime.fromisoformat(format_ts(ts)[:prefix] + suffix)
+    raise ValueError(f"Unknown rollup resolution: {resolution}")
+
+
+def _raw_query(db: Session, device_id: str, start: datetime, end: datetime, *columns):
+    Reading = models.TelemetryReading
+    return db.query(*columns).filter(Reading.device_id == device_id, Reading.ts >= start, Reading.ts < end)
+
+
+def _rollup_query(db: Session, device_id: str, start: datetime, end: datetime, resolution: str, *columns):
+    Rollup = models.TelemetryRollup
+    return db.query(*columns).filter(
+        Rollup.device_id == device_id,
+        Rollup.resolution == resolution,
+        Rollup.bucket >= bucket_start(start, resolution),
+        Rollup.bucket < end,
+    )
+
+
+def count_points(db: Session, device_id: str, start: datetime, end: datetime, resolution: str, limit: int) -> int:
+    """Number of points in range, counting no further than `limit` (index-only scan)."""
+    if resolution == "raw":
+        query = _raw_query(db, device_id, start, end, models.TelemetryReading.ts)
+    else:
+        query = _rollup_query(db, device_id, start, end, resolution, models.TelemetryRollup.bucket).distinct()
+    return query.limit(limit).count()
+
+
+def _raw_points(db: Session, device_id: str, start: datetime, end: datetime, limit: int) -> List[dict]:
+    Reading = models.TelemetryReading
+    rows = _raw_query(db, device_id, start, end, Reading.ts, Reading.data).order_by(Reading.ts, Reading.id).limit(limit)
+    return [{"ts": ts, "data": data} for ts, data in rows]
+
+
+def _rollup_points(db: Session, device_id: str, start: datetime, end: datetime, resolution: str,
+                   limit: int) -> List[dict]:
+    Rollup = models.TelemetryRollup
+    # Find the first `limit` buckets, then read their rows; both walk the primary key
+    buckets = _rollup_query(db, device_id, start, end, resolution, Rollup.bucket).distinct().order_by(Rollup.bucket)
+    last_bucket = buckets.offset(limit - 1).limit(1).scalar()
+    rows = _rollup_query(db, device_id, start, end, resolution, Rollup)
+    if last_bucket is not None:
+        rows = rows.filter(Rollup.bucket <= last_bucket)
+    points = {}
+    for rollup in rows.order_by(Rollup.bucket, Rollup.metric):
+        point = points.setdefault(rollup.bucket, {"ts": rollup.bucket, "data": {}})
+        point["data"][rollup.metric] = {
+            "min": rollup.value_min,
+            "max": rollup.value_max,
+            "avg": rollup.value_sum / rollup.value_count,
+            "count": rollup.value_count,
+            "last": rollup.value_last,
+        }
+    return list(points.values())
+
+
+def query_series(db: Session, device_id: str, start: datetime, end: datetime, resolution: str = "auto",
+                 max_points: int = DEFAULT_MAX_POINTS) -> Tuple[str, List[dict], bool]:
+    """
+    Read a device's readings in [start, end) as at most `max_points` points.
+
+    With resolution="auto" the finest resolution whose points fit the budget
+    is used, falling back to daily buckets; each probe counts at most
+    max_points + 1 index entries. Returns (resolution, points, truncated),
+    where truncated means points beyond the budget were left out.
+    """
+    if start > end:
+        raise ValueError("'from' must not be later than 'to'")
+    if resolution == "auto":
+        resolution = next(
+            (candidate for candidate in RESOLUTIONS
+             if count_points(db, device_id, start, end, candidate, max_points + 1) <= max_points),
+            RESOLUTIONS[-1],
+        )
+    elif resolution not in RESOLUTIONS:
+        raise ValueError(f"Invalid resolution: {resolution} (expected 'auto' or one of {RESOLUTIONS})")
+
+    if resolution == "raw":
+        points = _raw_points(db, device_id, start, end, max_points + 1)
+    else:
+        points = _rollup_points(db, device_id, start, end, resolution, max_points + 1)
+    return resolution, points[:max_points], len(points) > max_points
+
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_ITEM_DELIMITERS = " \t\n\r,]"
+
+
+class StreamItemParser:
+    """
+    Incremental decoder for a body holding NDJSON (one object per line) or a
+    single JSON array of objects; the format is sniffed from the first
+    non-blank byte. `feed()` takes bytes as they arrive and returns
+    (index, item) pairs for every complete item, where item is the decoded
+    value or the ValueError that made it unreadable. Indexes are 0-based line
+    numbers for NDJSON and array positions otherwise. Only the unparsed tail
+    is buffered.
+    """
+
+    def __init__(self, max_item_bytes: int = MAX_ITEM_BYTES):
+        self.max_item_bytes = max_item_bytes
+        self.mode = None  # "ndjson" or "array"
+        self.index = 0
+        self._head = b""
+        self._buffer = None
+        self._skipping_line = False
+        self._expect_separator = False
+        self._done = False
+        self._decoder = json.JSONDecoder()
+        self._text = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    def feed(self, chunk: bytes) -> List[tuple]:
+        if self.mode is None:
+            self._head += chunk
+            stripped = self._head.lstrip()
+            if not stripped:
+                return []
+            self._head = b""
+            if stripped[:1] == b"[":
+                self.mode, self._buffer = "array", ""
+                return self._feed_array(self._text.decode(stripped[1:]), final=False)
+            self.mode, self._buffer = "ndjson", b""
+            return self._feed_lines(stripped, final=False)
+        if self.mode == "ndjson":
+            return self._feed_lines(chunk, final=False)
+        return self._feed_array(self._text.decode(chunk), final=False)
+
+    def close(self) -> List[tuple]:
+        if self.mode == "ndjson":
+            return self._feed_lines(b"", final=True)
+        if self.mode == "array":
+            return self._feed_array(self._text.decode(b"", final=True), final=True)
+        return []
+
+    def _feed_lines(self, chunk: bytes, final: bool) -> List[tuple]:
+        *lines, tail = (self._buffer + chunk).split(b"\n")
+        if final:
+            lines.append(tail)
+            tail = b""
+        items = []
+        for line in lines:
+            if self._skipping_line:
+                self._skipping_line = False  # End of an over-long line, already rejected
+            elif line.strip():
+                try:
+                    items.append((self.index, json.loads(line)))
+                except ValueError as e:
+                    items.append((self.index, e))
+            self.index += 1
+        if self._skipping_line:
+            tail = b""
+        elif len(tail) > self.max_item_bytes:
+            items.append((self.index, ValueError(f"Line exceeds {self.max_item_bytes} bytes")))
+            self._skipping_line = True
+            tail = b""
+        self._buffer = tail
+        return items
+
+    def _feed_array(self, chunk: str, final: bool) -> List[tuple]:
+        if self._done:
+            return []
+        buffer = self._buffer + chunk
+        pos = 0
+        items = []
+        while True:
+            pos = _WHITESPACE.match(buffer, pos).end()
+            if pos == len(buffer):
+                break
+            if buffer[pos] == "]" and (self._expect_separator or self.index == 0):
+                self._done = True
+                break
+            if self._expect_separator:
+                if buffer[pos] != ",":
+                    return self._abandon(items, f"Expected ',' or ']' at item {self.index}")
+                self._expect_separator = False
+                pos += 1
+                continue
+            try:
+                value, end = self._decoder.raw_decode(buffer, pos)
+            except ValueError as e:
+                if final or len(buffer) - pos > self.max_item_bytes:
+                    return self._abandon(items, f"Malformed JSON array: {e}")
+                break  # Item continues in the next chunk
+            if (not final and not isinstance(value, (dict, list)) and len(buffer) - pos <= self.max_item_bytes
+                    and (end == len(buffer) or buffer[end] not in _ITEM_DELIMITERS)):
+                break  # A number cut by the chunk boundary ("3" of "3.5") may still have digits to come
+            items.append((self.index, value))
+            self.index += 1
+            self._expect_separator = True
+            pos = end
+        self._buffer = "" if self._done else buffer[pos:]
+        if final and not self._done:
+            return self._abandon(items, "Unterminated JSON array")
+        return items
+
+    def _abandon(self, items: List[tuple], detail: str) -> List[tuple]:
+        # The array cannot be resynchronised after a syntax error, so the rest of the body is dropped
+        items.append((self.index, ValueError(detail)))
+        self._done = True
+        self._buffer = ""
+        return items
+
+
+class BatchIngestor:
+    """
+    Validates decoded batch items and writes them through `ingest()` in
+    transactions of up to `transaction_rows` readings. Items that are not
+    valid readings, or that name an unknown device, are rejected by index.
+    """
+
+    def __init__(self, db: Session, transaction_rows: int = BATCH_TRANSACTION_ROWS):
+        self.db = db
+        self.transaction_rows = transaction_rows
+        self.accepted = 0
+        self.rejected = 0
+        self.rejects = []
+        self.pending = []
+        self._known_devices = set()
+        self._missing_devices = set()
+
+    @property
+    def full(self) -> bool:
+        return len(self.pending) >= self.transaction_rows
+
+    def reject(self, index: int, detail: str):
+        self.rejected += 1
+        if len(self.rejects) < MAX_REPORTED_REJECTS:
+            self.rejects.append({"index": index, "detail": detail})
+
+    def add(self, index: int, item):
+        if isinstance(item, Exception):
+            self.reject(index, f"Invalid JSON: {item}")
+            return
+        if not isinstance(item, dict):
+            self.reject(index, "Expected a JSON object")
+            return
+        try:
+            reading = schemas.TelemetryBatchItem(**item)
+        except ValueError as e:
+            self.reject(index, str(e))
+            return
+        self.pending.append((index, reading.device_id, reading.ts, reading.data))
+
+    def feed(self, parser: StreamItemParser, chunk: bytes):
+        """Decode and validate the items `chunk` completes, writing them once a transaction's worth is pending."""
+        for index, item in parser.feed(chunk):
+            self.add(index, item)
+        if self.full:
+            self.flush()
+
+    def finish(self, parser: StreamItemParser):
+        """Take the body's last item, if any, and write everything still pending."""
+        for index, item in parser.close():
+            self.add(index, item)
+        self.flush()
+
+    def flush(self):
+        """Write the pending readings of known devices in one transaction."""
+        if not self.pending:
+            return
+        unseen = list({device_id for _, device_id, _, _ in self.pending} - self._known_devices - self._missing_devices)
+        for start in range(0, len(unseen), DEVICE_LOOKUP_CHUNK):
+            chunk = unseen[start:start + DEVICE_LOOKUP_CHUNK]
+            found = {row[0] for row in self.db.query(models.Device.id).filter(models.Device.id.in_(chunk))}
+            self._known_devices |= found
+            self._missing_devices |= set(chunk) - found
+
+        readings = []
+        for index, device_id, ts, data in self.pending:
+            if device_id in self._known_devices:
+                readings.append((device_id, ts, data))
+            else:
+                self.reject(index, f"Device not found: {device_id}")
+        self.pending = []
+
+        accepted, device_ids = ingest(self.db, readings)
+        self.db.commit()
+        cache.invalidate("device", *device_ids)
+        hotstate.store.refresh(self.db, device_ids)
+        pubsub.notify_devices(self.db, device_ids, "telemetry")
+        self.accepted += accepted
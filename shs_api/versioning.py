@@ -0,0 +1,83 @@
+# versioning.py
+"""Row versions, ETags and compare-and-swap writes for conditional requests."""
+import re
+from typing import List, Optional
+
+from fastapi import HTTPException, Response
+from sqlalchemy import delete, update
+
+_ETAG = re.compile(r'^"(\d+)(?:-[0-9a-f]+)?"$')
+
+
+def etag(payload: dict) -> str:
+    """The ETag of a response payload (a dict with `version`, and `last_updated` for devices)."""
+    last_updated = payload.get("last_updated")
+    if last_updated is None:
+        return f'"{payload["version"]}"'
+    return f'"{payload["version"]}-{int(last_updated.timestamp() * 1_000_000):x}"'
+
+
+def conditional(payload: dict, response: Response, if_none_match: Optional[str]):
+    """
+    Attach the payload's ETag to `response`, or answer 304 without
+    serializing the payload when the client's copy is current.
+    """
+    tag = etag(payload)
+    if not_modified(if_none_match, tag):
+        return Response(status_code=304, headers={"ETag": tag})
+    response.headers["ETag"] = tag
+    return payload
+
+
+def _entity_tags(header: str) -> List[str]:
+    return [tag.strip() for tag in header.split(",") if tag.strip()]
+
+
+def not_modified(if_none_match: Optional[str], current: str) -> bool:
+    """Whether an If-None-Match header matches `current` (weak comparison)."""
+    if not if_none_match:
+        return False
+    tags = _entity_tags(if_none_match)
+    return "*" in tags or current in (tag[2:] if tag.startswith("W/") else tag for tag in tags)
+
+
+def expected_versions(if_match: Optional[str]) -> Optional[List[int]]:
+    """
+    Versions an If-Match header allows: None when the write is unconditional
+    (no header, or `*`, which only requires the row to exist).
+    """
+    if not if_match:
+        return None
+    tags = _entity_tags(if_match)
+    if "*" in tags:
+        return None
+    versions = []
+    for tag in tags:
+        match = _ETAG.match(tag)  # Weak tags never match under If-Match's strong comparison
+        if match:
+            versions.append(int(match.group(1)))
+    if not versions:
+        raise HTTPException(status_code=412, detail="Precondition failed")
+    return versions
+
+
+def cas_update(table, entity_id: str, values: dict, versions: Optional[List[int]]):
+    """UPDATE ... RETURNING that bumps the version, conditional on `versions` when given."""
+    stmt = update(table).where(table.c.id == entity_id)
+    if versions is not None:
+        stmt = stmt.where(table.c.version.in_(versions))
+    return stmt.values(**values, version=table.c.version + 1).returning(*table.c)
+
+
+def cas_delete(table, entity_id: str, versions: Optional[List[int]]):
+    stmt = delete(table).where(table.c.id == entity_id)
+    if versions is not None:
+        stmt = stmt.where(table.c.version.in_(versions))
+    return stmt
+
+
+def missed(exists: bool, detail: str):
+    """Raise for a compare-and-swap that matched no row: 412 if the row exists, else 404."""
+    if exists:
+        raise HTTPException(status_code=412, detail="Precondition failed")
+    raise HTTPException(status_code=404, detail=detail)
@@ -1,10 +1,19 @@
+import json
 import unittest
 import uuid
-from datetime import datetime
+from unittest import mock
+from datetime import datetime, timedelta, timezone
 from fastapi.testclient import TestClient
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
 import os
+import asyncio
+import tempfile
+import threading
+import time
+
+# Read when shs_api.database is imported: keep the app (and its lifespan) off ./smart_home.db
+os.environ["SHS_DATABASE_URL"] = "sqlite:///:memory:"
 
 from main import app, get_db
 from shs_api.database import Base
@@ -32,8 +41,18 @@ TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engin
 
 # Override the engine and SessionLocal in shs_api.database so that the entire app uses the test DB.
 import shs_api.database as db_mod
+from shs_api.cache import LRUTTLCache
+from shs_api.telemetry import StreamItemParser
+from shs_api import retention
+from shs_api.retention import RetentionPolicy
+from shs_api.pubsub import Broker, sse_stream
+from shs_api import cache, cascade, hotstate, metrics, search, slowlog, telemetry
+from shs_api.hotstate import HotStateStore
+from starlette.websockets import WebSocketDisconnect
 db_mod.engine = engine
 db_mod.SessionLocal = TestingSessionLocal
+metrics.instrument_engine(engine)
+hotstate.store.writeback_interval = 0  # Tests write device status back explicitly
 
 def override_get_db():
     """Override the get_db dependency to use an in-memory database."""
@@ -179,6 +198,63 @@ class TestAPIEndpoints(unittest.TestCase):
         """Drop all tables after all tests to keep things clean."""
         Base.metadata.drop_all(bind=engine)
 
+    # Helpers for tests that need a house -> room -> device hierarchy
+    def _create_house(self, **overrides):
+        payload = {
+            "name": "Helper House",
+            "address": "1 Helper Way",
+            "latitude": 42.0,
+            "longitude": -71.0,
+            "owner_ids": [str(uuid.uuid4())],
+            "occupant_count": 2
+        }
+        payload.update(overrides)
+        resp = client.post("/houses/", json=payload)
+        self.assertEqual(resp.status_code, 200, resp.text)
+        return resp.json()
+
+    def _create_room(self, house_id, **overrides):
+        payload = {
+            "name": "Helper Room",
+            "floor": 1,
+            "size": 20.0,
+            "house_id": house_id,
+            "type": "bedroom"
+        }
+        payload.update(overrides)
+        resp = client.post("/rooms/", json=payload)
+        self.assertEqual(resp.status_code, 200, resp.text)
+        return resp.json()
+
+    def _create_device(self, room_id, **overrides):
+        payload = {
+            "type": "light",
+            "name": "Helper Light",
+            "room_id": room_id,
+            "settings": {"brightness": 50}
+        }
+        payload.update(overrides)
+        resp = client.post("/devices/", json=payload)
+        self.assertEqual(resp.status_code, 200, resp.text)
+        return resp.json()
+
+    def _assert_query_budget(self, expected, method, url, **kwargs):
+        """Send one request and assert it ran exactly `expected` SQL statements (per its X-DB-Queries header)."""
+        statements = []
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        event.listen(engine, "before_cursor_execute", capture)
+        try:
+            with mock.patch.object(metrics, "DEBUG_HEADERS", True):
+                resp = client.request(method, url, **kwargs)
+        finally:
+            event.remove(engine, "before_cursor_execute", capture)
+        self.assertLess(resp.status_code, 400, resp.text)
+        self.assertEqual(int(resp.headers["X-DB-Queries"]), expected,
+                         f"{method} {url} ran:\n" + "\n".join(statements))
+        self.assertGreaterEqual(float(resp.headers["X-DB-Time"]), 0.0)
+        return resp
+
     # --------------------------
     #  USER ENDPOINTS
     # --------------------------
@@ -229,6 +305,43 @@ class TestAPIEndpoints(unittest.TestCase):
         self.assertEqual(updated_data["email"], "robert@example.com")
         self.assertEqual(updated_data["privilege"], "admin")
 
+    def test_list_users_keyset_pagination(self):
+        # Users created in the same second must still page without gaps or repeats
+        created_ids = set()
+        for i in range(5):
+            payload = {
+                "name": f"Pager {i}",
+                "username": f"pager{i}",
+                "phone_number": "5550000000",
+                "email": f"pager{i}@example.com",
+                "privilege": "guest"
+            }
+            resp = client.post("/users/", json=payload)
+            self.assertEqual(resp.status_code, 200, resp.text)
+            created_ids.add(resp.json()["id"])
+
+        seen_ids = []
+        cursor = None
+        while True:
+            params = {"limit": 2}
+            if cursor:
+                params["cursor"] = cursor
+            page_resp = client.get("/users/", params=params)
+            self.assertEqual(page_resp.status_code, 200, page_resp.text)
+            page = page_resp.json()
+            self.assertLessEqual(len(page["items"]), 2)
+            seen_ids.extend(item["id"] for item in page["items"])
+            cursor = page["next_cursor"]
+            if not cursor:
+                break
+
+        self.assertEqual(len(seen_ids), len(set(seen_ids)))
+        self.assertTrue(created_ids.issubset(seen_ids))
+
+    def test_list_users_invalid_cursor(self):
+        resp = client.get("/users/", params={"cursor": "not-a-cursor"})
+        self.assertEqual(resp.status_code, 400, resp.text)
+
     def test_delete_user(self):
         # Create user to delete
         payload = {
@@ -571,6 +684,1080 @@ class TestAPIEndpoints(unittest.TestCase):
         get_resp = client.get(f"/devices/{device_id}")
         self.assertEqual(get_resp.status_code, 404, get_resp.text)
 
+    def test_patch_device_merges_settings(self):
+        room_id = self._create_room(self._create_house()["id"])["id"]
+        device_id = self._create_device(room_id, settings={"brightness": 50, "color": "warm", "scene": {"a": 1}})["id"]
+        self.assertEqual(client.get(f"/devices/{device_id}").status_code, 200)  # Warm the cache
+
+        statements = []
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        event.listen(engine, "before_cursor_execute", capture)
+        try:
+            resp = client.patch(f"/devices/{device_id}", json={"settings": {"brightness": 10, "color": None}},
+                                headers={"Content-Type": "application/merge-patch+json"})
+        finally:
+            event.remove(engine, "before_cursor_execute", capture)
+        self.assertEqual(resp.status_code, 200, resp.text)
+        self.assertEqual(resp.json()["settings"], {"brightness": 10, "scene": {"a": 1}})
+        update_sql = [s for s in statements if s.startswith("UPDATE devices")]
+        self.assertEqual(len(update_sql), 1)
+        set_clause = update_sql[0].split(" WHERE ")[0]
+        self.assertIn("json_patch", set_clause)
+        self.assertNotIn("name", set_clause)
+
+        device = client.get(f"/devices/{device_id}").json()
+        self.assertEqual(device["settings"], {"brightness": 10, "scene": {"a": 1}})
+        self.assertEqual(device["name"], "Helper Light")
+
+        resp = client.patch(f"/devices/{device_id}", json={"name": "Dimmer", "settings": None})
+        self.assertEqual(resp.status_code, 200, resp.text)
+        self.assertEqual((resp.json()["name"], resp.json()["settings"]), ("Dimmer", {}))
+
+    def test_patch_validation(self):
+        house = self._create_house()
+        room_id = self._create_room(house["id"])["id"]
+        device_id = self._create_device(room_id)["id"]
+        self.assertEqual(client.patch(f"/devices/{device_id}", json={"type": "toaster"}).status_code, 400)
+        self.assertEqual(client.patch(f"/devices/{device_id}", json={"name": None}).status_code, 400)
+        self.assertEqual(client.patch(f"/devices/{device_id}", json={"colour": "red"}).status_code, 422)
+        self.assertEqual(client.patch(f"/rooms/{room_id}", json={"type": "attic"}).status_code, 400)
+        self.assertEqual(client.patch("/devices/missing", json={"name": "x"}).status_code, 404)
+        self.assertEqual(client.patch("/houses/missing", json={}).status_code, 404)
+
+        resp = client.patch(f"/houses/{house['id']}", json={})
+        self.assertEqual(resp.status_code, 200, resp.text)
+        self.assertEqual(resp.json()["name"], house["name"])
+
+    def test_patch_runs_the_create_checks(self):
+        user_id = client.post("/users/", json={
+            "name": "Val Idate", "username": "validate", "phone_number": "1112223333",
+            "email": "validate@example.com", "privilege": "regular",
+        }).json()["id"]
+        house = self._create_house()
+        room_id = self._create_room(house["id"])["id"]
+        device_id = self._create_device(room_id)["id"]
+        rejected = [
+            (f"/users/{user_id}", {"email": ""}),
+            (f"/houses/{house['id']}", {"name": ""}),
+            (f"/houses/{house['id']}", {"owner_ids": []}),
+            (f"/houses/{house['id']}", {"occupant_count": 0}),
+            (f"/rooms/{room_id}", {"floor": -1}),
+            (f"/rooms/{room_id}", {"size": 0}),
+            (f"/rooms/{room_id}", {"house_id": ""}),
+            (f"/devices/{device_id}", {"name": ""}),
+            (f"/devices/{device_id}", {"room_id": ""}),
+        ]
+        for url, patch in rejected:
+            with self.subTest(url=url, patch=patch):
+                self.assertEqual(client.patch(url, json=patch).status_code, 400)
+                self.assertEqual(client.get(url).json()["version"], 1)  # Rolled back
+        self.assertEqual(client.get(f"/houses/{house['id']}").json()["owner_ids"], house["owner_ids"])
+
+    def test_patch_user_house_and_room(self):
+        user = client.post("/users/", json={
+            "name": "Pat Cher", "username": "patcher", "phone_number": "1112223333",
+            "email": "patcher@example.com", "privilege": "regular",
+        }).json()
+        self.assertEqual(client.get(f"/users/{user['id']}").status_code, 200)  # Warm the cache
+        resp = client.patch(f"/users/{user['id']}", json={"privilege": "admin"})
+        self.assertEqual(resp.status_code, 200, resp.text)
+        self.assertEqual(client.get(f"/users/{user['id']}").json()["privilege"], "admin")
+        self.assertEqual(client.patch(f"/users/{user['id']}", json={"privilege": "root"}).status_code, 400)
+
+        house_id = self._create_house()["id"]
+        resp = client.patch(f"/houses/{house_id}", json={"occupant_count": 7, "owner_ids": ["a", "b"]})
+        self.assertEqual(resp.status_code, 200, resp.text)
+        self.assertEqual((resp.json()["occupant_count"], resp.json()["owner_ids"]), (7, ["a", "b"]))
+
+        room_id = self._create_room(house_id)["id"]
+        resp = client.patch(f"/rooms/{room_id}", json={"floor": 3, "type": "kitchen"})
+        self.assertEqual(resp.status_code, 200, resp.text)
+        self.assertEqual(client.get(f"/rooms/{room_id}").json()["type"], "kitchen")
+
+    def test_conditional_get_with_etag(self):
+        house_id = self._create_house()["id"]
+        resp = client.get(f"/houses/{house_id}")
+        self.assertEqual(resp.headers["ETag"], '"1"')
+        self.assertEqual(resp.json()["version"], 1)
+
+        resp = client.get(f"/houses/{house_id}", headers={"If-None-Match": '"1"'})
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.content, b"")
+        self.assertEqual(resp.headers["ETag"], '"1"')
+
+        patched = client.patch(f"/houses/{house_id}", json={"occupant_count": 4})
+        self.assertEqual(patched.headers["ETag"], '"2"')
+        resp = client.get(f"/houses/{house_id}", headers={"If-None-Match": 'W/"1"'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()["occupant_count"], 4)
+
+    def test_if_match_rejects_lost_updates(self):
+        room_id = self._create_room(self._create_house()["id"])["id"]
+        device_id = self._create_device(room_id)["id"]
+        etag = client.get(f"/devices/{device_id}").headers["ETag"]
+        payload = {"type": "light", "name": "Controller A", "room_id": room_id, "settings": {"brightness": 10}}
+
+        first = client.put(f"/devices/{device_id}", json=payload, headers={"If-Match": etag})
+        self.assertEqual(first.status_code, 200, first.text)
+        self.assertEqual(first.json()["version"], 2)
+        second = client.put(f"/devices/{device_id}", json={**payload, "name": "Controller B"}, headers={"If-Match": etag})
+        self.assertEqual(second.status_code, 412)
+        resp = client.patch(f"/devices/{device_id}", json={"name": "C"}, headers={"If-Match": etag})
+        self.assertEqual(resp.status_code, 412)
+        self.assertEqual(client.get(f"/devices/{device_id}").json()["name"], "Controller A")
+
+        # Status changes alter the device ETag but not the version guarded by If-Match
+        client.post(f"/devices/{device_id}/status", json={"status": True})
+        resp = client.get(f"/devices/{device_id}", headers={"If-None-Match": first.headers["ETag"]})
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.json()["status"])
+
+        self.assertEqual(client.delete(f"/devices/{device_id}", headers={"If-Match": etag}).status_code, 412)
+        self.assertEqual(client.delete(f"/devices/{device_id}", headers={"If-Match": resp.headers["ETag"]}).status_code, 200)
+        self.assertEqual(client.delete(f"/devices/{device_id}", headers={"If-Match": "*"}).status_code, 404)
+
+    def test_user_houses_follow_owner_ids(self):
+        user = client.post("/users/", json={
+            "name": "Owner One", "username": "ownerone", "phone_number": "5550001111",
+            "email": "ownerone@example.com", "privilege": "regular",
+        }).json()
+        first = self._create_house(owner_ids=[user["id"], "someone-else"])
+        second = self._create_house(owner_ids=[user["id"]])
+        resp = client.get(f"/users/{user['id']}/houses")
+        self.assertEqual(resp.status_code, 200, resp.text)
+        self.assertEqual([h["id"] for h in resp.json()], sorted([first["id"], second["id"]]))
+        self.assertEqual(client.get("/users/someone-else/houses").status_code, 404)  # Owns one, but is no user
+
+        payload = {k: first[k] for k in ("name", "address", "latitude", "longitude", "occupant_count")}
+        client.put(f"/houses/{first['id']}", json={**payload, "owner_ids": ["someone-else"]})
+        self.assertEqual([h["id"] for h in client.get(f"/users/{user['id']}/houses").json()], [second["id"]])
+        client.patch(f"/houses/{first['id']}", json={"owner_ids": [user["id"]]})
+        self.assertEqual(len(client.get(f"/users/{user['id']}/houses").json()), 2)
+        self.assertEqual(client.get("/users/someone-else/houses").status_code, 404)
+
+        client.delete(f"/houses/{second['id']}")
+        self.assertEqual([h["id"] for h in client.get(f"/users/{user['id']}/houses").json()], [first["id"]])
+
+        client.delete(f"/users/{user['id']}")
+        self.assertEqual(client.get(f"/users/{user['id']}/houses").status_code, 404)
+        with engine.connect() as conn:
+            self.assertEqual(conn.exec_driver_sql("SELECT count(*) FROM house_owners WHERE user_id = ?",
+                                                  (user["id"],)).scalar(), 0)
+
+    def test_migration_backfills_house_owners(self):
+        from shs_api import migrations
+        scratch = create_engine("sqlite://", poolclass=StaticPool)
+        Base.metadata.create_all(bind=scratch)
+        with scratch.begin() as conn:
+            conn.exec_driver_sql("DROP TABLE house_owners")
+            conn.execute(models.House.__table__.insert(), [
+                {"id": "h1", "name": "A", "address": "1", "latitude": 0.0, "longitude": 0.0,
+                 "owner_ids": ["u1", "u2"], "occupant_count": 1},
+                {"id": "h2", "name": "B", "address": "2", "latitude": 0.0, "longitude": 0.0,
+                 "owner_ids": ["u1"], "occupant_count": 1},
+            ])
+        migrations.upgrade(scratch)
+        migrations.upgrade(scratch)  # Idempotent; the backfill only runs when the table is created
+        with scratch.connect() as conn:
+            rows = conn.exec_driver_sql("SELECT user_id, house_id FROM house_owners ORDER BY 1, 2").all()
+        self.assertEqual([tuple(r) for r in rows], [("u1", "h1"), ("u1", "h2"), ("u2", "h1")])
+        scratch.dispose()
+
+    def test_nearby_and_within_houses(self):
+        # Fiji straddles the antimeridian; no other test places houses there
+        near = self._create_house(latitude=-17.0, longitude=179.99)
+        across = self._create_house(latitude=-17.0, longitude=-179.99)
+        far = self._create_house(latitude=-17.5, longitude=179.99)
+        resp = client.get("/houses/nearby", params={"lat": -17.0, "lon": 179.995, "radius_km": 5})
+        self.assertEqual(resp.status_code, 200, resp.text)
+        self.assertEqual({h["id"] for h in resp.json()}, {near["id"], across["id"]})
+        self.assertLess(resp.json()[0]["distance_km"], 1.0)
+        nearest = client.get("/houses/nearby", params={"lat": -17.0, "lon": -179.98, "radius_km": 100, "limit": 2})
+        self.assertEqual([h["id"] for h in nearest.json()], [across["id"], near["id"]])
+
+        box = {"min_lat": -18.0, "min_lon": 179.0, "max_lat": -16.0, "max_lon": -179.0}
+        pages, cursor = [], None
+        while True:
+            page = client.get("/houses/within", params={**box, "limit": 1, **({"cursor": cursor} if cursor else {})})
+            self.assertEqual(page.status_code, 200, page.text)
+            pages += [h["id"] for h in page.json()["items"]]
+            cursor = page.json()["next_cursor"]
+            if cursor is None:
+                break
+        self.assertEqual(sorted(pages), sorted([near["id"], across["id"], far["id"]]))
+        bad = client.get("/houses/within", params={**box, "min_lat": 0.0})
+        self.assertEqual(bad.status_code, 400)
+
+        # Patching one coordinate re-derives the geohash from the other, stored one
+        client.patch(f"/houses/{far['id']}", json={"latitude": -17.0})
+        resp = client.get("/houses/nearby", params={"lat": -17.0, "lon": 179.99, "radius_km": 0.1})
+        self.assertEqual({h["id"] for h in resp.json()}, {near["id"], far["id"]})
+        client.patch(f"/houses/{far['id']}", json={"longitude": 10.0})
+        resp = client.get("/houses/nearby", params={"lat": -17.0, "lon": 10.0, "radius_km": 0.1})
+        self.assertEqual([h["id"] for h in resp.json()], [far["id"]])
+
+    def test_migration_backfills_house_geohash(self):
+        from shs_api import geo, migrations
+        scratch = create_engine("sqlite://", poolclass=StaticPool)
+        Base.metadata.create_all(bind=scratch)
+        with scratch.begin() as conn:
+            conn.exec_driver_sql("DROP INDEX ix_houses_geohash")
+            conn.exec_driver_sql("ALTER TABLE houses DROP COLUMN geohash")
+            conn.exec_driver_sql(
+                "INSERT INTO houses (id, name, address, latitude, longitude, owner_ids, occupant_count) "
+                "VALUES ('h1', 'A', '1', 42.36, -71.06, '[]', 1)"
+            )
+        migrations.upgrade(scratch)
+        with scratch.connect() as conn:
+            self.assertEqual(conn.exec_driver_sql("SELECT geohash FROM houses").scalar(), geo.encode(42.36, -71.06))
+        self.assertEqual(geo.encode(57.64911, 10.40744, 11), "u4pruydqqvj")  # The reference example
+        scratch.dispose()
+
+    def test_search_tracks_creates_updates_and_deletes(self):
+        house = self._create_house(name="Quillfeather Cottage", address="12 Marigold Lane")
+        room = self._create_room(house["id"], name="Quillfeather Study")
+        device = self._create_device(room["id"], name="Desk Lamp")
+
+        resp = client.get("/search", params={"q": "quillf"})
+        self.assertEqual(resp.status_code, 200, resp.text)
+        self.assertEqual(sorted((h["type"], h["id"]) for h in resp.json()),
+                         [("house", house["id"]), ("room", room["id"])])
+        resp = client.get("/search", params={"q": "marigold la", "types": "house"})
+        self.assertEqual([h["id"] for h in resp.json()], [house["id"]])
+        self.assertEqual(client.get("/search", params={"q": "quillf", "types": "room,device"}).json()[0]["id"],
+                         room["id"])
+        self.assertEqual(client.get("/search", params={"q": "x", "types": "garage"}).status_code, 400)
+        self.assertEqual(client.get("/search", params={"q": '"AND* ('}).status_code, 200)  # Operators are literal
+
+        client.patch(f"/devices/{device['id']}", json={"name": "Quillfeather Lamp"})
+        self.assertIn(device["id"], [h["id"] for h in client.get("/search", params={"q": "quillfeather lamp"}).json()])
+        self.assertEqual(client.get("/search", params={"q": "desk", "types": "device"}).json(), [])
+
+        client.delete(f"/houses/{house['id']}")  # Cascades to the room and device
+        self.assertEqual(client.get("/search", params={"q": "quillfeather"}).json(), [])
+
+    def test_search_ranks_every_match(self):
+        house_id = self._create_house()["id"]
+        for n in range(30):
+            self._create_room(house_id, name=f"Zephyrine Annex Wing {n}")
+        exact = self._create_room(house_id, name="Zephyrine")["id"]  # The best match, but the last row
+
+        hits = client.get("/search", params={"q": "zephyrine", "types": "room", "limit": 1}).json()
+        self.assertEqual([hit["id"] for hit in hits], [exact])
+
+    def test_search_survives_renumbered_rowids(self):
+        house_id = self._create_house()["id"]
+        rooms = {self._create_room(house_id, name=f"Orrery {name}")["id"]: name for name in ("Lantern", "Vault")}
+        with engine.begin() as conn:  # What a VACUUM may do to tables without an INTEGER PRIMARY KEY
+            conn.exec_driver_sql("UPDATE rooms SET rowid = 1000000 - rowid")
+
+        hits = client.get("/search", params={"q": "orrery lantern", "types": "room"}).json()
+        self.assertEqual([rooms[hit["id"]] for hit in hits], ["Lantern"])
+        client.delete(f"/rooms/{hits[0]['id']}")
+        hits = client.get("/search", params={"q": "orrery", "types": "room"}).json()
+        self.assertEqual([rooms[hit["id"]] for hit in hits], ["Vault"])
+
+    def test_migration_replaces_rowid_keyed_search_index(self):
+        from shs_api import migrations
+        scratch = create_engine("sqlite://", poolclass=StaticPool)
+        Base.metadata.create_all(bind=scratch)
+        index = search.SEARCH_INDEXES["room"]
+        with scratch.begin() as conn:
+            for statement in search.drop_statements(index):
+                conn.exec_driver_sql(statement)
+            conn.exec_driver_sql(f"CREATE VIRTUAL TABLE {index.name} USING fts5(name, content='rooms', "
+                                 f"content_rowid='rowid')")
+            conn.exec_driver_sql("INSERT INTO rooms (id, name, floor, size, house_id, type) "
+                                 "VALUES ('r1', 'Orrery', 0, 1.0, 'h1', 'bedroom')")
+        migrations.upgrade(scratch)
+        with scratch.connect() as conn:
+            self.assertEqual(conn.exec_driver_sql(f"SELECT id FROM {index.keys}").scalar(), "r1")
+        session = sessionmaker(bind=scratch)()
+        self.assertEqual([hit["id"] for hit in search.search(session, "orrery", ["room"], 5)], ["r1"])
+        session.close()
+        scratch.dispose()
+
+    def test_house_stats_follow_room_and_device_writes(self):
+        house_id, other_id = self._create_house()["id"], self._create_house()["id"]
+        kitchen = self._create_room(house_id, size=12.5)["id"]
+        hall = self._create_room(house_id, size=7.5)["id"]
+        lights = [self._create_device(kitchen)["id"] for _ in range(2)]
+        self._create_device(hall, type="thermostat")
+        client.post(f"/houses/{house_id}/commands", json={"filter": {"type": "light"}, "status": True})
+
+        stats = client.get(f"/houses/{house_id}/stats").json()
+        self.assertEqual((stats["rooms"], stats["floor_area"], stats["devices"], stats["active_devices"]),
+                         (2, 20.0, 3, 2))
+        self.assertEqual(stats["devices_by_type"], {"light": 2, "thermostat": 1})
+        self.assertEqual(stats["active_devices_by_type"], {"light": 2})
+
+        client.patch(f"/devices/{lights[0]}", json={"type": "other"})
+        client.patch(f"/rooms/{hall}", json={"house_id": other_id, "size": 10.0})  # Takes its thermostat along
+        client.delete(f"/devices/{lights[1]}")
+        stats = client.get(f"/houses/{house_id}/stats").json()
+        self.assertEqual((stats["rooms"], stats["floor_area"], stats["devices_by_type"]), (1, 12.5, {"other": 1}))
+        moved = client.get(f"/houses/{other_id}/stats").json()
+        self.assertEqual((moved["rooms"], moved["floor_area"], moved["devices_by_type"]),
+                         (1, 10.0, {"thermostat": 1}))
+
+        db = TestingSessionLocal()
+        try:
+            db.execute(models.HouseStats.__table__.update().values(rooms=99))  # Drift, as if a trigger was bypassed
+            db.commit()
+        finally:
+            db.close()
+        self.assertEqual(client.post("/admin/house-stats/rebuild").status_code, 200)
+        self.assertEqual(client.get(f"/houses/{house_id}/stats").json(), stats)
+
+        client.delete(f"/houses/{other_id}")
+        self.assertEqual(client.get(f"/houses/{other_id}/stats").status_code, 404)
+        self.assertEqual(client.get(f"/houses/{house_id}/stats").json()["devices"], 1)
+
+    def test_delete_house_cascades_to_rooms_and_devices(self):
+        house_id = self._create_house()["id"]
+        rooms = [self._create_room(house_id)["id"] for _ in range(2)]
+        devices = [self._create_device(room_id)["id"] for room_id in rooms + rooms[:1]]
+        self.assertEqual(client.get(f"/devices/{devices[0]}").status_code, 200)  # Warm the cache
+
+        resp = client.delete(f"/houses/{house_id}")
+        self.assertEqual(resp.status_code, 200, resp.text)
+        self.assertEqual((resp.json()["rooms_deleted"], resp.json()["devices_deleted"]), (2, 3))
+        self.assertEqual(client.get(f"/rooms/{rooms[1]}").status_code, 404)
+        self.assertEqual(client.get(f"/devices/{devices[0]}").status_code, 404)
+
+        room_id = self._create_room(self._create_house()["id"])["id"]
+        device_id = self._create_device(room_id)["id"]
+        resp = client.delete(f"/rooms/{room_id}")
+        self.assertEqual(resp.json()["devices_deleted"], 1)
+        self.assertEqual(client.get(f"/devices/{device_id}").status_code, 404)
+
+    def test_purge_orphans_in_batches(self):
+        room_id = self._create_room(self._create_house()["id"])["id"]
+        kept = self._create_device(room_id)["id"]
+        client.post(f"/devices/{kept}/telemetry", json=[{"data": {"level": 1}}])
+        db = TestingSessionLocal()
+        try:
+            orphan_rooms = [models.Room(name="Lost", floor=1, size=1.0, house_id="gone-house", type="other")
+                            for _ in range(3)]
+            db.add_all(orphan_rooms)
+            db.flush()
+            orphan_devices = [models.Device(type="light", name="Lost", room_id=room.id) for room in orphan_rooms]
+            orphan_devices.append(models.Device(type="light", name="Lost", room_id="gone-room"))
+            db.add_all(orphan_devices)
+            db.commit()
+            orphan_ids = [device.id for device in orphan_devices]
+            telemetry.ingest(db, [(device_id, None, {"level": i}) for i, device_id in enumerate(orphan_ids * 2)])
+            db.commit()
+
+            report = cascade.purge_orphans(engine, batch_size=2, pause=0)
+            self.assertGreaterEqual(report["rooms_deleted"], 3)
+            self.assertGreaterEqual(report["devices_deleted"], 4)
+            self.assertGreaterEqual(report["readings_deleted"], 8)
+            self.assertGreaterEqual(report["rollups_deleted"], 12)  # 1m/1h/1d per orphan device
+            for model, column in ((models.Device, models.Device.id), (models.TelemetryReading, models.TelemetryReading.device_id)):
+                self.assertEqual(db.query(model).filter(column.in_(orphan_ids)).count(), 0)
+            self.assertEqual(db.query(models.TelemetryReading).filter_by(device_id=kept).count(), 1)
+        finally:
+            db.close()
+
+        resp = client.post("/admin/orphans/purge")
+        self.assertEqual(resp.status_code, 200, resp.text)
+        self.assertEqual(resp.json()["devices_deleted"], 0)
+
+    # --------------------------
+    #  HIERARCHY ENDPOINTS
+    # --------------------------
+    def test_house_and_room_hierarchy(self):
+        house_id = self._create_house()["id"]
+        kitchen_id = self._create_room(house_id, name="Kitchen", type="kitchen")["id"]
+        bedroom_id = self._create_room(house_id, name="Bedroom")["id"]
+        kitchen_devices = {self._create_device(kitchen_id)["id"] for _ in range(2)}
+        bedroom_device = self._create_device(bedroom_id, type="thermostat", settings={})["id"]
+
+        rooms_resp = client.get(f"/houses/{house_id}/rooms")
+        self.assertEqual(rooms_resp.status_code, 200, rooms_resp.text)
+        self.assertEqual({r["id"] for r in rooms_resp.json()}, {kitchen_id, bedroom_id})
+
+        room_devices_resp = client.get(f"/rooms/{kitchen_id}/devices")
+        self.assertEqual(room_devices_resp.status_code, 200, room_devices_resp.text)
+        self.assertEqual({d["id"] for d in room_devices_resp.json()}, kitchen_devices)
+
+        house_devices_resp = client.get(f"/houses/{house_id}/devices")
+        self.assertEqual(house_devices_resp.status_code, 200, house_devices_resp.text)
+        self.assertEqual({d["id"] for d in house_devices_resp.json()}, kitchen_devices | {bedroom_device})
+
+    def test_hierarchy_unknown_parent(self):
+        self.assertEqual(client.get(f"/houses/{uuid.uuid4()}/rooms").status_code, 404)
+        self.assertEqual(client.get(f"/houses/{uuid.uuid4()}/devices").status_code, 404)
+        self.assertEqual(client.get(f"/rooms/{uuid.uuid4()}/devices").status_code, 404)
+
+        # An existing house without rooms is an empty list, not a 404
+        house_id = self._create_house()["id"]
+        self.assertEqual(client.get(f"/houses/{house_id}/devices").json(), [])
+
+    # --------------------------
+    #  BULK ENDPOINTS
+    # --------------------------
+    def test_bulk_create_devices_reports_item_errors(self):
+        house_id = self._create_house()["id"]
+        room_id = self._create_room(house_id)["id"]
+        payload = [
+            {"type": "light", "name": "Bulk Light 1", "room_id": room_id, "settings": {"brightness": 10}},
+            {"type": "toaster", "name": "Bad Type", "room_id": room_id},
+            {"type": "light", "name": "", "room_id": room_id},
+            {"type": "door lock", "name": "Bulk Lock", "room_id": room_id},
+        ]
+        resp = client.post("/devices/bulk", json=payload)
+        self.assertEqual(resp.status_code, 200, resp.text)
+        body = resp.json()
+        self.assertEqual(len(body["created_ids"]), 2)
+        self.assertEqual([e["index"] for e in body["errors"]], [1, 2])
+
+        room_devices = client.get(f"/rooms/{room_id}/devices").json()
+        self.assertEqual({d["id"] for d in room_devices}, set(body["created_ids"]))
+        light = client.get(f"/devices/{body['created_ids'][0]}").json()
+        self.assertEqual(light["settings"], {"brightness": 10})
+
+    def test_bulk_create_rooms(self):
+        house_id = self._create_house()["id"]
+        payload = [
+            {"name": "Bulk Kitchen", "floor": 0, "size": 12.5, "house_id": house_id, "type": "kitchen"},
+            {"name": "Bulk Attic", "floor": -1, "size": 10.0, "house_id": house_id, "type": "other"},
+        ]
+        resp = client.post("/rooms/bulk", json=payload)
+        self.assertEqual(resp.status_code, 200, resp.text)
+        self.assertEqual(len(resp.json()["created_ids"]), 1)
+        self.assertEqual(resp.json()["errors"][0]["index"], 1)
+
+    def test_bulk_create_users_rejects_duplicates(self):
+        existing = {
+            "name": "Existing Bulk",
+            "username": "bulkexisting",
+            "phone_number": "1231231234",
+            "email": "bulkexisting@example.com",
+            "privilege": "regular"
+        }
+        self.assertEqual(client.post("/users/", json=existing).status_code, 200)
+        payload = [
+            {**existing, "email": "other@example.com"},
+            {**existing, "username": "bulknew1", "email": "bulknew@example.com"},
+            {**existing, "username": "bulknew2", "email": "bulknew@example.com"},
+            {**existing, "username": "bulknew3", "email": "bulknew3@example.com", "privilege": "root"},
+        ]
+        resp = client.post("/users/bulk", json=payload)
+        self.assertEqual(resp.status_code, 200, resp.text)
+        body = resp.json()
+        self.assertEqual(len(body["created_ids"]), 1)
+        self.assertEqual([e["index"] for e in body["errors"]], [0, 2, 3])
+        self.assertEqual(client.get(f"/users/{body['created_ids'][0]}").json()["username"], "bulknew1")
+
+    # --------------------------
+    #  COMMAND ENDPOINTS
+    # --------------------------
+    def test_house_command_updates_matching_devices(self):
+        house_id = self._create_house()["id"]
+        kitchen = self._create_room(house_id, type="kitchen")["id"]
+        bedroom = self._create_room(house_id)["id"]
+        light_a = self._create_device(kitchen, settings={"brightness": 80, "color": "warm"})["id"]
+        light_b = self._create_device(bedroom)["id"]
+        thermostat = self._create_device(bedroom, type="thermostat", settings={"target": 21})["id"]
+        self.assertEqual(client.get(f"/devices/{light_a}").status_code, 200)  # Warm the cache
+
+        resp = client.post(f"/houses/{house_id}/commands", json={
+            "filter": {"type": "light"}, "status": False, "settings": {"brightness": 0},
+        })
+        self.assertEqual(resp.status_code, 200, resp.text)
+        self.assertEqual(sorted(resp.json()["affected_ids"]), sorted([light_a, light_b]))
+
+        device = client.get(f"/devices/{light_a}").json()
+        self.assertFalse(device["status"])
+        self.assertEqual(device["settings"], {"brightness": 0, "color": "warm"})
+        self.assertEqual(client.get(f"/devices/{thermostat}").json()["settings"], {"target": 21})
+
+    def test_room_command_without_filter(self):
+        house_id = self._create_house()["id"]
+        room_id = self._create_room(house_id)["id"]
+        other_room = self._create_room(house_id)["id"]
+        device_ids = [self._create_device(room_id, type=t)["id"] for t in ("light", "door lock")]
+        untouched = self._create_device(other_room)["id"]
+
+        resp = client.post(f"/rooms/{room_id}/commands", json={"status": True})
+        self.assertEqual(resp.status_code, 200, resp.text)
+        self.assertEqual(sorted(resp.json()["affected_ids"]), sorted(device_ids))
+        self.assertTrue(client.get(f"/devices/{device_ids[1]}").json()["status"])
+        self.assertFalse(client.get(f"/devices/{untouched}").json()["status"])
+
+    def test_command_validation_and_not_found(self):
+        house_id = self._create_house()["id"]
+        self.assertEqual(client.post(f"/houses/{house_id}/commands", json={}).status_code, 400)
+        resp = client.post(f"/houses/{house_id}/commands", json={"filter": {"type": "toaster"}, "status": False})
+        self.assertEqual(resp.status_code, 400)
+        resp = client.post(f"/houses/{house_id}/commands", json={"status": False})  # No devices yet
+        self.assertEqual(resp.json(), {"affected_ids": []})
+        self.assertEqual(client.post("/houses/missing/commands", json={"status": False}).status_code, 404)
+        self.assertEqual(client.post("/rooms/missing/commands", json={"status": False}).status_code, 404)
+
+    # --------------------------
+    #  DEVICE STATUS ENDPOINTS
+    # --------------------------
+    def test_device_status_fast_path(self):
+        house_id = self._create_house()["id"]
+        room_id = self._create_room(house_id)["id"]
+        device = self._create_device(room_id)
+        device_id = device["id"]
+
+        resp = client.post(f"/devices/{device_id}/status", json={"status": True, "data": {"brightness": 70}})
+        self.assertEqual(resp.status_code, 200, resp.text)
+        self.assertTrue(resp.json()["status"])
+        status = client.get(f"/devices/{device_id}/status").json()
+        self.assertEqual((status["status"], status["last_data"]), (True, {"brightness": 70}))
+        self.assertTrue(client.get(f"/devices/{device_id}").json()["status"])
+
+        db = TestingSessionLocal()
+        try:
+            row = db.query(models.Device).filter(models.Device.id == device_id).one()
+            self.assertFalse(row.status)  # Not written back yet
+            hotstate.store.writeback()
+            db.refresh(row)
+            self.assertTrue(row.status)
+            self.assertEqual(row.last_data, {"brightness": 70})
+            self.assertEqual(row.updated_at.isoformat(), device["updated_at"])
+        finally:
+            db.close()
+
+        client.post(f"/houses/{house_id}/commands", json={"status": False})
+        self.assertFalse(client.get(f"/devices/{device_id}/status").json()["status"])
+
+        self.assertEqual(client.post("/devices/missing/status", json={"status": True}).status_code, 404)
+        self.assertEqual(client.get("/devices/missing/status").status_code, 404)
+        resp = client.post(f"/devices/{device_id}/status", json={"status": True, "data": {"blob": "x" * 2000}})
+        self.assertEqual(resp.status_code, 400)
+
+    def test_device_status_recovered_from_log(self):
+        room_id = self._create_room(self._create_house()["id"])["id"]
+        device_id = self._create_device(room_id)["id"]
+        with tempfile.TemporaryDirectory() as tmp:
+            log_path = os.path.join(tmp, "status.log")
+            crashed = HotStateStore(log_path=log_path, writeback_interval=0)
+            crashed.ensure_loaded(engine)
+            crashed.set_status(device_id, True, {"level": 3})
+            crashed._log.close()  # Dies before any writeback
+
+            recovered = HotStateStore(log_path=log_path, writeback_interval=0)
+            recovered.ensure_loaded(engine)  # Replays the log and writes it back
+            self.assertEqual(recovered.get(device_id)["last_data"], {"level": 3})
+            self.assertFalse(os.path.exists(log_path + ".1"))
+            recovered.close()
+
+        db = TestingSessionLocal()
+        try:
+            self.assertTrue(db.query(models.Device.status).filter(models.Device.id == device_id).scalar())
+        finally:
+            db.close()
+
+    # --------------------------
+    #  TELEMETRY ENDPOINTS
+    # --------------------------
+    @unittest.skipUnless(hasattr(time, "tzset"), "needs time.tzset")
+    def test_first_reading_after_device_creation_east_of_utc(self):
+        room_id = self._create_room(self._create_house()["id"])["id"]
+        self.addCleanup(time.tzset)  # Runs after TZ is restored
+        with mock.patch.dict(os.environ, {"TZ": "Etc/GMT-5"}):  # UTC+05:00
+            time.tzset()
+            device_id = self._create_device(room_id, type="thermostat", settings={})["id"]
+        reading = {"ts": datetime.now(timezone.utc).isoformat(), "data": {"temperature": 21.0}}
+        resp = client.post(f"/devices/{device_id}/telemetry", json=[reading])
+        self.assertEqual(resp.status_code, 200, resp.text)
+        self.assertEqual(client.get(f"/devices/{device_id}").json()["last_data"], {"temperature": 21.0})
+
+    def test_ingest_telemetry_appends_and_projects_latest(self):
+        room_id = self._create_room(self._create_house()["id"])["id"]
+        device_id = self._create_device(room_id, type="thermostat", settings={})["id"]
+        payload = [
+            {"ts": "2030-01-01T10:00:00", "data": {"temperature": 20.5}},
+            {"ts": "2030-01-01T12:00:00+02:00", "data": {"temperature": 22.0}},  # 10:00 UTC as well
+            {"ts": "2030-01-01T11:00:00Z", "data": {"temperature": 23.5}},
+            {"ts": "2030-01-01T09:00:00", "data": {"temperature": 19.0}},  # Late arrival
+        ]
+        self.assertEqual(client.get(f"/devices/{device_id}").status_code, 200)  # Warm the cache
+        resp = client.post(f"/devices/{device_id}/telemetry", json=payload)
+        self.assertEqual(resp.status_code, 200, resp.text)
+        self.assertEqual(resp.json(), {"device_id": device_id, "accepted": 4})
+
+        device = client.get(f"/devices/{device_id}").json()
+        self.assertEqual(device["last_data"], {"temperature": 23.5})
+        self.assertTrue(device["last_updated"].startswith("2030-01-01T11:00:00"))
+
+        db = TestingSessionLocal()
+        try:
+            readings = (
+                db.query(models.TelemetryReading)
+                .filter(models.TelemetryReading.device_id == device_id)
+                .order_by(models.TelemetryReading.ts)
+                .all()
+            )
+        finally:
+            db.close()
+        self.assertEqual([r.ts.hour for r in readings], [9, 10, 10, 11])
+        self.assertEqual(readings[-1].data, {"temperature": 23.5})
+
+    def test_ingest_telemetry_batch_ndjson(self):
+        room_id = self._create_room(self._create_house()["id"])["id"]
+        device_a = self._create_device(room_id)["id"]
+        device_b = self._create_device(room_id, type="thermostat", settings={})["id"]
+        lines = [
+            json.dumps({"device_id": device_a, "ts": "2030-02-01T00:00:00", "data": {"on": True}}),
+            json.dumps({"device_id": device_b, "ts": "2030-02-01T00:00:05", "data": {"temperature": 21.0}}),
+            "{not json",
+            json.dumps({"device_id": str(uuid.uuid4()), "data": {"on": False}}),
+            "",
+            json.dumps({"device_id": device_b, "ts": "2030-02-01T00:01:00", "data": {"temperature": 21.5}}),
+            json.dumps({"device_id": device_a}),
+        ]
+        resp = client.post("/telemetry/batch", content="\n".join(lines), headers={"Content-Type": "application/x-ndjson"})
+        self.assertEqual(resp.status_code, 200, resp.text)
+        body = resp.json()
+        self.assertEqual((body["accepted"], body["rejected"]), (3, 3))
+        self.assertEqual([r["index"] for r in sorted(body["rejects"], key=lambda r: r["index"])], [2, 3, 6])
+        self.assertEqual(client.get(f"/devices/{device_b}").json()["last_data"], {"temperature": 21.5})
+
+    def test_ingest_telemetry_batch_json_array(self):
+        room_id = self._create_room(self._create_house()["id"])["id"]
+        device_id = self._create_device(room_id)["id"]
+        payload = [{"device_id": device_id, "data": {"brightness": level}} for level in range(5)] + [42]
+        resp = client.post("/telemetry/batch", json=payload)
+        self.assertEqual(resp.status_code, 200, resp.text)
+        self.assertEqual(resp.json()["accepted"], 5)
+        self.assertEqual(resp.json()["rejects"], [{"index": 5, "detail": "Expected a JSON object"}])
+
+    def test_ingest_telemetry_batch_parses_off_the_event_loop(self):
+        device_id = self._create_device(self._create_room(self._create_house()["id"])["id"])["id"]
+        handler_threads, parse_threads = set(), set()
+
+        def recording(threads, method):
+            def wrapper(*args, **kwargs):
+                threads.add(threading.get_ident())
+                return method(*args, **kwargs)
+            return wrapper
+
+        with mock.patch.object(telemetry.StreamItemParser, "__init__",
+                               recording(handler_threads, telemetry.StreamItemParser.__init__)), \
+                mock.patch.object(telemetry.StreamItemParser, "feed",
+                                  recording(parse_threads, telemetry.StreamItemParser.feed)), \
+                mock.patch.object(telemetry.BatchIngestor, "add", recording(parse_threads, telemetry.BatchIngestor.add)):
+            resp = client.post("/telemetry/batch", json=[{"device_id": device_id, "data": {"on": True}}])
+        self.assertEqual(resp.json()["accepted"], 1)
+        self.assertEqual(len(handler_threads), 1)
+        self.assertTrue(parse_threads)
+        self.assertFalse(parse_threads & handler_threads)
+
+    def test_stream_item_parser_split_chunks(self):
+        body = b'[{"a": 1}, {"b": 12} ,\n 3.5, {"c": [1, 2]}]'
+        for size in (1, 2, 5, len(body)):
+            parser = StreamItemParser()
+            items = []
+            for start in range(0, len(body), size):
+                items += parser.feed(body[start:start + size])
+            items += parser.close()
+            self.assertEqual(items, [(0, {"a": 1}), (1, {"b": 12}), (2, 3.5), (3, {"c": [1, 2]})])
+
+        parser = StreamItemParser(max_item_bytes=16)
+        items = parser.feed(b'{"a": 1}\n' + b"x" * 20) + parser.feed(b'x\n{"b": 2}') + parser.close()
+        self.assertEqual([(i, type(v).__name__) for i, v in items], [(0, "dict"), (1, "ValueError"), (2, "dict")])
+
+    def test_telemetry_rollups_and_resolution_choice(self):
+        room_id = self._create_room(self._create_house()["id"])["id"]
+        device_id = self._create_device(room_id, type="thermostat", settings={})["id"]
+        # One reading a minute for three hours, posted in two requests so the rollups merge
+        readings = [
+            {"ts": f"2030-03-01T{10 + i // 60:02d}:{i % 60:02d}:30", "data": {"temperature": float(i), "mode": "heat"}}
+            for i in range(180)
+        ]
+        for part in (readings[:90], readings[90:]):
+            self.assertEqual(client.post(f"/devices/{device_id}/telemetry", json=part).status_code, 200)
+
+        params = {"from": "2030-03-01T10:00:00", "to": "2030-03-01T13:00:00"}
+        raw = client.get(f"/devices/{device_id}/telemetry", params={**params, "max_points": 500}).json()
+        self.assertEqual((raw["resolution"], len(raw["points"]), raw["truncated"]), ("raw", 180, False))
+        self.assertEqual(raw["points"][0]["data"], {"temperature": 0.0, "mode": "heat"})
+
+        hourly = client.get(f"/devices/{device_id}/telemetry", params={**params, "max_points": 100}).json()
+        self.assertEqual((hourly["resolution"], len(hourly["points"])), ("1h", 3))
+        self.assertEqual(hourly["points"][1]["data"]["temperature"],
+                         {"min": 60.0, "max": 119.0, "avg": 89.5, "count": 60, "last": 119.0})
+        self.assertNotIn("mode", hourly["points"][1]["data"])
+
+        minutes = client.get(f"/devices/{device_id}/telemetry",
+                             params={**params, "resolution": "1m", "max_points": 10}).json()
+        self.assertEqual((len(minutes["points"]), minutes["truncated"]), (10, True))
+        self.assertEqual(minutes["points"][0]["data"]["temperature"]["count"], 1)
+
+        bad = client.get(f"/devices/{device_id}/telemetry", params={"resolution": "5m"})
+        self.assertEqual(bad.status_code, 400, bad.text)
+        bad = client.get(f"/devices/{device_id}/telemetry",
+                         params={"from": "2030-06-01T00:00:00", "to": "2030-05-01T00:00:00"})
+        self.assertEqual(bad.status_code, 400, bad.text)
+
+    def test_telemetry_retention_compaction(self):
+        room_id = self._create_room(self._create_house()["id"])["id"]
+        camera_id = self._create_device(room_id, type="security camera", settings={})["id"]
+        light_id = self._create_device(room_id)["id"]
+        now = datetime(2030, 6, 1)
+        old = [{"ts": f"2030-05-0{day}T12:00:00", "data": {"motion": day}} for day in range(1, 6)]
+        recent = [{"ts": f"2030-05-31T0{hour}:00:00", "data": {"motion": hour}} for hour in range(6)]
+        for device_id in (camera_id, light_id):
+            client.post(f"/devices/{device_id}/telemetry", json=old + recent)
+
+        policies = {
+            DeviceType.SECURITY_CAMERA: RetentionPolicy(timedelta(days=7), timedelta(days=20), 4),
+            DeviceType.LIGHT: RetentionPolicy(timedelta(days=3650), timedelta(days=3650), 1000),
+        }
+        report = retention.compact(engine, policies, now=now, batch_size=2, pause=0)
+        self.assertEqual(report["raw_rows_deleted"], 5)  # The camera's old readings
+        self.assertEqual(report["capped_rows_deleted"], 2)  # Then its oldest recent ones, down to 4
+        self.assertEqual(report["rollup_rows_deleted"], 5 * 3)  # 1m/1h/1d buckets of May 1-5
+
+        def remaining(device_id):
+            return client.get(f"/devices/{device_id}/telemetry", params={
+                "from": "2030-05-01T00:00:00", "to": "2030-06-01T00:00:00", "resolution": "raw"
+            }).json()["points"]
+
+        self.assertEqual([p["data"]["motion"] for p in remaining(camera_id)], [2, 3, 4, 5])
+        self.assertEqual(len(remaining(light_id)), 11)
+
+    def test_ingest_telemetry_unknown_device(self):
+        resp = client.post(f"/devices/{uuid.uuid4()}/telemetry", json=[{"data": {"on": True}}])
+        self.assertEqual(resp.status_code, 404, resp.text)
+
+    # --------------------------
+    #  LIVE UPDATE ENDPOINTS
+    # --------------------------
+    def test_house_websocket_pushes_device_changes(self):
+        house_id = self._create_house()["id"]
+        room_id = self._create_room(house_id)["id"]
+        device_id = self._create_device(room_id)["id"]
+        other_room = self._create_room(self._create_house()["id"])["id"]
+        other_device = self._create_device(other_room)["id"]
+
+        with client.websocket_connect(f"/ws/houses/{house_id}") as ws:
+            update = {"type": "light", "name": "Hall Light", "room_id": room_id, "settings": {"brightness": 80}}
+            self.assertEqual(client.put(f"/devices/{device_id}", json=update).status_code, 200)
+            # Changes in other houses are not delivered
+            client.post(f"/devices/{other_device}/telemetry", json=[{"data": {"on": True}}])
+            client.post(f"/devices/{device_id}/telemetry", json=[{"data": {"brightness": 80, "on": True}}])
+
+            updated = ws.receive_json()
+            self.assertEqual((updated["event"], updated["device_id"]), ("device_updated", device_id))
+            self.assertEqual(updated["settings"], {"brightness": 80})
+            reading = ws.receive_json()
+            self.assertEqual((reading["event"], reading["device_id"]), ("telemetry", device_id))
+            self.assertEqual(reading["last_data"], {"brightness": 80, "on": True})
+
+    def test_house_websocket_unknown_house(self):
+        with self.assertRaises(WebSocketDisconnect) as ctx:
+            with client.websocket_connect(f"/ws/houses/{uuid.uuid4()}") as ws:
+                ws.receive_json()
+        self.assertEqual(ctx.exception.code, 4404)
+        self.assertEqual(client.get(f"/sse/houses/{uuid.uuid4()}").status_code, 404)
+
+    def test_pubsub_drops_oldest_for_slow_subscribers(self):
+        async def scenario():
+            broker = Broker(queue_size=2)
+            slow = broker.subscribe("house-1")
+            for n in range(5):
+                broker.publish("house-1", {"event": "telemetry", "n": n})
+            await asyncio.sleep(0)  # Let the call_soon_threadsafe deliveries run
+            received = [await slow.get(), await slow.get()]
+            broker.unsubscribe(slow)
+            return received, slow.dropped, broker.active
+
+        received, dropped, active = asyncio.run(scenario())
+        self.assertEqual([event["n"] for event in received], [3, 4])
+        self.assertEqual(dropped, 3)
+        self.assertFalse(active)
+
+    def test_sse_stream_frames(self):
+        async def scenario():
+            broker = Broker()
+            subscription = broker.subscribe("house-1")
+            stream = sse_stream(subscription, keepalive=0.01)
+            frames = [await stream.__anext__(), await stream.__anext__()]
+            broker.publish("house-1", {"event": "device_updated", "device_id": "d1"})
+            frames.append(await stream.__anext__())
+            await stream.aclose()
+            return frames
+
+        connected, keepalive, event = asyncio.run(scenario())
+        self.assertEqual((connected, keepalive), (": connected\n\n", ": keepalive\n\n"))
+        self.assertEqual(event, 'event: device_updated\ndata: {"event": "device_updated", "device_id": "d1"}\n\n')
+
+    # --------------------------
+    #  QUERY BUDGETS
+    # --------------------------
+    def test_query_budgets(self):
+        house_payload = {"name": "Budget House", "address": "2 Budget Way", "latitude": 42.0, "longitude": -71.0,
+                         "owner_ids": [str(uuid.uuid4())], "occupant_count": 1}
+        user_payload = {"name": "Budget User", "username": "budgetuser", "phone_number": "5550001111",
+                        "email": "budget@example.com", "privilege": "regular"}
+        self._assert_query_budget(1, "POST", "/users/", json=user_payload)  # INSERT ... RETURNING, no re-SELECT
+        house_id = self._assert_query_budget(3, "POST", "/houses/", json=house_payload).json()["id"]
+        self._assert_query_budget(1, "GET", f"/houses/{house_id}")
+        self._assert_query_budget(0, "GET", f"/houses/{house_id}")  # Served from the entity cache
+        room_payload = {"name": "Budget Room", "floor": 1, "size": 12.0, "house_id": house_id, "type": "bedroom"}
+        room_id = self._assert_query_budget(1, "POST", "/rooms/", json=room_payload).json()["id"]
+        device_payload = {"type": "light", "name": "Budget Light", "room_id": room_id, "settings": {}}
+        device_id = self._assert_query_budget(1, "POST", "/devices/", json=device_payload).json()["id"]
+        self._assert_query_budget(1, "GET", f"/devices/{device_id}")
+        self._assert_query_budget(1, "PUT", f"/devices/{device_id}", json=dict(device_payload, name="Renamed"))
+        self._assert_query_budget(1, "GET", f"/houses/{house_id}/rooms")
+        self._assert_query_budget(1, "GET", f"/rooms/{room_id}/devices")
+        self._assert_query_budget(2, "GET", f"/houses/{house_id}/stats")
+        self._assert_query_budget(1, "DELETE", f"/devices/{device_id}")
+
+    def test_debug_headers_off_by_default(self):
+        resp = client.get("/houses/")
+        self.assertNotIn("X-DB-Queries", resp.headers)
+
+    def test_repeated_statement_shapes_are_flagged(self):
+        stats = metrics.RequestStats({})
+        stats.queries = 25
+        stats.statements = {"SELECT * FROM rooms WHERE id = ?": 21, "SELECT * FROM houses WHERE id IN (?, ?)": 2,
+                            "SELECT * FROM houses WHERE id IN (?, ?, ?)": 2}
+        self.assertEqual(stats.repeated(20), {"SELECT * FROM rooms WHERE id = ?": 21})
+        self.assertEqual(stats.repeated(3), {"SELECT * FROM rooms WHERE id = ?": 21,
+                                             "SELECT * FROM houses WHERE id IN (?)": 4})
+
+        with self.assertLogs("shs_api.metrics", level="WARNING") as logs:
+            metrics.Metrics().record("/houses/{house_id}", "GET", 200, 0.01, stats, 0, 0)
+        self.assertIn("possible N+1", logs.output[0])
+
+    def test_slow_query_log(self):
+        house_id = self._create_house()["id"]
+        sink = slowlog.SlowQueryLog(threshold_ms=1e-6, sample_rate=1.0, max_per_minute=3)
+        with mock.patch.object(slowlog, "sink", sink), self.assertLogs("shs_api.slowlog", level="WARNING") as logs:
+            for _ in range(5):  # One SELECT each
+                cache.invalidate("house", house_id)
+                self.assertEqual(client.get(f"/houses/{house_id}").status_code, 200)
+            body = client.get("/diagnostics/slow-queries").json()
+
+        self.assertEqual(len(logs.output), 3)  # Rate limited to 3 a minute
+        self.assertEqual((body["logged"], body["suppressed"]), (3, 2))
+        entry = body["recent"][0]
+        self.assertEqual(entry["route"], "GET /houses/{house_id}")
+        self.assertTrue(entry["statement"].startswith("SELECT"))
+        self.assertEqual(entry["parameters"], ["str", "int", "int"])  # id, LIMIT, OFFSET
+        self.assertNotIn(house_id, json.dumps(entry))  # Values are never logged
+        self.assertTrue(any("houses" in line for line in entry["plan"]), entry["plan"])
+        self.assertEqual(json.loads(logs.output[0].split("Slow query: ", 1)[1])["plan"], entry["plan"])
+
+    def test_slow_query_plan_captured_once_per_shape(self):
+        sink = slowlog.SlowQueryLog(threshold_ms=1e-6, sample_rate=1.0, max_per_minute=100)
+        with mock.patch.object(slowlog, "sink", sink), self.assertLogs("shs_api.slowlog", level="WARNING"):
+            with engine.connect() as conn:
+                for ids in (["a"], ["b", "c"], ["d", "e", "f"]):
+                    conn.execute(models.House.__table__.select().where(models.House.id.in_(ids))).all()
+        shapes = [key for key in sink._plans if "FROM houses" in key]
+        self.assertEqual(len(shapes), 1)  # IN lists of any length share one plan
+        self.assertEqual(slowlog.parameter_shape([{"a": 1}, {"a": 2}], True), {"rows": 2, "types": {"a": "int"}})
+
+        disabled = slowlog.SlowQueryLog(threshold_ms=0)
+        self.assertEqual(disabled.threshold, float("inf"))
+
+    # --------------------------
+    #  DIAGNOSTICS ENDPOINTS
+    # --------------------------
+    def test_sqlite_diagnostics(self):
+        resp = client.get("/diagnostics/sqlite")
+        self.assertEqual(resp.status_code, 200, resp.text)
+        body = resp.json()
+        self.assertEqual(body["configured"], db_mod.ACTIVE_SQLITE_PRAGMAS)
+        self.assertIn("journal_mode", body["effective"])
+
+    def test_get_device_cache_hit_and_invalidation(self):
+        room_id = self._create_room(self._create_house()["id"])["id"]
+        device = self._create_device(room_id)
+
+        before = client.get("/diagnostics/cache").json()
+        self.assertEqual(client.get(f"/devices/{device['id']}").json()["name"], "Helper Light")
+        self.assertEqual(client.get(f"/devices/{device['id']}").json()["name"], "Helper Light")
+        after = client.get("/diagnostics/cache").json()
+        self.assertEqual(after["misses"] - before["misses"], 1)
+        self.assertEqual(after["hits"] - before["hits"], 1)
+
+        # Writes invalidate, so the next read sees the new row
+        update = {"type": "light", "name": "Renamed Light", "room_id": room_id, "settings": {}}
+        self.assertEqual(client.put(f"/devices/{device['id']}", json=update).status_code, 200)
+        self.assertEqual(client.get(f"/devices/{device['id']}").json()["name"], "Renamed Light")
+        self.assertEqual(client.delete(f"/devices/{device['id']}").status_code, 200)
+        self.assertEqual(client.get(f"/devices/{device['id']}").status_code, 404)
+
+    def test_metrics_exposition(self):
+        house = self._create_house()
+        self.assertEqual(client.get(f"/houses/{house['id']}").status_code, 200)
+        self.assertEqual(client.get("/no/such/route").status_code, 404)
+
+        resp = client.get("/metrics")
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.headers["content-type"].startswith("text/plain; version=0.0.4"))
+        lines = resp.text.splitlines()
+        labels = 'route="/houses/{house_id}",method="GET",status="200"'
+        count = next(line for line in lines if line.startswith(f"shs_http_request_duration_seconds_count{{{labels}}}"))
+        inf = next(line for line in lines
+                   if line.startswith(f'shs_http_request_duration_seconds_bucket{{{labels},le="+Inf"}}'))
+        self.assertGreaterEqual(int(count.split()[-1]), 1)
+        self.assertEqual(inf.split()[-1], count.split()[-1])  # Buckets are cumulative
+        self.assertTrue(any(line.startswith('shs_http_request_duration_seconds_count{route="<unmatched>"')
+                            for line in lines))
+        self.assertTrue(any(line.startswith('shs_http_request_bytes_total{route="/houses/",method="POST"')
+                            and int(line.split()[-1]) > 0 for line in lines))
+        queries = next(line for line in lines if line.startswith('shs_db_queries_total{route="/houses/",method="POST"'))
+        self.assertGreater(int(queries.split()[-1]), 0)  # The test engine is instrumented
+        self.assertIn("shs_http_requests_in_flight 1", lines)  # The scrape itself
+
+
+# ------------------------------------------------------------------
+#  SQLITE PRAGMA PROFILES (shs_api/database.py)
+# ------------------------------------------------------------------
+class TestSqlitePragmas(unittest.TestCase):
+    def test_production_profile_applied_on_connect(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            file_engine = create_engine(f"sqlite:///{os.path.join(tmpdir, 'pragmas.db')}")
+            db_mod.apply_sqlite_pragmas(file_engine, db_mod.sqlite_pragmas("production"))
+            with file_engine.connect() as conn:
+                self.assertEqual(conn.exec_driver_sql("PRAGMA journal_mode").scalar(), "wal")
+                self.assertEqual(conn.exec_driver_sql("PRAGMA synchronous").scalar(), 1)  # NORMAL
+                self.assertEqual(conn.exec_driver_sql("PRAGMA temp_store").scalar(), 2)  # MEMORY
+                self.assertEqual(conn.exec_driver_sql("PRAGMA busy_timeout").scalar(), 5000)
+            file_engine.dispose()
+
+    def test_pragma_overrides(self):
+        pragmas = db_mod.sqlite_pragmas("production", "cache_size=-1024; mmap_size=0")
+        self.assertEqual(pragmas["cache_size"], "-1024")
+        self.assertEqual(pragmas["mmap_size"], "0")
+        self.assertEqual(pragmas["journal_mode"], "WAL")
+        self.assertEqual(db_mod.sqlite_pragmas("default", ""), {})
+        with self.assertRaises(ValueError):
+            db_mod.sqlite_pragmas("turbo", "")
+
+
+# ------------------------------------------------------------------
+#  ENTITY CACHE (shs_api/cache.py)
+# ------------------------------------------------------------------
+class TestLRUTTLCache(unittest.TestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.cache = LRUTTLCache(max_entries=2, ttl_seconds=10, clock=lambda: self.now)
+
+    def test_evicts_least_recently_used(self):
+        self.cache.set("device:a", {"id": "a"})
+        self.cache.set("device:b", {"id": "b"})
+        self.cache.get("device:a")
+        self.cache.set("device:c", {"id": "c"})
+        self.assertIsNone(self.cache.get("device:b"))
+        self.assertEqual(self.cache.get("device:a"), {"id": "a"})
+        stats = self.cache.stats()
+        self.assertEqual((stats["entries"], stats["evictions"], stats["hits"], stats["misses"]), (2, 1, 2, 1))
+
+    def test_entries_expire_after_ttl(self):
+        self.cache.set("room:a", {"id": "a"})
+        self.now = 9.9
+        self.assertIsNotNone(self.cache.get("room:a"))
+        self.now = 10.0
+        self.assertIsNone(self.cache.get("room:a"))
+        self.assertEqual(self.cache.stats()["expirations"], 1)
+
+    def test_zero_capacity_disables_caching(self):
+        cache = LRUTTLCache(max_entries=0)
+        cache.set("user:a", {"id": "a"})
+        self.assertIsNone(cache.get("user:a"))
+
+
+# ------------------------------------------------------------------
+#  ASYNC MODE (shs_api/async_api.py)
+# ------------------------------------------------------------------
+class TestAsyncMode(unittest.TestCase):
+    """Runs the async CRUD router against a file-backed SQLite DB through aiosqlite."""
+
+    @classmethod
+    def setUpClass(cls):
+        from fastapi import FastAPI
+        from sqlalchemy.pool import NullPool
+        from shs_api import async_api, migrations
+        from shs_api.database import make_async_engine, make_async_sessionmaker
+
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        url = f"sqlite:///{os.path.join(cls.tmpdir.name, 'async.db')}"
+        cls.sync_engine = create_engine(url)
+        migrations.upgrade(cls.sync_engine)
+        # NullPool: TestClient may run each request on a fresh event loop
+        cls.async_engine = make_async_engine(url, poolclass=NullPool)
+        session_factory = make_async_sessionmaker(cls.async_engine)
+
+        async def override_get_async_db():
+            async with session_factory() as db:
+                yield db
+
+        async_app = FastAPI()
+
+        @async_app.get("/users/{user_id}")
+        def sync_get_user(user_id: str):
+            return {"served_by": "sync"}
+
+        async_api.install(async_app)
+        async_app.dependency_overrides[async_api.get_async_db] = override_get_async_db
+        cls.client = TestClient(async_app)
+
+    @classmethod
+    def tearDownClass(cls):
+        asyncio.run(cls.async_engine.dispose())
+        cls.sync_engine.dispose()
+        cls.tmpdir.cleanup()
+
+    def test_async_device_crud(self):
+        house = self.client.post("/houses/", json={
+            "name": "Async House",
+            "address": "1 Await Ave",
+            "latitude": 1.0,
+            "longitude": 2.0,
+            "owner_ids": [str(uuid.uuid4())],
+            "occupant_count": 1
+        })
+        self.assertEqual(house.status_code, 200, house.text)
+        room = self.client.post("/rooms/", json={
+            "name": "Async Room", "floor": 1, "size": 10.0, "house_id": house.json()["id"], "type": "kitchen"
+        })
+        self.assertEqual(room.status_code, 200, room.text)
+        device = self.client.post("/devices/", json={
+            "type": "light", "name": "Async Light", "room_id": room.json()["id"], "settings": {"brightness": 1}
+        })
+        self.assertEqual(device.status_code, 200, device.text)
+        device_id = device.json()["id"]
+
+        update = self.client.put(f"/devices/{device_id}", json={
+            "type": "light", "name": "Async Light 2", "room_id": room.json()["id"], "settings": {"brightness": 2}
+        })
+        self.assertEqual(update.status_code, 200, update.text)
+        self.assertEqual(update.json()["settings"], {"brightness": 2})
+        self.assertEqual(update.json()["version"], 2)
+        stale = self.client.put(f"/devices/{device_id}", headers={"If-Match": device.headers.get("ETag", '"1"')},
+                                json={"type": "light", "name": "Lost", "room_id": room.json()["id"]})
+        self.assertEqual(stale.status_code, 412, stale.text)
+        resp = self.client.get(f"/devices/{device_id}", headers={"If-None-Match": update.headers["ETag"]})
+        self.assertEqual(resp.status_code, 304)
+
+        page = self.client.get("/devices/", params={"limit": 10})
+        self.assertEqual(page.status_code, 200, page.text)
+        self.assertIn(device_id, [d["id"] for d in page.json()["items"]])
+
+        self.assertEqual(self.client.delete(f"/devices/{device_id}").status_code, 200)
+        self.assertEqual(self.client.get(f"/devices/{device_id}").status_code, 404)
+
+    def test_install_replaces_sync_routes(self):
+        resp = self.client.get(f"/users/{uuid.uuid4()}")
+        self.assertEqual(resp.status_code, 404, resp.text)
+        self.assertEqual(resp.json()["detail"], "User not found")
+
 
 # ------------------------------------------------------------------
 #  RUN TESTS